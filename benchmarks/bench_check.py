@@ -0,0 +1,234 @@
+"""Runs the whole regular vacancies check offline and measures it: the real main.py,
+db.py and utils.py code against a fake bot, a synthetic hh.ru (see fixture_server.py)
+and a local database.
+
+Usage: python benchmarks/bench_check.py [--users N] [--jobs N] [--results N] [--cycles N]
+                                        [--backend mysql --mysql-user USER ...]
+
+By default, the database is an SQLite file in a temporary directory, along with everything
+else the bot writes (the log, the FSM file). With --backend mysql, the benchmark works in
+its own database (jobmonitoringbot_bench by default), which is created if it doesn't exist
+and emptied before the run, so never point it at the bot's one.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+sys.path.insert(0, benchmarks_dir)
+
+from fixture_server import FixtureServer
+
+bench_config = """[telegram]
+token = 123456789:benchmark
+admin_id = 0
+
+[database]
+backend = {args.backend}
+
+[sqlite]
+path = bench.sqlite3
+
+[mysql]
+host = {args.mysql_host}
+port = {args.mysql_port}
+user = {args.mysql_user}
+password = {args.mysql_password}
+database = {args.database}
+pool_size = {args.workers}
+
+[parser]
+engine = http
+base_url = {base_url}
+# The cycles are 6 hours apart, so the pages are downloaded anew every cycle.
+http_cache_path =
+
+[scheduler]
+workers = {args.workers}
+
+[fsm]
+path = fsm.sqlite3
+"""
+
+
+class FakeBot:
+    """Records the messages instead of sending them, taking latency seconds per message."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent_count = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent_count += 1
+
+
+class CountingCursor:
+    def __init__(self, cursor, counters):
+        self._cursor = cursor
+        self._counters = counters
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, *args, **kwargs):
+        self._counters['queries'] += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._counters['queries'] += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+
+class CountingConnection:
+    """Wraps a DB connection and counts its round trips: queries and commits."""
+
+    def __init__(self, connection, counters):
+        self._connection = connection
+        self._counters = counters
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(self._connection.cursor(*args, **kwargs), self._counters)
+
+    def commit(self):
+        self._counters['commits'] += 1
+        return self._connection.commit()
+
+
+def create_database(args):
+    from mysql.connector import connect
+    connection = connect(host=args.mysql_host, port=args.mysql_port,
+                         user=args.mysql_user, password=args.mysql_password)
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`;")
+    connection.close()
+
+
+async def prepare(args, db, db_async, jobs_lists=None):
+    """Empties the benchmark's tables and creates the users along with their jobs:
+    the ones from jobs_lists (one list per user) if it is given, or args.jobs job names
+    out of args.phrases ones otherwise.
+    """
+    await db_async.create_tables()
+    with db.pool.connection() as connection:
+        with connection.cursor() as cursor:
+            for table in db.tables_create_queries:
+                cursor.execute(f"DELETE FROM `{table}`;")
+            connection.commit()
+    phrases = args.phrases or args.users * args.jobs
+    for user_number in range(args.users):
+        telegram_id = str(1000000 + user_number)
+        with db.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO `users` (`telegram_id`, `telegram_name`) "
+                               "VALUES (%s, %s);", (telegram_id, f'user{user_number}'))
+                connection.commit()
+        if jobs_lists is None:
+            jobs_list = [f'job {(user_number * args.jobs + job_number) % phrases}'
+                         for job_number in range(args.jobs)]
+        else:
+            jobs_list = jobs_lists[user_number]
+        await db_async.add_jobs_or_stops('jobs', telegram_id, jobs_list)
+        await db_async.add_jobs_or_stops('stops', telegram_id, ['java'])
+
+
+async def run(args, server):
+    import db
+    import db_async
+    import main
+    import sender
+    import utils
+
+    counters = {'queries': 0, 'commits': 0}
+    connect_function = db.pool.connect_function
+    db.pool.connect_function = lambda: CountingConnection(connect_function(), counters)
+    await prepare(args, db, db_async)
+
+    bot = FakeBot(args.send_latency)
+    if args.rate_limited:
+        main.outbox.bot = bot
+    else:
+        main.outbox = sender.MessageScheduler(bot, global_rate=10 ** 6, chat_rate=10 ** 6,
+                                              chat_burst=10 ** 6)
+
+    print(f'{args.users} users, {args.jobs} jobs each, {args.results} results per job name, '
+          f'{args.workers} workers')
+    print(f'{"cycle":>5} {"time, s":>9} {"messages":>9} {"pages":>7} {"queries":>8} '
+          f'{"commits":>8} {"py peak, MB":>12}')
+    for cycle in range(1, args.cycles + 1):
+        # The cycles are 6 hours apart, so the scrapes of the previous one are stale.
+        utils.scrape_cache.clear()
+        sent_count, request_count = bot.sent_count, server.request_count
+        counters.update(queries=0, commits=0)
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        await main.regular_vacancies_check()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        print(f'{cycle:>5} {elapsed:>9.2f} {bot.sent_count - sent_count:>9} '
+              f'{server.request_count - request_count:>7} {counters["queries"]:>8} '
+              f'{counters["commits"]:>8} {peak:>12.1f}')
+    print(f'Peak RSS of the process: '
+          f'{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB')
+
+    await main.outbox.close()
+    db_async.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--jobs', type=int, default=2, help='job names per user')
+    parser.add_argument('--phrases', type=int, default=0,
+                        help='distinct job names for all the users (all distinct by default)')
+    parser.add_argument('--results', type=int, default=60, help='vacancies per job name')
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--cycles', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--send-latency', type=float, default=0.0,
+                        help='seconds the fake bot takes per message')
+    parser.add_argument('--rate-limited', action='store_true',
+                        help="keep the outbox's Telegram rate limits")
+    parser.add_argument('--backend', choices=['sqlite', 'mysql'], default='sqlite')
+    parser.add_argument('--mysql-host', default='127.0.0.1')
+    parser.add_argument('--mysql-port', type=int, default=3306)
+    parser.add_argument('--mysql-user', default=os.environ.get('MYSQL_USER', 'root'))
+    parser.add_argument('--mysql-password', default=os.environ.get('MYSQL_PASSWORD', ''))
+    parser.add_argument('--database', default='jobmonitoringbot_bench')
+    args = parser.parse_args()
+
+    server = FixtureServer(synthetic_results=args.results, per_page=args.per_page).start()
+    work_dir = tempfile.mkdtemp(prefix='bench_check_')
+    # The bot's modules read config.ini from the current directory when they are imported.
+    with open(os.path.join(work_dir, 'config.ini'), 'w', encoding='utf-8') as file:
+        file.write(bench_config.format(args=args, base_url=server.base_url))
+    os.chdir(work_dir)
+    try:
+        if args.backend == 'mysql':
+            create_database(args)
+        tracemalloc.start()
+        asyncio.run(run(args, server))
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Compares the two check modes offline: a scrape per user (regular_vacancies_check)
+and a scrape per distinct job name (shared_crawl), with the same synthetic users
+and a growing number of the distinct job names they pick from.
+
+Usage: python benchmarks/bench_crawl.py [--users N] [--jobs N] [--phrases N N ...]
+
+Every user picks --jobs job names at random out of --phrases ones. With few distinct
+job names, the users' queries overlap and the shared crawl scrapes far less. As the number
+of the distinct job names grows past the number of the pages the users' own queries take,
+a scrape per user becomes cheaper: a user's query covers all the user's job names
+in the same pages, while the shared crawl takes at least a page per job name.
+The last column shows which mode has scraped fewer pages.
+
+By default, a job name finds fewer vacancies than a page holds, like the searches
+narrowed to the time since the last check usually do.
+
+Like bench_check.py, the benchmark works in a temporary directory with an SQLite database.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+sys.path.insert(0, benchmarks_dir)
+
+import bench_check
+from fixture_server import FixtureServer
+
+
+async def measure(check, bot, server):
+    """Runs a single check cycle and returns the seconds, the messages and the pages it took."""
+    sent_count, request_count = bot.sent_count, server.request_count
+    started = time.perf_counter()
+    await check()
+    return (time.perf_counter() - started, bot.sent_count - sent_count,
+            server.request_count - request_count)
+
+
+async def run(args, server):
+    import db
+    import db_async
+    import main
+    import sender
+    import utils
+
+    bot = bench_check.FakeBot()
+    main.outbox = sender.MessageScheduler(bot, global_rate=10 ** 6, chat_rate=10 ** 6,
+                                          chat_burst=10 ** 6)
+    print(f'{args.users} users, {args.jobs} job names each, {args.results} results '
+          f'per job name, {args.per_page} per page')
+    print(f'{"job names":>9} {"queries":>8} | {"per user: s":>11} {"pages":>6} {"messages":>8} | '
+          f'{"shared: s":>9} {"pages":>6} {"messages":>8} | fewer pages')
+    for phrases in args.phrases:
+        rng = random.Random(phrases)
+        jobs_lists = [[f'job {number}'
+                       for number in rng.sample(range(phrases), min(args.jobs, phrases))]
+                      for _ in range(args.users)]
+        queries = len({tuple(sorted(jobs_list)) for jobs_list in jobs_lists})
+        results = []
+        for check in (main.regular_vacancies_check, main.shared_crawl):
+            # Both modes start from scratch: no stored vacancies, watermarks or cached scrapes.
+            await bench_check.prepare(args, db, db_async, jobs_lists)
+            utils.scrape_cache.clear()
+            results.append(await measure(check, bot, server))
+        (per_user_seconds, per_user_messages, per_user_pages), \
+            (shared_seconds, shared_messages, shared_pages) = results
+        print(f'{phrases:>9} {queries:>8} | {per_user_seconds:>11.2f} {per_user_pages:>6} '
+              f'{per_user_messages:>8} | {shared_seconds:>9.2f} {shared_pages:>6} '
+              f'{shared_messages:>8} | {"per user" if per_user_pages < shared_pages else "shared"}')
+
+    await main.outbox.close()
+    db_async.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--jobs', type=int, default=3, help='job names per user')
+    parser.add_argument('--phrases', type=int, nargs='+',
+                        default=[5, 10, 25, 50, 100, 200, 400],
+                        help='distinct job names the users pick from')
+    parser.add_argument('--results', type=int, default=10, help='vacancies per job name')
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    # The settings bench_check.py's config.ini needs.
+    args.backend = 'sqlite'
+    args.mysql_host, args.mysql_port, args.mysql_user, args.mysql_password = \
+        '127.0.0.1', 3306, '', ''
+    args.database = 'jobmonitoringbot_bench'
+
+    server = FixtureServer(synthetic_results=args.results, per_page=args.per_page).start()
+    work_dir = tempfile.mkdtemp(prefix='bench_crawl_')
+    # The bot's modules read config.ini from the current directory when they are imported.
+    with open(os.path.join(work_dir, 'config.ini'), 'w', encoding='utf-8') as file:
+        file.write(bench_check.bench_config.format(args=args, base_url=server.base_url))
+    os.chdir(work_dir)
+    try:
+        asyncio.run(run(args, server))
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Measures what running the blocking DB calls in the DB thread pool (see db_async.py) gives:
+--calls concurrent awaits of a slow DB call through db_async, against the same calls made
+one after another right on the event loop, the way the handlers made them before.
+
+Usage: python benchmarks/bench_db_async.py [--calls N] [--latency MS] [--pool-size N]
+
+Every query takes --latency milliseconds more than it does on the local SQLite file,
+like a round trip to a remote MySQL server does. Alongside the total time, the benchmark
+shows the longest the event loop has been blocked for: a ticker task which should wake up
+every millisecond records how late it wakes up, which is how long the bot's other updates
+would wait meanwhile.
+
+Like bench_check.py, the benchmark works in a temporary directory with an SQLite database.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+sys.path.insert(0, benchmarks_dir)
+
+import bench_check
+
+
+class SlowCursor(bench_check.CountingCursor):
+    def __init__(self, cursor, latency):
+        super().__init__(cursor, {'queries': 0, 'commits': 0})
+        self._latency = latency
+
+    def execute(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return super().execute(*args, **kwargs)
+
+
+class SlowConnection(bench_check.CountingConnection):
+    """Wraps a DB connection and makes every query take latency seconds longer."""
+
+    def __init__(self, connection, latency):
+        super().__init__(connection, {'queries': 0, 'commits': 0})
+        self._latency = latency
+
+    def cursor(self, *args, **kwargs):
+        return SlowCursor(self._connection.cursor(*args, **kwargs), self._latency)
+
+
+async def measure(calls):
+    """Runs the coroutine function calls and returns the seconds it took and the longest
+    the event loop has been blocked for meanwhile, in seconds."""
+    max_lag = 0.0
+    running = True
+
+    async def tick():
+        nonlocal max_lag
+        while running:
+            scheduled = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_lag = max(max_lag, time.perf_counter() - scheduled - 0.001)
+
+    ticker = asyncio.create_task(tick())
+    # Letting the ticker start before the calls.
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await calls()
+    elapsed = time.perf_counter() - started
+    running = False
+    await ticker
+    return elapsed, max_lag
+
+
+async def run(args):
+    import db
+    import db_async
+
+    latency = args.latency / 1000
+    connect_function = db.pool.connect_function
+    db.pool.connect_function = lambda: SlowConnection(connect_function(), latency)
+    await bench_check.prepare(args, db, db_async)
+
+    async def serialized():
+        for _ in range(args.calls):
+            db.get_users()
+
+    async def concurrent():
+        await asyncio.gather(*(db_async.get_users() for _ in range(args.calls)))
+
+    # Warming up: the pool's connections are created by the first calls.
+    await concurrent()
+    print(f'{args.calls} calls of get_users, {args.latency} ms of latency per query, '
+          f'{args.pool_size} connections in the pool')
+    print(f'{"calls":<24} {"total, ms":>10} {"per call, ms":>13} {"max loop lag, ms":>17}')
+    results = dict()
+    for name, calls in (('on the event loop', serialized), ('through db_async', concurrent)):
+        elapsed, max_lag = await measure(calls)
+        results[name] = elapsed
+        print(f'{name:<24} {elapsed * 1000:>10.1f} {elapsed / args.calls * 1000:>13.2f} '
+              f'{max_lag * 1000:>17.1f}')
+    print(f'Speed-up: {results["on the event loop"] / results["through db_async"]:.1f}x')
+
+    db_async.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=20, help='milliseconds per query')
+    parser.add_argument('--pool-size', type=int, default=5)
+    args = parser.parse_args()
+    # The settings bench_check.py's config.ini and prepare() need.
+    args.backend = 'sqlite'
+    args.mysql_host, args.mysql_port, args.mysql_user, args.mysql_password = \
+        '127.0.0.1', 3306, '', ''
+    args.database = 'jobmonitoringbot_bench'
+    args.workers = args.pool_size
+    args.users, args.jobs, args.phrases = 10, 1, 0
+
+    work_dir = tempfile.mkdtemp(prefix='bench_db_async_')
+    # The bot's modules read config.ini from the current directory when they are imported.
+    with open(os.path.join(work_dir, 'config.ini'), 'w', encoding='utf-8') as file:
+        file.write(bench_check.bench_config.format(args=args, base_url='http://127.0.0.1:1'))
+    os.chdir(work_dir)
+    try:
+        asyncio.run(run(args))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
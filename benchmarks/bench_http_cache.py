@@ -0,0 +1,76 @@
+"""Measures the traffic the HTTP cache (see http_cache.py) saves, against the synthetic
+hh.ru of fixture_server.py, which counts the requests and the bytes it sends.
+
+Usage: python benchmarks/bench_http_cache.py [--queries N] [--results N]
+
+Every scenario scrapes the same --queries queries twice: the first pass fills the cache,
+and the second one is measured.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+from fixture_server import FixtureServer
+from http_cache import HTTPCache
+
+
+def scrape(jobs_lists):
+    for jobs_list in jobs_lists:
+        utils.hh_http_parser(jobs_list, [])
+
+
+def run_scenario(name, jobs_lists, results, cache_dir, validators=True, ttl=300,
+                 max_size=64 * 1024 * 1024, cached=True):
+    server = FixtureServer(synthetic_results=results, validators=validators).start()
+    utils.hh_base_url = server.base_url
+    utils.http_cache = HTTPCache(os.path.join(cache_dir, f'{name}.sqlite3'), ttl=ttl,
+                                 max_size=max_size) if cached else None
+    try:
+        scrape(jobs_lists)
+        request_count, not_modified_count, bytes_sent = \
+            server.request_count, server.not_modified_count, server.bytes_sent
+        started = time.perf_counter()
+        scrape(jobs_lists)
+        elapsed = time.perf_counter() - started
+        evictions = utils.http_cache.get_stats()['evictions'] if cached else 0
+        print(f'{name:<34} {server.request_count - request_count:>8} '
+              f'{server.not_modified_count - not_modified_count:>5} '
+              f'{(server.bytes_sent - bytes_sent) / 1024:>9.1f} {elapsed * 1000:>8.1f} '
+              f'{evictions:>9}')
+    finally:
+        if utils.http_cache is not None:
+            utils.http_cache.close()
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--results', type=int, default=60, help='vacancies per job name')
+    args = parser.parse_args()
+
+    jobs_lists = [[f'job {number}'] for number in range(args.queries)]
+    cache_dir = tempfile.mkdtemp(prefix='bench_http_cache_')
+    print(f'{args.queries} queries, {args.results} vacancies each; the second pass:')
+    print(f'{"scenario":<34} {"requests":>8} {"304":>5} {"body, KB":>9} {"time, ms":>8} '
+          f'{"evictions":>9}')
+    try:
+        run_scenario('no cache', jobs_lists, args.results, cache_dir, cached=False)
+        run_scenario('fresh', jobs_lists, args.results, cache_dir)
+        run_scenario('stale, revalidated', jobs_lists, args.results, cache_dir, ttl=0)
+        run_scenario('stale, no validators', jobs_lists, args.results, cache_dir,
+                     validators=False, ttl=0)
+        run_scenario('fresh, 16 KB size cap', jobs_lists, args.results, cache_dir,
+                     max_size=16 * 1024)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Compares the Selenium and the HTTP engines of the hh.ru parser offline,
+against the saved pages in benchmarks/fixtures.
+
+Usage: python benchmarks/bench_parsers.py [--runs N] [--latency SECONDS]
+
+The Selenium engine needs Chrome; if it can't be started, it is skipped.
+
+The last part scrapes a query of 10 pages from a synthetic hh.ru which takes --latency
+seconds per response, with the pages after the first one fetched 1 to 9 at a time.
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+from fixture_server import FixtureServer, fixtures_dir
+
+
+def bench(function, runs):
+    timings = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return timings, result
+
+
+def report(name, timings, result=None):
+    line = f'{name:<32} median {statistics.median(timings) * 1000:9.2f} ms, ' \
+           f'min {min(timings) * 1000:9.2f} ms'
+    if result is not None:
+        vacancies_dict, vacancies_count = result
+        line += f', {len(vacancies_dict)} of {vacancies_count} vacancies'
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.1)
+    args = parser.parse_args()
+
+    # Parsing alone, without any network.
+    pages = []
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        if file_name.startswith('results_'):
+            with open(os.path.join(fixtures_dir, file_name), 'rb') as file:
+                pages.append(file.read())
+    timings, _ = bench(lambda: [utils.parse_results_page(page, 'http://127.0.0.1/')
+                                for page in pages], args.runs * 10)
+    report(f'lxml parse ({len(pages)} pages)', timings)
+
+    server = FixtureServer().start()
+    utils.hh_base_url = server.base_url
+    jobs_list, stops_list = ['python developer'], ['Java', 'C++']
+    try:
+        timings, result = bench(lambda: utils.hh_http_parser(jobs_list, stops_list), args.runs)
+        report('http engine', timings, result)
+        try:
+            timings, result = bench(lambda: utils.hh_parser(jobs_list, stops_list), args.runs)
+            report('selenium engine', timings, result)
+        except Exception as e:
+            print(f'selenium engine                  skipped: {e.__class__.__name__}: {e}')
+    finally:
+        server.stop()
+
+    # A query of 10 pages (fewer vacancies than max_vacancies_count) over a slow network.
+    server = FixtureServer(synthetic_results=utils.max_vacancies_count - 1, per_page=20,
+                           latency=args.latency).start()
+    utils.hh_base_url = server.base_url
+    try:
+        for page_fan_out in (1, 3, 5, 9):
+            utils.page_fan_out = page_fan_out
+            utils.page_executor = ThreadPoolExecutor(max_workers=page_fan_out)
+            timings, result = bench(lambda: utils.hh_http_parser(['python developer'], []),
+                                    max(args.runs // 5, 1))
+            report(f'http engine, 10 pages, fan-out {page_fan_out}', timings, result)
+            utils.page_executor.shutdown()
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Measures the local stop-word filter (see stop_words.py) with stop lists of 10 to 10,000
+words, against the straightforward ways of doing the same: a regular expression with
+all the words as alternatives, and checking the words one by one.
+
+Usage: python benchmarks/bench_stop_words.py [--titles N] [--sizes 10 100 1000 10000]
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stop_words
+
+title_words = ['python', 'developer', 'разработчик', 'senior', 'junior', 'middle', 'backend',
+               'инженер', 'программист', 'django', 'data', 'engineer', 'аналитик', 'lead',
+               'ведущий', 'старший', 'fastapi', 'ml', 'qa', 'devops', 'в', 'команду', 'продукта']
+
+
+def random_word(rng):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyzабвгдежзиклмнопрстуфхцчшэюя')
+                   for _ in range(rng.randint(3, 10)))
+
+
+def make_titles(count, rng):
+    return [' '.join(rng.choice(title_words) for _ in range(rng.randint(2, 7)))
+            for _ in range(count)]
+
+
+def make_stops(count, rng):
+    # A couple of the words actually occur in the titles; the rest are random.
+    return ['devops', 'qa'] + [random_word(rng) for _ in range(count - 2)]
+
+
+def bench(function, runs):
+    timings = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def filter_by_regex(titles, stops_list):
+    pattern = re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(stop_word.lower())
+                                                  for stop_word in stops_list) + r')(?!\w)')
+    return [title for title in titles if pattern.search(title.lower()) is None]
+
+
+def filter_one_by_one(titles, stops_list):
+    lowered_stops = [stop_word.lower() for stop_word in stops_list]
+    return [title for title in titles
+            if not any(stop_word in title.lower().split() for stop_word in lowered_stops)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--titles', type=int, default=10000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    titles = make_titles(args.titles, rng)
+    vacancies_dict = {title: f'https://hh.ru/vacancy/{number}'
+                      for number, title in enumerate(titles)}
+    print(f'{len(titles)} titles')
+    print(f'{"stop words":>10} {"compile, ms":>12} {"matcher, us/title":>18} '
+          f'{"regex, us/title":>16} {"one by one, us/title":>21} {"kept":>6}')
+    for size in args.sizes:
+        stops_list = make_stops(size, rng)
+        compile_seconds, matcher = bench(lambda: stop_words.StopWordsMatcher(stops_list), 1)
+        matcher_seconds, kept = bench(lambda: [title for title in titles
+                                               if matcher.find(title) is None], args.runs)
+        regex_seconds, regex_kept = bench(lambda: filter_by_regex(titles, stops_list), args.runs)
+        # Checking the words one by one is too slow for the long lists to be run repeatedly.
+        one_by_one_seconds, _ = bench(lambda: filter_one_by_one(titles, stops_list),
+                                      args.runs if size <= 1000 else 1)
+        assert len(kept) == len(regex_kept)
+        print(f'{size:>10} {compile_seconds * 1000:>12.2f} '
+              f'{matcher_seconds / len(titles) * 10 ** 6:>18.2f} '
+              f'{regex_seconds / len(titles) * 10 ** 6:>16.2f} '
+              f'{one_by_one_seconds / len(titles) * 10 ** 6:>21.2f} {len(kept):>6}')
+
+    # The cached path the bot takes: the matcher is compiled on the first call only.
+    stops_list = make_stops(args.sizes[-1], rng)
+    first_seconds, _ = bench(lambda: stop_words.filter_vacancies(vacancies_dict, stops_list), 1)
+    cached_seconds, _ = bench(lambda: stop_words.filter_vacancies(vacancies_dict, stops_list),
+                              args.runs)
+    print(f'filter_vacancies with {len(stops_list)} stop words: first call '
+          f'{first_seconds * 1000:.1f} ms, cached {cached_seconds * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
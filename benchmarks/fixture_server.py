@@ -0,0 +1,188 @@
+"""A local stand-in for hh.ru which serves the saved pages from benchmarks/fixtures.
+
+/search/vacancy/advanced is served from advanced.html, and /search/vacancy?...&page=N
+from results_N.html (the page parameter defaults to 0). The server counts the requests
+it has received and the bytes of the bodies it has sent, so the benchmarks can tell
+how much traffic a scrape costs.
+
+With latency set, every response is delayed by that many seconds, like over a network.
+
+With validators set, the pages are sent with an ETag and a Last-Modified header,
+and the conditional requests for the unchanged pages are answered with 304 Not Modified.
+
+With synthetic_results set, the result pages are generated instead: every job name
+gets its own synthetic_results vacancies (with ids derived from the job name), and
+a search text like '"job 1" OR "job 2"' finds the vacancies of all its job names,
+split into pages of per_page vacancies.
+"""
+import html
+import email.utils
+import os
+import re
+import time
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+results_page_template = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+  <meta charset="utf-8">
+  <title>{title}</title>
+</head>
+<body class="s-friendly">
+  <main class="HH-MainContent">
+    <div class="bloko-columns-row">
+      <div data-qa="vacancies-search-header">
+        <h1 data-qa="bloko-header-3" class="bloko-header-section-3">Найдено {count} вакансий</h1>
+      </div>
+      <div id="a11y-search-results" data-qa="vacancy-serp__results">
+{items}
+      </div>
+      <div class="pager" data-qa="pager-block">
+{pager}
+      </div>
+    </div>
+  </main>
+</body>
+</html>
+"""
+
+vacancy_template = """        <div class="serp-item" \
+data-qa="vacancy-serp__vacancy vacancy-serp__vacancy_standard">
+          <h3 data-qa="bloko-header-3" class="bloko-header-section-3">
+            <a class="serp-item__title" data-qa="serp-item__title" target="_blank" \
+href="https://spb.hh.ru/vacancy/{vacancy_id}?query=python&amp;hhtmFrom=vacancy_search_list">\
+{name}</a>
+          </h3>
+          <div class="g-user-content">
+            <div data-qa="vacancy-serp__vacancy_snippet_responsibility" class="bloko-text">\
+Разработка и поддержка сервисов на Python. Участие в код-ревью.</div>
+          </div>
+        </div>"""
+
+pager_next_template = """        <a class="bloko-button" data-qa="pager-next" \
+href="/search/vacancy?{query}"><span>дальше</span></a>"""
+
+
+def render_results_page(text, page, results, per_page):
+    """Generates a page with search results for the search text.
+
+    :param text: the search text
+    :type text: str
+    :param page: the number of the page, starting with 0
+    :type page: int
+    :param results: the number of vacancies found by every job name of the search text
+    :type results: int
+    :param per_page: the number of vacancies on a page
+    :type per_page: int
+
+    :return: the HTML code of the page
+    :rtype: bytes
+    """
+    # Every job name has its own range of ids, so the users with different job names
+    # don't get the same vacancies, and the ones with the same job name do.
+    vacancies = []
+    for job_name in re.findall(r'"([^"]*)"', text) or [text]:
+        first_id = 10000000 + zlib.crc32(job_name.encode('utf-8')) % 8000 * 10000
+        vacancies.extend((first_id + number, f'{job_name} #{number + 1}')
+                         for number in range(results))
+    items = '\n'.join(vacancy_template.format(vacancy_id=vacancy_id, name=html.escape(name))
+                      for vacancy_id, name in vacancies[page * per_page:(page + 1) * per_page])
+    pager = ''
+    if (page + 1) * per_page < len(vacancies):
+        pager = pager_next_template.format(
+            query=html.escape(urlencode({'text': text, 'page': page + 1})))
+    return results_page_template.format(title=html.escape(text), count=len(vacancies),
+                                        items=items, pager=pager).encode('utf-8')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        with self.server.lock:
+            self.server.request_count += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if url.path == '/search/vacancy' and self.server.synthetic_results is not None:
+            self.send_body(render_results_page(query.get('text', [''])[0],
+                                               int(query.get('page', ['0'])[0]),
+                                               self.server.synthetic_results,
+                                               self.server.per_page))
+            return
+        if url.path == '/search/vacancy/advanced':
+            file_name = 'advanced.html'
+        elif url.path == '/search/vacancy':
+            file_name = f'results_{query.get("page", ["0"])[0]}.html'
+        else:
+            file_name = None
+
+        file_path = os.path.join(fixtures_dir, file_name) if file_name else None
+        if file_path is None or not os.path.exists(file_path):
+            self.send_error(404)
+            return
+        with open(file_path, 'rb') as file:
+            self.send_body(file.read())
+
+    def send_body(self, body):
+        if self.server.validators:
+            etag = f'"{zlib.crc32(body):08x}"'
+            last_modified = email.utils.formatdate(self.server.started_at, usegmt=True)
+            if_none_match = self.headers.get('If-None-Match')
+            if_modified_since = self.headers.get('If-Modified-Since')
+            if if_none_match == etag or (if_none_match is None
+                                         and if_modified_since == last_modified):
+                with self.server.lock:
+                    self.server.not_modified_count += 1
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler_class=FixtureHandler, synthetic_results=None, per_page=20,
+                 validators=False, latency=0.0):
+        super().__init__(('127.0.0.1', 0), handler_class)
+        self.synthetic_results = synthetic_results
+        self.per_page = per_page
+        self.validators = validators
+        self.latency = latency
+        self.started_at = time.time()
+        self.request_count = 0
+        self.not_modified_count = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
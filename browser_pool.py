@@ -0,0 +1,265 @@
+import contextlib
+import logging
+import queue
+import threading
+import time
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service as ChromeService
+from webdriver_manager.chrome import ChromeDriverManager
+import metrics
+
+# psutil is only needed for the memory limit and for reaping the orphaned drivers;
+# without it, the instances are recycled by the number of jobs only.
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logging.basicConfig(level=logging.INFO,
+                    filename="jobmonitoringbot.log",
+                    filemode="a",
+                    format="%(asctime)s %(levelname)s %(message)s")
+
+
+class PooledBrowser:
+    """A headless Chrome instance along with its bookkeeping."""
+
+    def __init__(self, browser, launch_time):
+        self.browser = browser
+        self.launch_time = launch_time
+        self.jobs = 0
+
+    @property
+    def driver_pid(self):
+        return self.browser.service.process.pid
+
+    def get_rss(self):
+        """Returns the resident memory of the driver and all the browser processes, in MB.
+
+        :return: the memory in MB, or None if psutil is not installed
+        :rtype: float or None
+        """
+        if psutil is None:
+            return None
+        try:
+            driver = psutil.Process(self.driver_pid)
+            processes = [driver] + driver.children(recursive=True)
+        except psutil.Error:
+            return None
+        rss = 0
+        for process in processes:
+            try:
+                rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+        return rss / 1024 / 1024
+
+
+class BrowserPool:
+    """A pool of warm headless Chrome instances shared by the scrapes.
+
+    The driver is resolved once, when the pool is started. The instances are handed out
+    with clean state and recycled after max_jobs scrapes or once their memory exceeds max_rss.
+    """
+
+    def __init__(self, size=2, max_jobs=50, max_rss=1024, checkout_timeout=300):
+        """
+        :param size: the maximum number of browser instances
+        :type size: int
+        :param max_jobs: the number of scrapes an instance is recycled after
+        :type max_jobs: int
+        :param max_rss: the memory (in MB) an instance is recycled after
+        :type max_rss: int or float
+        :param checkout_timeout: the number of seconds to wait for a free instance
+        :type checkout_timeout: int or float
+        """
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.checkout_timeout = checkout_timeout
+        self.driver_path = None
+        self._idle = queue.LifoQueue()
+        self._instances = set()
+        self._lock = threading.Lock()
+        self._stats = {'launches': 0,
+                       'launch_time': 0.0,
+                       'sessions': 0,
+                       'reuses': 0,
+                       'recycles': 0,
+                       'orphans_reaped': 0}
+
+    def start(self):
+        """Resolves the driver, reaps the drivers orphaned by the previous runs
+        and launches the warm instances.
+        """
+        logging.info('Starting the browser pool...')
+        self.reap_orphans()
+        self._resolve_driver()
+        for _ in range(self.size):
+            with self._lock:
+                if len(self._instances) >= self.size:
+                    break
+                pooled_browser = self._launch()
+            self._idle.put(pooled_browser)
+        logging.info(f'The browser pool started with {self.size} instances.')
+
+    @contextlib.contextmanager
+    def session(self):
+        """Checks a browser out of the pool and returns it back when the block is left.
+
+        Usage: `with browser_pool.session() as browser: ...`
+        """
+        pooled_browser = self._checkout()
+        try:
+            yield pooled_browser.browser
+        except GeneratorExit:
+            # A generator which scrapes page by page has been closed early,
+            # which says nothing bad about the browser.
+            self._checkin(pooled_browser)
+            raise
+        except BaseException:
+            # A browser which failed in the middle of a scrape may be in any state,
+            # so it is better to replace it.
+            self._recycle(pooled_browser)
+            raise
+        else:
+            self._checkin(pooled_browser)
+
+    def get_stats(self):
+        """Returns the pool's counters along with the launch time saved by reusing
+        the instances and their current memory.
+
+        :return: a dictionary like {'launches': 2, ..., 'launch_time_saved': 12.3, 'rss_mb': 512}
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            instances = list(self._instances)
+        average_launch_time = stats['launch_time'] / stats['launches'] if stats['launches'] else 0
+        stats['average_launch_time'] = round(average_launch_time, 3)
+        stats['launch_time_saved'] = round(average_launch_time * stats['reuses'], 3)
+        stats['instances'] = len(instances)
+        rss = [pooled_browser.get_rss() for pooled_browser in instances]
+        stats['rss_mb'] = round(sum(rss), 1) if None not in rss else None
+        return stats
+
+    def close(self):
+        """Quits all the idle instances."""
+        while True:
+            try:
+                pooled_browser = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(pooled_browser)
+
+    def reap_orphans(self):
+        """Kills the chromedriver processes which have lost their parent
+        (which happens if the bot is killed), along with their browsers.
+        """
+        if psutil is None:
+            return
+        for process in psutil.process_iter(['name', 'ppid']):
+            try:
+                if 'chromedriver' not in (process.info['name'] or '') \
+                        or process.info['ppid'] != 1:
+                    continue
+                logging.info(f'Reaping an orphaned driver process {process.pid}...')
+                for child in process.children(recursive=True):
+                    child.kill()
+                process.kill()
+                with self._lock:
+                    self._stats['orphans_reaped'] += 1
+            except psutil.Error:
+                continue
+
+    def _resolve_driver(self):
+        if self.driver_path is None:
+            self.driver_path = ChromeDriverManager().install()
+
+    def _launch(self):
+        # Must be called with the lock held, so that the pool never exceeds its size.
+        self._resolve_driver()
+        started = time.monotonic()
+        # Setting the browser's settings. Making it so that it opens in the background,
+        # without opening a window.
+        browser_options = Options()
+        browser_options.add_argument('--headless')
+        browser = webdriver.Chrome(service=ChromeService(self.driver_path),
+                                   options=browser_options)
+        browser.maximize_window()
+        launch_time = time.monotonic() - started
+        metrics.browser_launch_seconds.observe(launch_time)
+        pooled_browser = PooledBrowser(browser, launch_time)
+        self._instances.add(pooled_browser)
+        self._stats['launches'] += 1
+        self._stats['launch_time'] += launch_time
+        logging.info(f'A browser instance launched in {launch_time:.2f} seconds.')
+        return pooled_browser
+
+    def _checkout(self):
+        try:
+            pooled_browser = self._idle.get_nowait()
+        except queue.Empty:
+            pooled_browser = None
+            with self._lock:
+                if len(self._instances) < self.size:
+                    pooled_browser = self._launch()
+            if pooled_browser is None:
+                with metrics.browser_checkout_seconds.time():
+                    pooled_browser = self._idle.get(timeout=self.checkout_timeout)
+        with self._lock:
+            self._stats['sessions'] += 1
+            if pooled_browser.jobs > 0:
+                self._stats['reuses'] += 1
+        pooled_browser.jobs += 1
+        return pooled_browser
+
+    def _checkin(self, pooled_browser):
+        rss = pooled_browser.get_rss()
+        if pooled_browser.jobs >= self.max_jobs or (rss is not None and rss > self.max_rss):
+            logging.info(f'Recycling a browser instance after {pooled_browser.jobs} jobs '
+                         f'({rss} MB)...')
+            self._recycle(pooled_browser)
+            return
+        try:
+            self._clean_up(pooled_browser.browser)
+        except Exception as e:
+            logging.error(f'Cleaning up a browser instance failed: {e}', exc_info=True)
+            self._recycle(pooled_browser)
+            return
+        self._idle.put(pooled_browser)
+
+    def _recycle(self, pooled_browser):
+        with self._lock:
+            self._stats['recycles'] += 1
+        self._quit(pooled_browser)
+        # Launching a replacement right away keeps the pool warm and wakes up
+        # whoever is waiting for a free instance.
+        try:
+            with self._lock:
+                replacement = self._launch()
+        except Exception as e:
+            logging.error(f'Launching a replacement browser instance failed: {e}', exc_info=True)
+            return
+        self._idle.put(replacement)
+
+    def _quit(self, pooled_browser):
+        try:
+            pooled_browser.browser.quit()
+        except Exception as e:
+            logging.error(f'Quitting a browser instance failed: {e}', exc_info=True)
+        with self._lock:
+            self._instances.discard(pooled_browser)
+
+    @staticmethod
+    def _clean_up(browser):
+        # Leaving only one tab, and wiping everything the previous scrape has left.
+        for handle in browser.window_handles[1:]:
+            browser.switch_to.window(handle)
+            browser.close()
+        browser.switch_to.window(browser.window_handles[0])
+        browser.delete_all_cookies()
+        browser.execute_script('try { window.localStorage.clear(); '
+                               'window.sessionStorage.clear(); } catch (e) {}')
+        browser.get('about:blank')
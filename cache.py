@@ -0,0 +1,136 @@
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe cache with LRU eviction and an optional TTL.
+
+    Besides the usual get/set, it can compute a missing value with get_or_compute(),
+    making the concurrent callers which ask for the same key wait for a single computation.
+    """
+
+    _missing = object()
+
+    def __init__(self, maxsize=128, ttl=None):
+        """
+        :param maxsize: the maximum number of entries
+        :type maxsize: int
+        :param ttl: the number of seconds an entry is valid for; entries never expire if None
+        :type ttl: int or float or None
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Entries are stored as key: (value, stored_at), the most recently used one being the last.
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = dict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key, default=None):
+        """Returns the cached value, or default if there is no such key or it has expired."""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_compute(self, key, function):
+        """Returns the cached value, or calls the function, caches its result and returns it.
+        If several threads ask for the same missing key, only one of them calls the function.
+
+        :param key: a hashable key
+        :param function: a function without arguments which computes the value
+        :type function: callable
+
+        :return: the cached or the computed value
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self._stats['hits'] += 1
+                return entry[0]
+        with self.key_lock(key):
+            # Somebody may have computed the value while we were waiting for the lock.
+            value = self.get(key, default=self._missing)
+            if value is self._missing:
+                value = function()
+                self.set(key, value)
+            return value
+
+    @contextlib.contextmanager
+    def key_lock(self, key, blocking=True):
+        """Serializes the computations of the same key: while one thread is inside the block,
+        the others asking for the same key wait at its beginning.
+
+        With blocking=False, the block is entered at once, and the value it gets tells
+        whether the lock has been taken (True) or another thread holds it (False).
+
+        Usage: `with cache.key_lock(key): ...` or
+               `with cache.key_lock(key, blocking=False) as acquired: ...`
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        acquired = False
+        try:
+            acquired = key_lock[0].acquire(blocking)
+            yield acquired
+        finally:
+            # The lock may be released by another thread than the one which has taken it,
+            # like when the block is in a generator resumed in different threads.
+            if acquired:
+                key_lock[0].release()
+            with self._lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0:
+                    del self._key_locks[key]
+
+    def get_stats(self):
+        """Returns the cache's counters along with its current size.
+
+        :return: a dictionary like {'hits': 10, 'misses': 2, 'evictions': 0, 'size': 2}
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._data)
+        return stats
+
+    def _lookup(self, key):
+        # Must be called with the lock held.
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
@@ -1,10 +1,15 @@
 import configparser
+import contextlib
 import datetime
 import logging
+import threading
 from datetime import date
 import texts
 import time
 from mysql.connector import connect
+from cache import LRUCache
+import db_backends
+import metrics
 
 config = configparser.ConfigParser()
 config.read('config.ini', encoding='utf-8-sig')
@@ -14,11 +19,11 @@ logging.basicConfig(level=logging.INFO,
                     filemode="a",
                     format="%(asctime)s %(levelname)s %(message)s")
 
-db_config = {'host': "127.0.0.1",
-             'port': 3306,
-             'user': config.get('mysql', 'user'),
-             'password': config.get('mysql', 'password'),
-             'database': "jobmonitoringbot"}
+db_config = {'host': config.get('mysql', 'host', fallback="127.0.0.1"),
+             'port': config.getint('mysql', 'port', fallback=3306),
+             'user': config.get('mysql', 'user', fallback=None),
+             'password': config.get('mysql', 'password', fallback=None),
+             'database': config.get('mysql', 'database', fallback="jobmonitoringbot")}
 
 
 def access_to_db(host, port, user, password, database):
@@ -43,15 +48,18 @@ def access_to_db(host, port, user, password, database):
         logging.info(f'Connecting to the database. Attempt {attempt} of 10...')
 
         try:
-            connection = connect(host=host,
-                                 port=port,
-                                 user=user,
-                                 password=password,
-                                 database=database)
+            with metrics.db_connect_seconds.time():
+                connection = connect(host=host,
+                                     port=port,
+                                     user=user,
+                                     password=password,
+                                     database=database)
         except Exception as e:
             logging.error(f'An attempt to connect to the database failed: {e}', exc_info=True)
+            metrics.db_connect_attempts_total.inc(result='failed')
             time.sleep(5)
             continue
+        metrics.db_connect_attempts_total.inc(result='connected')
 
         if connection.is_connected():
             logging.info(f'The connection to the database established successfully.')
@@ -60,60 +68,315 @@ def access_to_db(host, port, user, password, database):
     return connection
 
 
-def add_jobs_or_stops(table, data_list):
-    """Adds new entries to jobs or stops tables.
+class PoolError(Exception):
+    """Raised when a connection can't be checked out of the pool."""
 
-    :param table: a name of the table we need to add the data to
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of database connections shared by all the functions
+    of this module.
+
+    Connections are created lazily up to max_size. A connection which has been idle for
+    longer than health_check_interval seconds is checked for liveness before it is handed
+    out, and a connection which has been idle for longer than max_idle seconds is closed.
+    """
+
+    def __init__(self, connect_function, max_size=5, max_idle=300, health_check_interval=30,
+                 checkout_timeout=30):
+        """
+        :param connect_function: a function which creates a new connection or returns None
+        :type connect_function: callable
+        :param max_size: the maximum number of connections, both idle and checked out
+        :type max_size: int
+        :param max_idle: the number of seconds an idle connection is kept open for
+        :type max_idle: int or float
+        :param health_check_interval: the number of idle seconds after which a connection
+                                      is pinged before it is handed out
+        :type health_check_interval: int or float
+        :param checkout_timeout: the number of seconds to wait for a free connection
+        :type checkout_timeout: int or float
+        """
+        self.connect_function = connect_function
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        # Idle connections are stored as (connection, released_at) tuples,
+        # the most recently released one being the last.
+        self._idle = []
+        self._size = 0
+        self._condition = threading.Condition()
+        self._stats = {'checkouts': 0,
+                       'waits': 0,
+                       'wait_time': 0.0,
+                       'creations': 0,
+                       'evictions': 0,
+                       'health_check_failures': 0}
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Checks a connection out of the pool and returns it back when the block is left.
+
+        Usage: `with pool.connection() as connection: ...`
+        """
+        connection = self._checkout()
+        try:
+            yield connection
+        except BaseException:
+            self._checkin(connection, failed=True)
+            raise
+        else:
+            self._checkin(connection)
+
+    def get_stats(self):
+        """Returns the pool's counters along with its current size.
+
+        :return: a dictionary like {'checkouts': 10, 'waits': 0, ..., 'size': 2, 'idle': 2}
+        :rtype: dict
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+        return stats
+
+    def close_all(self):
+        """Closes all the idle connections."""
+        with self._condition:
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._size -= 1
+                self._close(connection)
+
+    def _checkout(self):
+        released_at = None
+        with self._condition:
+            self._stats['checkouts'] += 1
+            wait_started = None
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    connection, released_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserving a slot for a new connection which is created below,
+                    # outside the lock.
+                    self._size += 1
+                    connection = None
+                    break
+                if wait_started is None:
+                    wait_started = time.monotonic()
+                    self._stats['waits'] += 1
+                    logging.info('All the connections to the database are in use. Waiting...')
+                remaining = self.checkout_timeout - (time.monotonic() - wait_started)
+                if remaining <= 0:
+                    raise PoolError(f'No free connection to the database '
+                                    f'within {self.checkout_timeout} seconds.')
+                self._condition.wait(remaining)
+            if wait_started is not None:
+                self._stats['wait_time'] += time.monotonic() - wait_started
+
+        if connection is not None \
+                and time.monotonic() - released_at > self.health_check_interval \
+                and not self._is_alive(connection):
+            logging.info('An idle connection to the database is dead. Replacing it...')
+            with self._condition:
+                self._stats['health_check_failures'] += 1
+            self._close(connection)
+            connection = None
+
+        if connection is None:
+            try:
+                connection = self.connect_function()
+                if connection is None:
+                    raise PoolError('Failed to connect to the database.')
+            except BaseException:
+                self._release_slot()
+                raise
+            with self._condition:
+                self._stats['creations'] += 1
+        return connection
+
+    def _checkin(self, connection, failed=False):
+        # Every connection is rolled back, not only a failed one: uncommitted changes must not
+        # leak into the next checkout, and an open transaction left after a SELECT would keep
+        # its REPEATABLE READ snapshot (so the next checkout would read stale data) and hold
+        # the metadata locks the partition maintenance's ALTER TABLE statements wait for.
+        try:
+            connection.rollback()
+        except Exception as e:
+            state = 'a failed' if failed else 'a'
+            logging.error(f'Rolling back {state} connection failed: {e}', exc_info=True)
+            self._close(connection)
+            self._release_slot()
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def _evict_idle(self):
+        # Must be called with the lock held. The oldest connections are at the beginning.
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            connection, _ = self._idle.pop(0)
+            self._size -= 1
+            self._stats['evictions'] += 1
+            self._close(connection)
+
+    def _release_slot(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def _is_alive(connection):
+        try:
+            return connection.is_connected()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+            logging.info(texts.connection_closed)
+        except Exception as e:
+            logging.error(f'Closing a connection to the database failed: {e}', exc_info=True)
+
+
+# The database engine: 'mysql', or 'sqlite' which keeps everything in a local file
+# and needs no database server.
+if config.get('database', 'backend', fallback='mysql') == 'sqlite':
+    backend = db_backends.SQLiteBackend(config.get('sqlite', 'path',
+                                                   fallback='jobmonitoringbot.sqlite3'))
+else:
+    backend = db_backends.MySQLBackend(lambda: access_to_db(**db_config))
+
+pool = ConnectionPool(backend.connect,
+                      max_size=config.getint('mysql', 'pool_size', fallback=5),
+                      max_idle=config.getint('mysql', 'pool_max_idle', fallback=300),
+                      health_check_interval=config.getint('mysql', 'pool_health_check_interval',
+                                                          fallback=30),
+                      checkout_timeout=config.getint('mysql', 'pool_checkout_timeout',
+                                                     fallback=30))
+
+
+# The telegram ids of the users who are known to exist in the DB already, so that checking
+# whether a user exists doesn't need the DB most of the time.
+known_users = LRUCache(maxsize=config.getint('mysql', 'known_users_cache_size', fallback=10000))
+
+# The users' job names and stop words, keyed by (table, telegram_id). The entries are dropped
+# whenever the user's data changes, so the DB is only read after a change.
+user_data_cache = LRUCache(maxsize=config.getint('mysql', 'user_data_cache_size',
+                                                 fallback=10000))
+
+# The names of the columns which store the data of the jobs and stops tables.
+data_columns = {'jobs': 'job_name', 'stops': 'stop_word'}
+
+# All the users' data lives in these shared tables and is keyed by telegram_id
+# (see db_backends.py for their definitions).
+tables_create_queries = backend.tables_create_queries
+
+# The settings a user has until the user changes them.
+default_settings = {'digest_mode': False}
+
+# Whether the vacancies table is partitioned by month of `vacancy_date` (MySQL only, see
+# partition_vacancies()), so that the old vacancies can be dropped a partition at a time.
+vacancies_partitioned = backend.name == 'mysql' \
+    and config.getboolean('retention', 'partitioning', fallback=False)
+
+
+def _add_months(month, months):
+    """Returns the first day of the month which is a given number of months after another one.
+
+    :param month: the first day of a month
+    :type month: datetime.date
+    :param months: the number of months to add
+    :type months: int
+
+    :rtype: datetime.date
+    """
+    year, month_index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return date(year, month_index + 1, 1)
+
+
+def _clear_watermark(cursor, telegram_id):
+    # The watermark narrows the search to the period since the last check, so once the user's
+    # query changes (a new job name or a stop word less), it would skip the older vacancies
+    # the new query finds. Without it, the next check searches through all the vacancies.
+    cursor.execute("DELETE FROM `watermarks` WHERE `telegram_id` = %s;", (telegram_id,))
+
+
+def _get_vacancies_partitions(cursor):
+    """Returns the months the vacancies table has partitions for, along with the estimated
+    numbers of rows in them. The catch-all `pmax` partition is not included.
+
+    :param cursor: a cursor of a connection checked out of the pool
+
+    :return: a dictionary like {datetime.date(2024, 5, 1): 12345}, sorted by month;
+             it is empty if the table isn't partitioned
+    :rtype: dict
+    """
+    cursor.execute("SELECT `PARTITION_NAME`, `TABLE_ROWS` FROM `information_schema`.`PARTITIONS` "
+                   "WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = 'vacancies' "
+                   "AND `PARTITION_NAME` IS NOT NULL ORDER BY `PARTITION_ORDINAL_POSITION`;")
+    partitions = dict()
+    for name, rows in cursor.fetchall():
+        if name != 'pmax':
+            partitions[datetime.datetime.strptime(name, 'p%Y%m').date()] = rows or 0
+    return partitions
+
+
+def _month_partition(month):
+    """Returns the definition of the partition which holds the vacancies of a month.
+
+    :param month: the first day of the month
+    :type month: datetime.date
+
+    :rtype: str
+    """
+    return f"PARTITION `p{month:%Y%m}` VALUES LESS THAN (TO_DAYS('{_add_months(month, 1)}'))"
+
+
+def add_jobs_or_stops(table, telegram_id, data_list):
+    """Adds new entries to jobs or stops tables. The entries which are present
+    in the table already are skipped.
+
+    :param table: a name of the table we need to add the data to ('jobs' or 'stops')
     :type table: str
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
     :param data_list: a list of job names or stop words which should be added
     :type data_list: list
     :return: True or False, depending on whether the function has been executed correctly or not
     :rtype: bool
     """
-    column_name = str()
-    if table.startswith('jobs'):
-        column_name = 'job_name'
-    if table.startswith('stops'):
-        column_name = 'stop_word'
-
+    if len(data_list) == 0:
+        return True
+    column_name = data_columns[table]
     error = False
-    logging.info(f'Adding new records to the {table} table...')
-    connection = access_to_db(**db_config)
-
+    logging.info(f'Adding new records for the user {telegram_id} to the {table} table...')
+    values = []
     for data_element in data_list:
-        # Checking if there is such a data element in the table already.
+        values.extend([telegram_id, data_element])
+    insert_query = f"{backend.insert_ignore} INTO `{table}` (`telegram_id`, `{column_name}`) " \
+                   "VALUES " + ', '.join(['(%s, %s)'] * len(data_list)) + ';'
+    with pool.connection() as connection:
         with connection.cursor() as cursor:
             try:
-                logging.info(f'Checking if \'{data_element}\' is present in {table}...')
-                cursor.execute(f"SELECT * FROM `{table}` "
-                               f"WHERE `{column_name}` = '{data_element}';")
-                search_result = cursor.fetchone()
+                cursor.execute(insert_query, values)
+                added_count = cursor.rowcount
+                _clear_watermark(cursor, telegram_id)
+                connection.commit()
+                logging.info(f'{added_count} new records for the user {telegram_id} '
+                             f'added to the {table} table.')
             except Exception as e:
-                logging.error(f'An attempt to check if \'{data_element}\' is in {table} '
-                              f'failed: {e}', exc_info=True)
+                logging.error(f'An attempt to add {data_list} for the user {telegram_id} '
+                              f'to the {table} table failed: {e}', exc_info=True)
                 error = True
+    invalidate_jobs_or_stops(table, telegram_id)
 
-            # If there is no such a job name in the table, we should add it.
-            if search_result is None:
-                try:
-                    logging.info(f'Adding \'{data_element}\' to {table}...')
-                    cursor.execute(f"INSERT INTO `{table}` (`{column_name}`) "
-                                   f"VALUES ('{data_element}');")
-                    connection.commit()
-                    logging.info(f'\'{data_element}\' added to {table}.')
-                except Exception as e:
-                    logging.error(f'An attempt to add \'{data_element}\' to {table} '
-                                  f'failed: {e}', exc_info=True)
-                    error = True
-
-            # If the data element is in the db already, we pass it and go to the next one.
-            else:
-                logging.info(f'The table {table} already contains \'{data_element}\'. '
-                             f'Skipping...')
-                continue
-
-    connection.close()
-    logging.info(texts.connection_closed)
     if error:
         return False
     else:
@@ -133,137 +396,145 @@ def add_user_if_none(message):
     telegram_name = message.from_user.username
     error = False
 
-    # Checking if user is present in the DB already.
+    # Most of the time the user is known already, and the DB isn't needed at all.
+    if telegram_id in known_users:
+        return 'user_exists'
+
+    # Checking if user is present in the DB already and creating the user's entry if it isn't.
+    # Both are done by a single INSERT IGNORE: it affects one row if the user is new,
+    # and no rows if the user exists already.
     logging.info(f'Checking if user {telegram_id} ({telegram_name}) exists...')
     # This variable takes a 'user_created' or 'user_exists' state depending
     # on the results of the checkup, and is returned if everything goes smoothly
     # (otherwise False is returned).
     existence_check_result = str()
-    search_query = f"SELECT * FROM `users` WHERE `telegram_id` = {telegram_id};"
-    connection = access_to_db(**db_config)
-    with connection.cursor() as cursor:
-        try:
-            cursor.execute(search_query)
-            search_result = cursor.fetchone()
-        except Exception as e:
-            error = True
-            logging.error(f'An attempt to check if the user {telegram_id} ({telegram_name}) '
-                          f'is present in the DB failed: {e}', exc_info=True)
-
-        # If there is no such user in the DB, we should do the following:
-        #   1. Create the user's entry.
-        #   2. Create a table with user's vacancies.
-        #   3. Create a table with user's job names.
-        #   4. Create a table with user's stop words.
-        if search_result is None:
-            # 1. Creating the user's entry.
-            logging.info(f'User {telegram_id} ({telegram_name}) not found. Adding user...')
-            user_vacancies = '_'.join(['vacancies', telegram_id])
-            user_jobs = '_'.join(['jobs', telegram_id])
-            user_stops = '_'.join(['stops', telegram_id])
-            insert_query = f"INSERT INTO `users` (`telegram_id`, `telegram_name`, " \
-                           f"`user_vacancies`, `user_jobs`, `user_stops`) " \
-                           f"VALUES ('{telegram_id}', '{telegram_name}', '{user_vacancies}', " \
-                           f"'{user_jobs}', '{user_stops}');"
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
             try:
-                cursor.execute(insert_query)
+                cursor.execute(f"{backend.insert_ignore} INTO `users` "
+                               f"(`telegram_id`, `telegram_name`) VALUES (%s, %s);",
+                               (telegram_id, telegram_name))
                 connection.commit()
-                logging.info(f'User {telegram_id} ({telegram_name}) added to the DB.')
-                # 2. Creating a table with user's vacancies.
-                user_vacancies_create_query = f"CREATE TABLE IF NOT EXISTS `{user_vacancies}` (" \
-                                              f"`vacancy_id` INT UNSIGNED PRIMARY KEY " \
-                                              f"AUTO_INCREMENT NOT NULL, " \
-                                              f"`vacancy_url` VARCHAR(256) NOT NULL, " \
-                                              f"`vacancy_name` VARCHAR(512) NOT NULL, " \
-                                              f"`vacancy_date` DATE NOT NULL, " \
-                                              f"`sent_to_user` TINYINT NOT NULL) ENGINE=InnoDB;"
-                create_table(user_vacancies_create_query, user_vacancies)
-                # 3. Creating a table with user's job names.
-                user_jobs_create_query = f"CREATE TABLE IF NOT EXISTS `{user_jobs}` (" \
-                                         f"`job_name_id` INT UNSIGNED PRIMARY KEY " \
-                                         f"AUTO_INCREMENT NOT NULL, " \
-                                         f"`job_name` VARCHAR(128) NOT NULL) ENGINE=InnoDB;"
-                create_table(user_jobs_create_query, user_jobs)
-                # 4. Creating a table with user's stop words.
-                user_stops_create_query = f"CREATE TABLE IF NOT EXISTS `{user_stops}` (" \
-                                          f"`stop_word_id` INT UNSIGNED PRIMARY KEY " \
-                                          f"AUTO_INCREMENT NOT NULL, " \
-                                          f"`stop_word` VARCHAR(128) NOT NULL) ENGINE=InnoDB;"
-                create_table(user_stops_create_query, user_stops)
-                existence_check_result = 'user_created'
+                if cursor.rowcount == 1:
+                    existence_check_result = 'user_created'
+                    logging.info(f'User {telegram_id} ({telegram_name}) added to the DB.')
+                else:
+                    existence_check_result = 'user_exists'
+                known_users.set(telegram_id, True)
             except Exception as e:
                 error = True
-                logging.error(f'An attempt to add user {telegram_id} ({telegram_name}) '
-                              f'to the DB failed: {e}', exc_info=True)
-        else:
-            existence_check_result = 'user_exists'
+                logging.error(f'An attempt to check if the user {telegram_id} ({telegram_name}) '
+                              f'is present in the DB failed: {e}', exc_info=True)
 
-    connection.close()
-    logging.info(texts.connection_closed)
     if error:
         return False
     else:
         return existence_check_result
 
 
-def add_vacancies(user_table, vacancies_dict):
+def add_vacancies(telegram_id, vacancies_dict):
     """
-    Adds new vacancies to the DB.
+    Adds new vacancies to the DB in a single multi-row INSERT and a single transaction.
+    Vacancies which are in the table already are skipped by the unique key
+    on (`telegram_id`, `vacancy_url`), or by a SELECT if the table is partitioned.
 
-    :param user_table: a name of the user's table which stores the vacancies found
-                       upon the user's request
-    :type user_table: str
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
     :param vacancies_dict: a dictionary with vacancies: looks like {'vacancy_name': 'vacancy_url'}
     :type vacancies_dict: dict
 
-    :return: True of False, depending on whether everything worked correctly
-    :rtype: bool
+    :return: the number of vacancies which were actually new, or False if something went wrong
+    :rtype: int or bool
     """
-    logging.info(f'Adding new vacancies to the {user_table} table...')
-    connection = access_to_db(**db_config)
+    if len(vacancies_dict) == 0:
+        return 0
+    logging.info(f'Adding {len(vacancies_dict)} vacancies for the user {telegram_id}...')
     error = False
-    for vacancy_name, vacancy_url in vacancies_dict.items():
-        # 1. Checking if the vacancy in the db already.
-        search_query = f"SELECT * FROM `{user_table}` WHERE `vacancy_url` = '{vacancy_url}';"
+    new_vacancies_count = 0
+    today = date.today()
+    with pool.connection() as connection:
         with connection.cursor() as cursor:
             try:
-                logging.info(f'Checking if {vacancy_url} is present in the {user_table} table...')
-                cursor.execute(search_query)
-                search_result = cursor.fetchone()
+                vacancies_list = list(vacancies_dict.items())
+                if vacancies_partitioned:
+                    # The unique key of a partitioned table has to include `vacancy_date`,
+                    # so it doesn't skip the vacancies stored on the previous days.
+                    cursor.execute("SELECT `vacancy_url` FROM `vacancies` "
+                                   "WHERE `telegram_id` = %s AND `vacancy_url` IN ("
+                                   + ', '.join(['%s'] * len(vacancies_list)) + ');',
+                                   [telegram_id] + list(vacancies_dict.values()))
+                    stored_urls = {elem[0] for elem in cursor.fetchall()}
+                    vacancies_list = [(vacancy_name, vacancy_url)
+                                      for vacancy_name, vacancy_url in vacancies_list
+                                      if vacancy_url not in stored_urls]
+                if vacancies_list:
+                    values = []
+                    for vacancy_name, vacancy_url in vacancies_list:
+                        values.extend([telegram_id, vacancy_url, vacancy_name, today, 0])
+                    insert_query = f"{backend.insert_ignore} INTO `vacancies` (`telegram_id`, " \
+                                   "`vacancy_url`, `vacancy_name`, `vacancy_date`, " \
+                                   "`sent_to_user`) VALUES " \
+                                   + ', '.join(['(%s, %s, %s, %s, %s)'] * len(vacancies_list)) \
+                                   + ';'
+                    cursor.execute(insert_query, values)
+                    new_vacancies_count = cursor.rowcount
+                    connection.commit()
+                logging.info(f'{new_vacancies_count} new vacancies added '
+                             f'for the user {telegram_id}.')
             except Exception as e:
-                logging.error(f'An attempt to check if vacancy {vacancy_url} exists '
-                              f'in the {user_table} table failed: {e}', exc_info=True)
+                logging.error(f'An attempt to add vacancies for the user {telegram_id} '
+                              f'failed: {e}', exc_info=True)
                 error = True
-            # If there is no such a vacancy in the DB, we should add it.
-            if search_result is None:
-                insert_query = f"INSERT INTO `{user_table}` (`vacancy_url`, `vacancy_name`, " \
-                               f"`vacancy_date`, `sent_to_user`) VALUES " \
-                               f"('{vacancy_url}', '{vacancy_name}', '{date.today()}', '0');"
-                try:
-                    logging.info(f'Adding {vacancy_url} to the {user_table} table...')
-                    cursor.execute(insert_query)
-                    connection.commit()
-                    logging.info(f'The vacancy {vacancy_url} added to {user_table} table.')
-                except Exception as e:
-                    logging.error(f'An attempt to add {vacancy_url} '
-                                  f'to {user_table} failed: {e}', exc_info=True)
-                    error = True
-            # If vacancy is in the db already, we pass it and go to the next one.
-            else:
-                logging.info(f'The vacancy {vacancy_url} is present in the {user_table} '
-                             f'table already.')
-                continue
-
-    connection.close()
-    logging.info(texts.connection_closed)
+
     if error:
         return False
     else:
-        return True
+        return new_vacancies_count
+
+
+def add_vacancies_partitions(months_ahead=2):
+    """Makes sure the partitioned vacancies table has the partitions for the current month
+    and for months_ahead months after it, so that the new vacancies never end up in the
+    catch-all `pmax` partition. The new partitions are split off `pmax`, which is cheap
+    while it is empty.
+
+    :param months_ahead: the number of the months after the current one to prepare
+    :type months_ahead: int
+
+    :return: the number of the partitions added, or False if something went wrong
+    :rtype: int or bool
+    """
+    error = False
+    new_months = []
+    last_month = _add_months(date.today().replace(day=1), months_ahead)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                partitions = _get_vacancies_partitions(cursor)
+                if partitions:
+                    month = _add_months(max(partitions), 1)
+                    while month <= last_month:
+                        new_months.append(month)
+                        month = _add_months(month, 1)
+                if new_months:
+                    partitions_str = ', '.join(_month_partition(month) for month in new_months)
+                    cursor.execute(f"ALTER TABLE `vacancies` REORGANIZE PARTITION `pmax` INTO "
+                                   f"({partitions_str}, "
+                                   f"PARTITION `pmax` VALUES LESS THAN MAXVALUE);")
+                    logging.info(f'{len(new_months)} partitions added to the vacancies table.')
+            except Exception as e:
+                logging.error(f'An attempt to add partitions to the vacancies table failed: {e}',
+                              exc_info=True)
+                error = True
+
+    if error:
+        return False
+    else:
+        return len(new_months)
 
 
 def check_if_jobs_empty(message):
-    """Checks if user's table with job names empty.
+    """Checks if user has no job names in the jobs table.
 
     :param message: message: a message object which contains user data
 
@@ -275,73 +546,92 @@ def check_if_jobs_empty(message):
     add_user_if_none(message)  # creating user if it doesn't exist
     telegram_id = str(message.from_user.id)
     jobs_table_state = 'not_empty'
-    jobs_table = '_'.join(['jobs', telegram_id])
-    logging.info(f'Checking if the user {telegram_id} has no entries '
-                 f'in the \'{jobs_table}\' table...')
-    connection = access_to_db(**db_config)
-    with connection.cursor() as cursor:
-        try:
-            cursor.execute(f"SELECT * FROM `{jobs_table}`;")
-            if len(cursor.fetchall()) == 0:
-                jobs_table_state = 'empty'
-        except Exception as e:
-            error = True
-            logging.error(f'Check if the user {telegram_id} has no entries in the \'{jobs_table}\' '
-                          f'table failed: {e}', exc_info=True)
+    logging.info(f'Checking if the user {telegram_id} has no entries in the \'jobs\' table...')
+    jobs_count = count_jobs_or_stops('jobs', telegram_id)
+    if jobs_count is False:
+        error = True
+    elif jobs_count == 0:
+        jobs_table_state = 'empty'
 
-    connection.close()
-    logging.info(texts.connection_closed)
     if error:
         return False
     else:
         return jobs_table_state
 
 
-def clean_up_db_table(table):
-    """Truncates the table.
+def clean_up_db_table(table, telegram_id):
+    """Deletes all the user's records in the table.
 
     :param table: the name of the table which we are performing the operation upon
     :type table: str
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
 
     :return: True or False, depending on whether the function has been executed correctly or not
     :rtype: bool
     """
     error = False
-    logging.info(f'Trying to clean up the \'{table}\' table...')
-    connection = access_to_db(**db_config)
-    with connection.cursor() as cursor:
-        try:
-            cursor.execute(f"TRUNCATE TABLE `{table}`;;")
-            connection.commit()
-            logging.info(
-                f'The \'{table}\' table cleaned up successfully.')
-        except Exception as e:
-            logging.error(f'An attempt to clean up the \'{table}\' table failed: {e}',
-                          exc_info=True)
-            error = True
+    logging.info(f'Trying to clean up the \'{table}\' table for the user {telegram_id}...')
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(f"DELETE FROM `{table}` WHERE `telegram_id` = %s;", (telegram_id,))
+                if table in data_columns:
+                    _clear_watermark(cursor, telegram_id)
+                connection.commit()
+                logging.info(
+                    f'The \'{table}\' table cleaned up for the user {telegram_id} successfully.')
+            except Exception as e:
+                logging.error(f'An attempt to clean up the \'{table}\' table for the user '
+                              f'{telegram_id} failed: {e}', exc_info=True)
+                error = True
+    if table in data_columns:
+        invalidate_jobs_or_stops(table, telegram_id)
 
-    connection.close()
-    logging.info(texts.connection_closed)
     if error:
         return False
     else:
         return True
 
 
-def create_table(create_query, table):
-    """Creates a table which belongs to a specific user and contains this user's data.
+def count_jobs_or_stops(table, telegram_id):
+    """Counts user's job names or stop words.
+
+    :param table: the name of the table ('jobs' or 'stops')
+    :type table: str
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
+
+    :return: the number of the entries, or False if something went wrong
+    :rtype: int or bool
+    """
+    data_list = get_jobs_or_stops_list(table, telegram_id)
+    if data_list is False:
+        return False
+    else:
+        return len(data_list)
 
-    :param create_query: MySQL query for table creation
+
+def create_table(create_query, table, connection=None):
+    """Creates a table.
+
+    :param create_query: a query for table (or index) creation
     :type create_query: str
     :param table: name of the table we are creating
     :type table: str
+    :param connection: a connection which is already checked out of the pool by the caller;
+                       if it is omitted, a connection is checked out for this call only
+    :type connection: mysql.connector.connection or None
 
     :return: True of False, depending on whether everything worked correctly
     :rtype: bool
     """
+    if connection is None:
+        with pool.connection() as connection:
+            return create_table(create_query, table, connection)
+
     error = False
     logging.info(f'Creating table {table}...')
-    connection = access_to_db(**db_config)
     with connection.cursor() as cursor:
         try:
             cursor.execute(create_query)
@@ -350,68 +640,73 @@ def create_table(create_query, table):
         except Exception as e:
             logging.error(f'An attempt to create the table {table} failed: {e}', exc_info=True)
             error = True
-        finally:
-            connection.close()
-            logging.info(texts.connection_closed)
-            if error:
-                return False
-            else:
-                return True
 
+    if error:
+        return False
+    else:
+        return True
 
-def delete_old_vacancies():
-    """
-    Iterates over all the tables with vacancies, and deletes the old ones.
 
-    :return: True or False, depending on whether the function has been executed correctly or not
+def create_tables():
+    """Creates the shared tables if they don't exist yet.
+
+    :return: True of False, depending on whether everything worked correctly
     :rtype: bool
     """
     error = False
-    # Getting the list of tables with vacancies.
-    tables_list = []
-    logging.info(f'Starting a regular job of deleting old vacancies. '
-                 f'Getting the list of tables with vacancies...')
-    connection = access_to_db(**db_config)
-    with connection.cursor() as cursor:
-        try:
-            cursor.execute(f"SHOW TABLES LIKE 'vacancies%';")
-            result = cursor.fetchall()
-            for elem in result:
-                tables_list.append(elem[0])
-            logging.info(f'A list of tables with vacancies created.')
-        except Exception as e:
-            logging.error(f'An attempt to create a list of tables with vacancies '
-                          f'failed: {e}', exc_info=True)
-            error = True
+    with pool.connection() as connection:
+        for table, create_query in tables_create_queries.items():
+            if not create_table(create_query, table, connection):
+                error = True
+        for index, create_query in backend.indexes_create_queries.items():
+            if not create_table(create_query, index, connection):
+                error = True
 
-    # Calculating the expiration date.
-    expiration_date = datetime.date.today() - datetime.timedelta(days=90)
+    if error:
+        return False
+    else:
+        return True
 
-    # Iterating over the tables and deleting old vacancies in each one of them.
-    with connection.cursor() as cursor:
-        try:
-            for table in tables_list:
-                logging.info(f'Deleting old vacancies in the \'{table}\' table...')
-                cursor.execute(f"DELETE FROM `{table}` WHERE `vacancy_date` < '{expiration_date}';")
-            connection.commit()
-        except Exception as e:
-            logging.error(f'An attempt to delete old vacancies in the \'{table}\' table '
-                          f'failed: {e}', exc_info=True)
-            error = True
 
-    connection.close()
-    logging.info(texts.connection_closed)
+def delete_old_vacancies(expiration_date, batch_size):
+    """Deletes a batch of the vacancies which have been stored before the expiration date.
+    Every batch is a short transaction of its own, which finds the rows by the index
+    on `vacancy_date`, so it doesn't lock the table for long.
+
+    :param expiration_date: the vacancies stored before this date are deleted
+    :type expiration_date: datetime.date
+    :param batch_size: the maximum number of the vacancies to delete
+    :type batch_size: int
+
+    :return: the number of the vacancies deleted, or False if something went wrong
+    :rtype: int or bool
+    """
+    error = False
+    deleted_count = 0
+    delete_query = backend.batch_delete_query('vacancies', "`vacancy_date` < %s")
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(delete_query, (expiration_date, batch_size))
+                deleted_count = cursor.rowcount
+                connection.commit()
+            except Exception as e:
+                logging.error(f'An attempt to delete old vacancies failed: {e}', exc_info=True)
+                error = True
+
     if error:
         return False
     else:
-        return True
+        return deleted_count
 
 
-def delete_record(table, column_name, record):
-    """Deletes records in the DB tables.
+def delete_record(table, telegram_id, column_name, record):
+    """Deletes user's records in the DB tables.
 
     :param table: the name of the table which we are performing the operation upon
     :type table: str
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
     :param column_name: the name of the column which contains the data we are about to delete
     :type column_name: str
     :param record: the record we are about to delete
@@ -421,21 +716,26 @@ def delete_record(table, column_name, record):
     :rtype: bool
     """
     error = False
-    logging.info(f'Trying to delete \'{record}\' in the \'{table}\' table...')
-    connection = access_to_db(**db_config)
-    with connection.cursor() as cursor:
-        try:
-            cursor.execute(f"DELETE FROM `{table}` WHERE `{column_name}` = '{record}';")
-            connection.commit()
-            logging.info(
-                f'The record \'{record}\' successfully deleted from the \'{table}\' table.')
-        except Exception as e:
-            logging.error(f'An attempt to delete \'{record}\' from the \'{table}\' table '
-                          f'failed: {e}', exc_info=True)
-            error = True
+    logging.info(f'Trying to delete \'{record}\' of the user {telegram_id} '
+                 f'in the \'{table}\' table...')
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(f"DELETE FROM `{table}` "
+                               f"WHERE `telegram_id` = %s AND `{column_name}` = %s;",
+                               (telegram_id, record))
+                if table in data_columns:
+                    _clear_watermark(cursor, telegram_id)
+                connection.commit()
+                logging.info(
+                    f'The record \'{record}\' successfully deleted from the \'{table}\' table.')
+            except Exception as e:
+                logging.error(f'An attempt to delete \'{record}\' from the \'{table}\' table '
+                              f'failed: {e}', exc_info=True)
+                error = True
+    if table in data_columns:
+        invalidate_jobs_or_stops(table, telegram_id)
 
-    connection.close()
-    logging.info(texts.connection_closed)
     if error:
         return False
     else:
@@ -443,7 +743,8 @@ def delete_record(table, column_name, record):
 
 
 def delete_user(telegram_id):
-    """Deletes all user data, including the user's tables and the user's record in the DB.
+    """Deletes all user data, including the user's records in the shared tables
+    and the user's record in the DB.
 
     :param telegram_id: user's telegram id
     :type telegram_id: int or str
@@ -453,61 +754,164 @@ def delete_user(telegram_id):
     """
     error = False
     logging.info(f'Deleting all data for the user {telegram_id}...')
-    connection = access_to_db(**db_config)
-    with connection.cursor() as cursor:
-        try:
-            logging.info(f'Getting the tables names for {telegram_id}...')
-            cursor.execute(f"SELECT * FROM `users` WHERE `telegram_id` = {telegram_id};")
-            result = cursor.fetchall()
-            vacancies, jobs, stops = result[0][2], result[0][3], result[0][4]
-            logging.info(f'Deleting {telegram_id}\'s tables...')
-            cursor.execute(f"DROP TABLE IF EXISTS `{vacancies}`, `{jobs}`, `{stops}`;")
-            logging.info(f'{telegram_id}\'s tables deleted.')
-            logging.info(f'Deleting {telegram_id}\'s record in the DB...')
-            cursor.execute(f"DELETE FROM `users` WHERE `telegram_id` = '{telegram_id}';")
-            connection.commit()
-            logging.info(f'All data for user {telegram_id} deleted.')
-        except Exception as e:
-            logging.error(f'An attempt to delete user {telegram_id} failed: {e}', exc_info=True)
-            error = True
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                for table in ('vacancies', 'jobs', 'stops', 'watermarks', 'settings'):
+                    logging.info(f'Deleting {telegram_id}\'s records in the \'{table}\' table...')
+                    cursor.execute(f"DELETE FROM `{table}` WHERE `telegram_id` = %s;",
+                                   (telegram_id,))
+                logging.info(f'Deleting {telegram_id}\'s record in the DB...')
+                cursor.execute("DELETE FROM `users` WHERE `telegram_id` = %s;", (telegram_id,))
+                if cursor.rowcount == 0:
+                    logging.info(f'The user {telegram_id} not found.')
+                    error = True
+                connection.commit()
+                known_users.delete(str(telegram_id))
+                logging.info(f'All data for user {telegram_id} deleted.')
+            except Exception as e:
+                logging.error(f'An attempt to delete user {telegram_id} failed: {e}',
+                              exc_info=True)
+                error = True
+    for table in data_columns:
+        invalidate_jobs_or_stops(table, telegram_id)
 
-    connection.close()
-    logging.info(texts.connection_closed)
     if error:
         return False
     else:
         return True
 
 
-def get_jobs_or_stops(table):
+def drop_old_vacancies_partitions(expiration_date):
+    """Drops the partitions of the vacancies table which hold nothing but the vacancies
+    stored before the expiration date. Dropping a partition takes about the same time
+    whatever the number of rows in it.
+
+    :param expiration_date: the vacancies stored before this date are deleted
+    :type expiration_date: datetime.date
+
+    :return: the number of the partitions dropped and the estimated number of the vacancies
+             in them, or False if something went wrong
+    :rtype: tuple or bool
+    """
+    error = False
+    expired_partitions = dict()
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                partitions = _get_vacancies_partitions(cursor)
+                expired_partitions = {month: rows for month, rows in partitions.items()
+                                      if _add_months(month, 1) <= expiration_date}
+                if expired_partitions:
+                    partitions_str = ', '.join(f'`p{month:%Y%m}`' for month in expired_partitions)
+                    cursor.execute(f"ALTER TABLE `vacancies` DROP PARTITION {partitions_str};")
+                    logging.info(f'The partitions {partitions_str} of the vacancies table '
+                                 f'dropped.')
+            except Exception as e:
+                logging.error(f'An attempt to drop old partitions of the vacancies table '
+                              f'failed: {e}', exc_info=True)
+                error = True
+
+    if error:
+        return False
+    else:
+        return len(expired_partitions), sum(expired_partitions.values())
+
+
+def get_jobs_or_stops(table, telegram_id):
     """
-    Gets user's job names or stop words from the DB and returns them as a list.
+    Gets user's job names or stop words and returns them as a string.
 
-    :param table: the name of the table we are extracting the data from
+    :param table: the name of the table we are extracting the data from ('jobs' or 'stops')
     :type table: str
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
 
     :return: a string or False if something went wrong
     :rtype: str or bool
     """
+    data_list = get_jobs_or_stops_list(table, telegram_id)
+    if data_list is False:
+        return False
+    else:
+        return ', '.join(data_list)
+
+
+def get_jobs_or_stops_list(table, telegram_id):
+    """Gets user's job names or stop words, in the order they have been added.
+    They are read from the DB only if they aren't cached yet.
+
+    :param table: the name of the table we are extracting the data from ('jobs' or 'stops')
+    :type table: str
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
+
+    :return: a list like ['python developer', 'django developer'], or False if something
+             went wrong
+    :rtype: list or bool
+    """
+    key = (table, str(telegram_id))
+    data_tuple = user_data_cache.get(key)
+    if data_tuple is not None:
+        return list(data_tuple)
+
     error = False
-    logging.info(f'Getting the data from the \'{table}\' table...')
-    connection = access_to_db(**db_config)
-    with connection.cursor() as cursor:
-        try:
-            cursor.execute(f"SELECT * FROM `{table}`;")
-            logging.info(f'The data from the \'{table}\' table acquired.')
-            result = cursor.fetchall()
-            data_str = ', '.join([elem[1] for elem in result])
-        except Exception as e:
-            logging.error(f'Getting the data from {table} failed: {e}', exc_info=True)
-            error = True
+    # The lock makes invalidate_jobs_or_stops() wait until we are done, so that the data
+    # we read before somebody changes it doesn't stay in the cache.
+    with user_data_cache.key_lock(key):
+        data_tuple = user_data_cache.get(key)
+        if data_tuple is not None:
+            return list(data_tuple)
+        logging.info(f'Getting the data of the user {telegram_id} from the \'{table}\' table...')
+        column_name = data_columns[table]
+        with pool.connection() as connection:
+            with connection.cursor() as cursor:
+                try:
+                    cursor.execute(f"SELECT `{column_name}` FROM `{table}` "
+                                   f"WHERE `telegram_id` = %s ORDER BY `{column_name}_id`;",
+                                   (telegram_id,))
+                    data_tuple = tuple(elem[0] for elem in cursor.fetchall())
+                    logging.info(f'The data from the \'{table}\' table acquired.')
+                except Exception as e:
+                    logging.error(f'Getting the data from {table} failed: {e}', exc_info=True)
+                    error = True
+        if not error:
+            user_data_cache.set(key, data_tuple)
 
-    connection.close()
-    logging.info(texts.connection_closed)
     if error:
         return False
     else:
-        return data_str
+        return list(data_tuple)
+
+
+def get_settings(telegram_id):
+    """Gets the user's settings, the default ones for those the user hasn't changed.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
+
+    :return: a dictionary like {'digest_mode': False}, or False if something went wrong
+    :rtype: dict or bool
+    """
+    error = False
+    settings = dict(default_settings)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute("SELECT `digest_mode` FROM `settings` WHERE `telegram_id` = %s;",
+                               (telegram_id,))
+                result = cursor.fetchone()
+                if result is not None:
+                    settings['digest_mode'] = bool(result[0])
+            except Exception as e:
+                logging.error(f'Getting the settings of the user {telegram_id} failed: {e}',
+                              exc_info=True)
+                error = True
+
+    if error:
+        return False
+    else:
+        return settings
 
 
 def get_users():
@@ -515,77 +919,263 @@ def get_users():
     error = False
     logging.info("Collecting telegram ids of the users.")
     telegram_ids = []
-    connection = access_to_db(**db_config)
-    with connection.cursor() as cursor:
-        try:
-            cursor.execute("SELECT `telegram_id` FROM `users`;")
-            result = cursor.fetchall()
-            telegram_ids = [str(elem[0]) for elem in result]
-        except Exception as e:
-            error = True
-            logging.error(f"Collecting the users' telegram ids table failed: {e}", exc_info=True)
-    connection.close()
-    logging.info(texts.connection_closed)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute("SELECT `telegram_id` FROM `users`;")
+                result = cursor.fetchall()
+                telegram_ids = [str(elem[0]) for elem in result]
+            except Exception as e:
+                error = True
+                logging.error(f"Collecting the users' telegram ids table failed: {e}",
+                              exc_info=True)
     if error:
         return False
     else:
         return telegram_ids
 
 
-def get_vacancies(table):
+def get_vacancies(telegram_id):
     logging.info("The 'get_vacancies' function has been started.")
     error = False
-    logging.info(f"Collecting vacancies with negative 'sent_to_user' flag from the {table} table.")
-    connection = access_to_db(**db_config)
+    logging.info(f"Collecting vacancies with negative 'sent_to_user' flag "
+                 f"for the user {telegram_id}.")
     vacancies_list = []
-    with connection.cursor() as cursor:
-        try:
-            cursor.execute(f"SELECT `vacancy_id`, `vacancy_url`, `vacancy_name` "
-                           f"FROM `{table}` WHERE `sent_to_user` = 0;")
-            vacancies_list = cursor.fetchall()
-        except Exception as e:
-            error = True
-            logging.error(f"Collecting the users' telegram ids table failed: {e}", exc_info=True)
-    connection.close()
-    logging.info(texts.connection_closed)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute("SELECT `vacancy_id`, `vacancy_url`, `vacancy_name` "
+                               "FROM `vacancies` WHERE `telegram_id` = %s AND `sent_to_user` = 0;",
+                               (telegram_id,))
+                vacancies_list = cursor.fetchall()
+            except Exception as e:
+                error = True
+                logging.error(f"Collecting the user's unsent vacancies failed: {e}",
+                              exc_info=True)
     if error:
         return False
     else:
         return vacancies_list
 
 
-def update_sent_to_user(table, vacancy_id, state):
-    """Updates the sent_to_user parameter in the user's vacancies table
+def get_watermark(telegram_id):
+    """Gets the time of the user's last check and the ids of the newest vacancies known by then.
 
-    :param table: the name of the table which we are performing the operation upon
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
+
+    :return: a tuple like (datetime, ['87654321', '87654320']), None if the user has never
+             been checked, or False if something went wrong
+    :rtype: tuple or None or bool
+    """
+    error = False
+    watermark = None
+    logging.info(f'Getting the watermark of the user {telegram_id}...')
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute("SELECT `checked_at`, `known_ids` FROM `watermarks` "
+                               "WHERE `telegram_id` = %s;", (telegram_id,))
+                result = cursor.fetchone()
+                if result is not None:
+                    known_ids = result[1].split(',') if result[1] else []
+                    watermark = (result[0], known_ids)
+            except Exception as e:
+                logging.error(f'Getting the watermark of the user {telegram_id} failed: {e}',
+                              exc_info=True)
+                error = True
+
+    if error:
+        return False
+    else:
+        return watermark
+
+
+def invalidate_jobs_or_stops(table, telegram_id):
+    """Drops the cached job names or stop words of the user. Must be called
+    whenever they are changed in the DB.
+
+    :param table: the name of the table ('jobs' or 'stops')
     :type table: str
-    :param vacancy_id: the id of the vacancy
-    :type vacancy_id: str or int
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
+    """
+    key = (table, str(telegram_id))
+    with user_data_cache.key_lock(key):
+        user_data_cache.delete(key)
+
+
+def partition_vacancies(months_ahead=2):
+    """Converts the vacancies table (MySQL only) to a table partitioned by month
+    of `vacancy_date`, with a partition for every month from the oldest vacancy
+    to months_ahead months after the current one, and the catch-all `pmax` partition.
+    MySQL requires every unique key of a partitioned table to include `vacancy_date`,
+    so the keys are extended with it. The whole table is rebuilt, so this is done once,
+    by hand (see retention.py), and the 'partitioning' option of the [retention]
+    section is set afterwards.
+
+    :param months_ahead: the number of the months after the current one to prepare
+    :type months_ahead: int
+
+    :return: True or False, depending on whether the function has been executed correctly or not
+    :rtype: bool
+    """
+    if backend.name != 'mysql':
+        logging.error('Only the MySQL vacancies table can be partitioned.')
+        return False
+    error = False
+    logging.info('Partitioning the vacancies table...')
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                if _get_vacancies_partitions(cursor):
+                    logging.info('The vacancies table is partitioned already.')
+                    return True
+                cursor.execute("SELECT MIN(`vacancy_date`) FROM `vacancies`;")
+                oldest_date = cursor.fetchone()[0] or date.today()
+                month = oldest_date.replace(day=1)
+                last_month = _add_months(date.today().replace(day=1), months_ahead)
+                partitions = []
+                while month <= last_month:
+                    partitions.append(_month_partition(month))
+                    month = _add_months(month, 1)
+                partitions.append("PARTITION `pmax` VALUES LESS THAN MAXVALUE")
+                cursor.execute("ALTER TABLE `vacancies` "
+                               "DROP PRIMARY KEY, "
+                               "ADD PRIMARY KEY (`vacancy_id`, `vacancy_date`), "
+                               "DROP INDEX `telegram_id_vacancy_url`, "
+                               "ADD UNIQUE KEY `telegram_id_vacancy_url` "
+                               "(`telegram_id`, `vacancy_url`, `vacancy_date`) "
+                               "PARTITION BY RANGE (TO_DAYS(`vacancy_date`)) "
+                               f"({', '.join(partitions)});")
+                logging.info(f'The vacancies table partitioned into {len(partitions)} partitions.')
+            except Exception as e:
+                logging.error(f'An attempt to partition the vacancies table failed: {e}',
+                              exc_info=True)
+                error = True
+
+    if error:
+        return False
+    else:
+        return True
+
+
+def set_digest_mode(telegram_id, digest_mode):
+    """Turns the user's digest mode on or off. In the digest mode, the vacancies
+    are packed into as few messages as possible instead of being sent one by one.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
+    :param digest_mode: whether the digest mode should be on
+    :type digest_mode: bool
+
+    :return: True or False, depending on whether the function has been executed correctly or not
+    :rtype: bool
+    """
+    error = False
+    logging.info(f'Setting the digest mode of the user {telegram_id} to {digest_mode}...')
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(backend.upsert_query('settings', ['telegram_id', 'digest_mode'],
+                                                    'telegram_id'),
+                               (telegram_id, int(digest_mode)))
+                connection.commit()
+            except Exception as e:
+                logging.error(f'Setting the digest mode of the user {telegram_id} failed: {e}',
+                              exc_info=True)
+                error = True
+
+    if error:
+        return False
+    else:
+        return True
+
+
+def set_watermark(telegram_id, checked_at, known_ids):
+    """Saves the time of the user's last check and the ids of the newest vacancies known by then.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
+    :param checked_at: the time the check has been started at
+    :type checked_at: datetime.datetime
+    :param known_ids: hh.ru ids of the newest vacancies, the newest one being the first
+    :type known_ids: list
+
+    :return: True or False, depending on whether the function has been executed correctly or not
+    :rtype: bool
+    """
+    error = False
+    logging.info(f'Saving the watermark of the user {telegram_id}...')
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(backend.upsert_query('watermarks',
+                                                    ['telegram_id', 'checked_at', 'known_ids'],
+                                                    'telegram_id'),
+                               (telegram_id, checked_at, ','.join(known_ids)))
+                connection.commit()
+            except Exception as e:
+                logging.error(f'Saving the watermark of the user {telegram_id} failed: {e}',
+                              exc_info=True)
+                error = True
+
+    if error:
+        return False
+    else:
+        return True
+
+
+def update_sent_to_user(telegram_id, vacancy_ids, state):
+    """Updates the sent_to_user parameter for a batch of the user's vacancies
+    with a single UPDATE in a single transaction.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: int or str
+    :param vacancy_ids: the ids of the vacancies
+    :type vacancy_ids: list
     :param state: the new state for the sent_to_user parameter (0 - false, 1 - true)
     :type state: int
 
     :return: True or False, depending on whether the function has been executed correctly or not
     :rtype: bool
     """
+    if len(vacancy_ids) == 0:
+        return True
     error = False
-    logging.info(f'Updating the \'sent_to_user\' field for {vacancy_id} '
-                 f'in the \'{table}\' table...')
-    connection = access_to_db(**db_config)
-    with connection.cursor() as cursor:
-        try:
-            cursor.execute(f"UPDATE `{table}` "
-                           f"SET `sent_to_user` = '{state}' "
-                           f"WHERE `vacancy_id` = '{vacancy_id}';")
-            connection.commit()
-            logging.info(f'The \'sent_to_user\' field for {vacancy_id} in the \'{table}\' updated.')
-        except Exception as e:
-            logging.error(f'Update of \'sent_to_user\' for {vacancy_id} in the \'{table}\' failed: '
-                          f'{e}', exc_info=True)
-            error = True
+    logging.info(f'Updating the \'sent_to_user\' field for {len(vacancy_ids)} vacancies '
+                 f'of the user {telegram_id}...')
+    update_query = "UPDATE `vacancies` SET `sent_to_user` = %s " \
+                   "WHERE `telegram_id` = %s AND `vacancy_id` IN (" \
+                   + ', '.join(['%s'] * len(vacancy_ids)) + ');'
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(update_query, [state, telegram_id, *vacancy_ids])
+                connection.commit()
+                logging.info(f'The \'sent_to_user\' field for {len(vacancy_ids)} vacancies '
+                             f'of the user {telegram_id} updated.')
+            except Exception as e:
+                logging.error(f'Update of \'sent_to_user\' for {vacancy_ids} of the user '
+                              f'{telegram_id} failed: {e}', exc_info=True)
+                error = True
 
-    connection.close()
-    logging.info(texts.connection_closed)
     if error:
         return False
     else:
         return True
+
+
+def warm_up_known_users():
+    """Fills the known users cache with the users present in the DB.
+
+    :return: True or False, depending on whether the function has been executed correctly or not
+    :rtype: bool
+    """
+    telegram_ids = get_users()
+    if telegram_ids is False:
+        return False
+    for telegram_id in telegram_ids[:known_users.maxsize]:
+        known_users.set(telegram_id, True)
+    logging.info(f'{len(known_users)} users added to the known users cache.')
+    return True
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import db
+import metrics
+
+# The functions of the db module are blocking (mysql.connector is synchronous, and
+# connecting to the database may take up to 50 seconds of retries), so they are run
+# in a dedicated thread pool. There is no point in having more threads than connections
+# in the pool, since the extra threads would only wait for a free connection.
+executor = ThreadPoolExecutor(max_workers=db.pool.max_size, thread_name_prefix='db')
+
+
+async def run_in_executor(function, *args, **kwargs):
+    """Runs a blocking function of the db module in the DB thread pool
+    without blocking the event loop.
+
+    :param function: a blocking function
+    :type function: callable
+
+    :return: whatever the function returns
+    """
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+
+    def call():
+        # Both the time spent waiting for a free thread and the time of the call itself
+        # are measured.
+        metrics.db_executor_wait_seconds.observe(time.perf_counter() - submitted)
+        with metrics.db_call_seconds.time(function=function.__name__):
+            return function(*args, **kwargs)
+
+    return await loop.run_in_executor(executor, call)
+
+
+async def add_jobs_or_stops(table, telegram_id, data_list):
+    return await run_in_executor(db.add_jobs_or_stops, table, telegram_id, data_list)
+
+
+async def add_user_if_none(message):
+    return await run_in_executor(db.add_user_if_none, message)
+
+
+async def add_vacancies(telegram_id, vacancies_dict):
+    return await run_in_executor(db.add_vacancies, telegram_id, vacancies_dict)
+
+
+async def add_vacancies_partitions(months_ahead=2):
+    return await run_in_executor(db.add_vacancies_partitions, months_ahead)
+
+
+async def check_if_jobs_empty(message):
+    return await run_in_executor(db.check_if_jobs_empty, message)
+
+
+async def clean_up_db_table(table, telegram_id):
+    return await run_in_executor(db.clean_up_db_table, table, telegram_id)
+
+
+async def count_jobs_or_stops(table, telegram_id):
+    return await run_in_executor(db.count_jobs_or_stops, table, telegram_id)
+
+
+async def create_tables():
+    return await run_in_executor(db.create_tables)
+
+
+async def delete_old_vacancies(expiration_date, batch_size):
+    return await run_in_executor(db.delete_old_vacancies, expiration_date, batch_size)
+
+
+async def delete_record(table, telegram_id, column_name, record):
+    return await run_in_executor(db.delete_record, table, telegram_id, column_name, record)
+
+
+async def delete_user(telegram_id):
+    return await run_in_executor(db.delete_user, telegram_id)
+
+
+async def drop_old_vacancies_partitions(expiration_date):
+    return await run_in_executor(db.drop_old_vacancies_partitions, expiration_date)
+
+
+async def get_jobs_or_stops(table, telegram_id):
+    return await run_in_executor(db.get_jobs_or_stops, table, telegram_id)
+
+
+async def get_jobs_or_stops_list(table, telegram_id):
+    return await run_in_executor(db.get_jobs_or_stops_list, table, telegram_id)
+
+
+async def get_settings(telegram_id):
+    return await run_in_executor(db.get_settings, telegram_id)
+
+
+async def get_users():
+    return await run_in_executor(db.get_users)
+
+
+async def get_vacancies(telegram_id):
+    return await run_in_executor(db.get_vacancies, telegram_id)
+
+
+async def get_watermark(telegram_id):
+    return await run_in_executor(db.get_watermark, telegram_id)
+
+
+async def set_digest_mode(telegram_id, digest_mode):
+    return await run_in_executor(db.set_digest_mode, telegram_id, digest_mode)
+
+
+async def set_watermark(telegram_id, checked_at, known_ids):
+    return await run_in_executor(db.set_watermark, telegram_id, checked_at, known_ids)
+
+
+async def update_sent_to_user(telegram_id, vacancy_ids, state):
+    return await run_in_executor(db.update_sent_to_user, telegram_id, vacancy_ids, state)
+
+
+async def warm_up_known_users():
+    return await run_in_executor(db.warm_up_known_users)
+
+
+def shutdown():
+    """Waits for the running DB calls to finish and closes the idle connections."""
+    executor.shutdown(wait=True)
+    db.pool.close_all()
@@ -0,0 +1,251 @@
+"""The database engines db.py can work with: MySQL, and an embedded SQLite for the
+single-node deployments, the benchmarks and the tests. The engine is chosen with
+the 'backend' option of the [database] section of config.ini.
+
+The queries of db.py are written for MySQL (with %s placeholders and backticks).
+A backend provides its own DDL and the statements which differ between the dialects;
+the SQLite connections translate the placeholders on the fly.
+"""
+import datetime
+import logging
+import sqlite3
+
+logging.basicConfig(level=logging.INFO,
+                    filename="jobmonitoringbot.log",
+                    filemode="a",
+                    format="%(asctime)s %(levelname)s %(message)s")
+
+
+class MySQLBackend:
+    name = 'mysql'
+    insert_ignore = 'INSERT IGNORE'
+
+    # All the users' data lives in these shared tables and is keyed by telegram_id.
+    tables_create_queries = {
+        'users': "CREATE TABLE IF NOT EXISTS `users` ("
+                 "`telegram_id` BIGINT UNSIGNED PRIMARY KEY NOT NULL, "
+                 "`telegram_name` VARCHAR(64)) ENGINE=InnoDB;",
+        'vacancies': "CREATE TABLE IF NOT EXISTS `vacancies` ("
+                     "`vacancy_id` INT UNSIGNED PRIMARY KEY AUTO_INCREMENT NOT NULL, "
+                     "`telegram_id` BIGINT UNSIGNED NOT NULL, "
+                     "`vacancy_url` VARCHAR(256) NOT NULL, "
+                     "`vacancy_name` VARCHAR(512) NOT NULL, "
+                     "`vacancy_date` DATE NOT NULL, "
+                     "`sent_to_user` TINYINT NOT NULL, "
+                     "UNIQUE KEY `telegram_id_vacancy_url` (`telegram_id`, `vacancy_url`), "
+                     "KEY `telegram_id_sent_to_user` (`telegram_id`, `sent_to_user`), "
+                     "KEY `vacancy_date` (`vacancy_date`)) ENGINE=InnoDB;",
+        'jobs': "CREATE TABLE IF NOT EXISTS `jobs` ("
+                "`job_name_id` INT UNSIGNED PRIMARY KEY AUTO_INCREMENT NOT NULL, "
+                "`telegram_id` BIGINT UNSIGNED NOT NULL, "
+                "`job_name` VARCHAR(128) NOT NULL, "
+                "UNIQUE KEY `telegram_id_job_name` (`telegram_id`, `job_name`)) ENGINE=InnoDB;",
+        'stops': "CREATE TABLE IF NOT EXISTS `stops` ("
+                 "`stop_word_id` INT UNSIGNED PRIMARY KEY AUTO_INCREMENT NOT NULL, "
+                 "`telegram_id` BIGINT UNSIGNED NOT NULL, "
+                 "`stop_word` VARCHAR(128) NOT NULL, "
+                 "UNIQUE KEY `telegram_id_stop_word` (`telegram_id`, `stop_word`)) ENGINE=InnoDB;",
+        # The time of the user's last check and the ids of the newest vacancies seen by then,
+        # which make it possible to scrape only what has been published since.
+        'watermarks': "CREATE TABLE IF NOT EXISTS `watermarks` ("
+                      "`telegram_id` BIGINT UNSIGNED PRIMARY KEY NOT NULL, "
+                      "`checked_at` DATETIME NOT NULL, "
+                      "`known_ids` TEXT NOT NULL) ENGINE=InnoDB;",
+        # The users' preferences. A user without a row here has the default ones.
+        'settings': "CREATE TABLE IF NOT EXISTS `settings` ("
+                    "`telegram_id` BIGINT UNSIGNED PRIMARY KEY NOT NULL, "
+                    "`digest_mode` TINYINT NOT NULL DEFAULT 0) ENGINE=InnoDB;"}
+    # MySQL creates the indexes along with the tables.
+    indexes_create_queries = dict()
+
+    def __init__(self, connect_function):
+        """
+        :param connect_function: a function which connects to MySQL (with retries)
+                                 and returns the connection or None
+        :type connect_function: callable
+        """
+        self.connect = connect_function
+
+    @staticmethod
+    def batch_delete_query(table, condition):
+        """Builds a DELETE of no more than a given number of the rows matching the condition.
+
+        :param table: the name of the table
+        :type table: str
+        :param condition: the WHERE condition (it should be served by an index)
+        :type condition: str
+
+        :return: the query with a %s placeholder for the number of rows at the end
+        :rtype: str
+        """
+        return f"DELETE FROM `{table}` WHERE {condition} LIMIT %s;"
+
+    @staticmethod
+    def upsert_query(table, columns, key_column):
+        """Builds an INSERT which updates the row if there is one with the same key already.
+
+        :param table: the name of the table
+        :type table: str
+        :param columns: the names of the columns, the key one included
+        :type columns: list
+        :param key_column: the name of the primary key column
+        :type key_column: str
+
+        :return: the query with a %s placeholder for every column
+        :rtype: str
+        """
+        columns_str = ', '.join(f'`{column}`' for column in columns)
+        updates_str = ', '.join(f'`{column}` = VALUES(`{column}`)'
+                                for column in columns if column != key_column)
+        return f"INSERT INTO `{table}` ({columns_str}) " \
+               f"VALUES ({', '.join(['%s'] * len(columns))}) " \
+               f"ON DUPLICATE KEY UPDATE {updates_str};"
+
+
+class SQLiteCursor:
+    """A cursor which understands the %s placeholders and works as a context manager,
+    like the cursors of mysql.connector.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, query, params=()):
+        return self._cursor.execute(query.replace('%s', '?'), params)
+
+    def executemany(self, query, params_list):
+        return self._cursor.executemany(query.replace('%s', '?'), params_list)
+
+
+class SQLiteConnection:
+    """A connection to the SQLite file with the interface db.py expects from mysql.connector."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self):
+        return SQLiteCursor(self._connection.cursor())
+
+    def is_connected(self):
+        try:
+            self._connection.execute("SELECT 1;")
+        except sqlite3.Error:
+            return False
+        return True
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+    insert_ignore = 'INSERT OR IGNORE'
+
+    tables_create_queries = {
+        'users': "CREATE TABLE IF NOT EXISTS `users` ("
+                 "`telegram_id` INTEGER PRIMARY KEY NOT NULL, "
+                 "`telegram_name` TEXT);",
+        'vacancies': "CREATE TABLE IF NOT EXISTS `vacancies` ("
+                     "`vacancy_id` INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                     "`telegram_id` INTEGER NOT NULL, "
+                     "`vacancy_url` TEXT NOT NULL, "
+                     "`vacancy_name` TEXT NOT NULL, "
+                     "`vacancy_date` DATE NOT NULL, "
+                     "`sent_to_user` INTEGER NOT NULL, "
+                     "UNIQUE (`telegram_id`, `vacancy_url`));",
+        'jobs': "CREATE TABLE IF NOT EXISTS `jobs` ("
+                "`job_name_id` INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                "`telegram_id` INTEGER NOT NULL, "
+                "`job_name` TEXT NOT NULL, "
+                "UNIQUE (`telegram_id`, `job_name`));",
+        'stops': "CREATE TABLE IF NOT EXISTS `stops` ("
+                 "`stop_word_id` INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                 "`telegram_id` INTEGER NOT NULL, "
+                 "`stop_word` TEXT NOT NULL, "
+                 "UNIQUE (`telegram_id`, `stop_word`));",
+        'watermarks': "CREATE TABLE IF NOT EXISTS `watermarks` ("
+                      "`telegram_id` INTEGER PRIMARY KEY NOT NULL, "
+                      "`checked_at` DATETIME NOT NULL, "
+                      "`known_ids` TEXT NOT NULL);",
+        'settings': "CREATE TABLE IF NOT EXISTS `settings` ("
+                    "`telegram_id` INTEGER PRIMARY KEY NOT NULL, "
+                    "`digest_mode` INTEGER NOT NULL DEFAULT 0);"}
+    # SQLite can't declare the secondary indexes inside CREATE TABLE.
+    indexes_create_queries = {
+        'vacancies_telegram_id_sent_to_user':
+            "CREATE INDEX IF NOT EXISTS `vacancies_telegram_id_sent_to_user` "
+            "ON `vacancies` (`telegram_id`, `sent_to_user`);",
+        'vacancies_vacancy_date':
+            "CREATE INDEX IF NOT EXISTS `vacancies_vacancy_date` ON `vacancies` (`vacancy_date`);"}
+
+    def __init__(self, path):
+        """
+        :param path: the path to the database file
+        :type path: str
+        """
+        self.path = path
+
+    def connect(self):
+        logging.info(f'Opening the SQLite database {self.path}...')
+        # The pool hands the connections to different threads (one at a time).
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        # The WAL mode lets the readers work while somebody writes.
+        connection.execute("PRAGMA journal_mode=WAL;")
+        connection.execute("PRAGMA synchronous=NORMAL;")
+        return SQLiteConnection(connection)
+
+    @staticmethod
+    def batch_delete_query(table, condition):
+        """Builds a DELETE of no more than a given number of the rows matching the condition.
+        SQLite is usually built without DELETE ... LIMIT, so the rows are picked by a subquery.
+
+        :param table: the name of the table
+        :type table: str
+        :param condition: the WHERE condition (it should be served by an index)
+        :type condition: str
+
+        :return: the query with a %s placeholder for the number of rows at the end
+        :rtype: str
+        """
+        return f"DELETE FROM `{table}` WHERE `rowid` IN " \
+               f"(SELECT `rowid` FROM `{table}` WHERE {condition} LIMIT %s);"
+
+    @staticmethod
+    def upsert_query(table, columns, key_column):
+        """Builds an INSERT which updates the row if there is one with the same key already.
+
+        :param table: the name of the table
+        :type table: str
+        :param columns: the names of the columns, the key one included
+        :type columns: list
+        :param key_column: the name of the primary key column
+        :type key_column: str
+
+        :return: the query with a %s placeholder for every column
+        :rtype: str
+        """
+        columns_str = ', '.join(f'`{column}`' for column in columns)
+        updates_str = ', '.join(f'`{column}` = excluded.`{column}`'
+                                for column in columns if column != key_column)
+        return f"INSERT INTO `{table}` ({columns_str}) " \
+               f"VALUES ({', '.join(['%s'] * len(columns))}) " \
+               f"ON CONFLICT (`{key_column}`) DO UPDATE SET {updates_str};"
+
+
+# The dates are stored as ISO strings and turned back into the date and datetime objects
+# by the declared types of the columns.
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATE', lambda value: datetime.date.fromisoformat(value.decode()))
+sqlite3.register_converter('DATETIME',
+                           lambda value: datetime.datetime.fromisoformat(value.decode()))
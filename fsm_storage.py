@@ -0,0 +1,179 @@
+import asyncio
+import copy
+import functools
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aiogram.dispatcher.storage import BaseStorage
+from cache import LRUCache
+
+logging.basicConfig(level=logging.INFO,
+                    filename="jobmonitoringbot.log",
+                    filemode="a",
+                    format="%(asctime)s %(levelname)s %(message)s")
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage kept in a local SQLite file (in the WAL mode), so that the flows
+    the users are in survive restarts.
+
+    The states which haven't been touched for ttl seconds are considered abandoned
+    and are deleted. The recently used records are kept in an in-process LRU cache,
+    so reading the state of an active user doesn't touch the disk at all.
+    """
+
+    def __init__(self, path='fsm.sqlite3', ttl=86400, cache_size=1024, purge_interval=600):
+        """
+        :param path: the path to the SQLite file (':memory:' keeps everything in memory)
+        :type path: str
+        :param ttl: the number of seconds an untouched state is kept for
+        :type ttl: int or float
+        :param cache_size: the number of records kept in the read cache
+        :type cache_size: int
+        :param purge_interval: the number of seconds between the deletions of the abandoned states
+        :type purge_interval: int or float
+        """
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._cache = LRUCache(maxsize=cache_size)
+        # A single thread does all the work with the file, so the writes are applied
+        # in the order they are made, and the connection is never shared between threads.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm')
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL;")
+        self._connection.execute("PRAGMA synchronous=NORMAL;")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS fsm ("
+                                 "chat TEXT NOT NULL, "
+                                 "user TEXT NOT NULL, "
+                                 "state TEXT, "
+                                 "data TEXT NOT NULL, "
+                                 "bucket TEXT NOT NULL, "
+                                 "updated_at REAL NOT NULL, "
+                                 "PRIMARY KEY (chat, user));")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS fsm_updated_at ON fsm (updated_at);")
+        self._last_purge = 0
+
+    async def close(self):
+        await self._run(self._purge)
+        self._executor.shutdown(wait=True)
+        self._connection.close()
+        self._cache.clear()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        record = await self._get_record(chat, user)
+        if record['state'] is None:
+            return self.resolve_state(default)
+        return record['state']
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record['data'])
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        record = await self._get_record(chat, user)
+        record['state'] = self.resolve_state(state)
+        await self._put_record(chat, user, record)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        record = await self._get_record(chat, user)
+        record['data'] = copy.deepcopy(data or {})
+        await self._put_record(chat, user, record)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        record = await self._get_record(chat, user)
+        record['data'].update(data or {}, **kwargs)
+        await self._put_record(chat, user, record)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        record = await self._get_record(chat, user)
+        record['state'] = None
+        if with_data:
+            record['data'] = {}
+        await self._put_record(chat, user, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        record = await self._get_record(chat, user)
+        return copy.deepcopy(record['bucket'])
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        record = await self._get_record(chat, user)
+        record['bucket'] = copy.deepcopy(bucket or {})
+        await self._put_record(chat, user, record)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        record = await self._get_record(chat, user)
+        record['bucket'].update(bucket or {}, **kwargs)
+        await self._put_record(chat, user, record)
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args))
+
+    async def _get_record(self, chat, user):
+        # Returns the record of the cache itself, so it must be changed
+        # without awaiting anything before _put_record().
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        record = self._cache.get(key)
+        if record is None:
+            loaded_record = await self._run(self._select, *key)
+            # Somebody may have loaded and changed the record while we were reading it.
+            record = self._cache.get(key)
+            if record is None:
+                record = loaded_record
+                self._cache.set(key, record)
+        if time.time() - record['updated_at'] > self.ttl:
+            record.update(self._empty_record())
+        return record
+
+    async def _put_record(self, chat, user, record):
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        record['updated_at'] = time.time()
+        self._cache.set(key, record)
+        await self._run(self._write, *key, json.dumps(record['state']),
+                        json.dumps(record['data']), json.dumps(record['bucket']),
+                        record['updated_at'])
+
+    @staticmethod
+    def _empty_record():
+        return {'state': None, 'data': {}, 'bucket': {}, 'updated_at': time.time()}
+
+    def _select(self, chat, user):
+        row = self._connection.execute("SELECT state, data, bucket, updated_at FROM fsm "
+                                       "WHERE chat = ? AND user = ?;", (chat, user)).fetchone()
+        if row is None:
+            return self._empty_record()
+        return {'state': json.loads(row[0]),
+                'data': json.loads(row[1]),
+                'bucket': json.loads(row[2]),
+                'updated_at': row[3]}
+
+    def _write(self, chat, user, state, data, bucket, updated_at):
+        # A record without anything in it is not kept at all.
+        if state == 'null' and data == '{}' and bucket == '{}':
+            self._connection.execute("DELETE FROM fsm WHERE chat = ? AND user = ?;",
+                                     (chat, user))
+        else:
+            self._connection.execute("INSERT INTO fsm (chat, user, state, data, bucket, "
+                                     "updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                                     "ON CONFLICT (chat, user) DO UPDATE SET "
+                                     "state = excluded.state, data = excluded.data, "
+                                     "bucket = excluded.bucket, updated_at = excluded.updated_at;",
+                                     (chat, user, state, data, bucket, updated_at))
+        if time.monotonic() - self._last_purge > self.purge_interval:
+            self._purge()
+
+    def _purge(self):
+        self._last_purge = time.monotonic()
+        cursor = self._connection.execute("DELETE FROM fsm WHERE updated_at < ?;",
+                                          (time.time() - self.ttl,))
+        if cursor.rowcount:
+            logging.info(f'{cursor.rowcount} abandoned FSM states deleted.')
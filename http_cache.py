@@ -0,0 +1,154 @@
+"""A persistent cache of the pages the HTTP engine downloads from hh.ru.
+
+The responses are kept in a local SQLite file, keyed by the normalized URL, with their
+bodies compressed. A response is fresh for ttl seconds after it has been downloaded
+or revalidated, and is served without any request meanwhile. After that, it is
+revalidated with a conditional request (If-None-Match / If-Modified-Since) if the site
+has sent an ETag or a Last-Modified header, so an unchanged page costs a body-less
+304 response; otherwise it is simply downloaded again. Once the bodies take more than
+max_size bytes, the least recently used responses are evicted.
+"""
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logging.basicConfig(level=logging.INFO,
+                    filename="jobmonitoringbot.log",
+                    filemode="a",
+                    format="%(asctime)s %(levelname)s %(message)s")
+
+
+def normalize_url(url):
+    """Brings a URL to a canonical form, so that the URLs of the same page look the same:
+    the scheme and the host lowercased, the query parameters sorted, the fragment dropped.
+
+    :param url: a URL like 'HTTPS://spb.hh.ru/search/vacancy?text=python&area=2#top'
+    :type url: str
+
+    :return: a URL like 'https://spb.hh.ru/search/vacancy?area=2&text=python'
+    :rtype: str
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+
+class HTTPCache:
+    def __init__(self, path='http_cache.sqlite3', ttl=300, max_size=64 * 1024 * 1024):
+        """
+        :param path: the path to the SQLite file (':memory:' keeps everything in memory)
+        :type path: str
+        :param ttl: the number of seconds a response is served without revalidation
+        :type ttl: int or float
+        :param max_size: the maximum total size of the compressed bodies, in bytes
+        :type max_size: int
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        # The scrapes run in several threads, and the queries are short, so the threads
+        # share a single connection by turns.
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL;")
+        self._connection.execute("PRAGMA synchronous=NORMAL;")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                 "key TEXT PRIMARY KEY NOT NULL, "
+                                 "url TEXT NOT NULL, "
+                                 "body BLOB NOT NULL, "
+                                 "etag TEXT, "
+                                 "last_modified TEXT, "
+                                 "stored_at REAL NOT NULL, "
+                                 "accessed_at REAL NOT NULL);")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                                 "ON responses (accessed_at);")
+        self._size = self._connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses;").fetchone()[0]
+        self._stats = {'hits': 0, 'revalidations': 0, 'not_modified': 0, 'misses': 0,
+                       'evictions': 0}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get(self, session, url, timeout=None):
+        """Returns the page from the cache if it is fresh, revalidates or downloads it otherwise.
+
+        :param session: a requests session
+        :type session: requests.Session
+        :param url: the URL of the page
+        :type url: str
+        :param timeout: the timeout of the request, in seconds
+        :type timeout: int or float or None
+
+        :return: the body of the page and its URL (the one after the redirects)
+        :rtype: tuple
+        """
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._connection.execute(
+                "SELECT url, body, etag, last_modified, stored_at FROM responses WHERE key = ?;",
+                (key,)).fetchone()
+            if entry is not None and time.time() - entry[4] < self.ttl:
+                self._stats['hits'] += 1
+                self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?;",
+                                         (time.time(), key))
+                return zlib.decompress(entry[1]), entry[0]
+
+        headers = dict()
+        if entry is not None:
+            if entry[2]:
+                headers['If-None-Match'] = entry[2]
+            if entry[3]:
+                headers['If-Modified-Since'] = entry[3]
+        response = session.get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self._stats['revalidations'] += 1
+                self._stats['not_modified'] += 1
+                now = time.time()
+                self._connection.execute(
+                    "UPDATE responses SET etag = COALESCE(?, etag), "
+                    "last_modified = COALESCE(?, last_modified), stored_at = ?, accessed_at = ? "
+                    "WHERE key = ?;", (response.headers.get('ETag'),
+                                       response.headers.get('Last-Modified'), now, now, key))
+            return zlib.decompress(entry[1]), entry[0]
+        response.raise_for_status()
+
+        with self._lock:
+            self._stats['revalidations' if headers else 'misses'] += 1
+            body = zlib.compress(response.content)
+            now = time.time()
+            old_body = self._connection.execute("SELECT LENGTH(body) FROM responses WHERE key = ?;",
+                                                (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, url, body, etag, last_modified, "
+                "stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?);",
+                (key, response.url, body, response.headers.get('ETag'),
+                 response.headers.get('Last-Modified'), now, now))
+            self._size += len(body) - (old_body[0] if old_body else 0)
+            self._evict()
+        return response.content, response.url
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = self._connection.execute(
+                "SELECT COUNT(*) FROM responses;").fetchone()[0]
+        stats['size'] = self._size
+        return stats
+
+    def _evict(self):
+        # Must be called with the lock held.
+        while self._size > self.max_size:
+            oldest = self._connection.execute(
+                "SELECT key, LENGTH(body) FROM responses ORDER BY accessed_at LIMIT 1;").fetchone()
+            if oldest is None:
+                self._size = 0
+                break
+            self._connection.execute("DELETE FROM responses WHERE key = ?;", (oldest[0],))
+            self._size -= oldest[1]
+            self._stats['evictions'] += 1
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+
+logging.basicConfig(level=logging.INFO,
+                    filename="jobmonitoringbot.log",
+                    filemode="a",
+                    format="%(asctime)s %(levelname)s %(message)s")
+
+
+class StaggeredScheduler:
+    """Runs periodic jobs, each of them with its own due time, keeping them in a heap
+    and sleeping until the earliest one is due.
+
+    No more than max_concurrency jobs run at once; a job which is due while all the slots
+    are busy waits for a free one. A job's next run is due an interval after its previous
+    due time, so the jobs keep the spacing they have been given.
+    """
+
+    def __init__(self, max_concurrency=4):
+        """
+        :param max_concurrency: the maximum number of jobs running at once
+        :type max_concurrency: int
+        """
+        self.max_concurrency = max_concurrency
+        # Jobs are stored as key: [function, interval, due time]. The heap keeps
+        # (due time, sequence number, key) tuples; the tuples of the removed or rescheduled
+        # jobs stay in it and are skipped once they come up.
+        self._jobs = dict()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._slots = None
+        self._wakeup = None
+        self._running = set()
+        self._stats = {'runs': 0, 'failures': 0, 'late_starts': 0, 'lateness': 0.0}
+
+    def __contains__(self, key):
+        return key in self._jobs
+
+    def keys(self):
+        return list(self._jobs)
+
+    def add(self, key, function, interval, delay=0):
+        """Schedules a job, replacing the one with the same key if there is one.
+
+        :param key: a hashable key of the job, like ('check', '123456')
+        :param function: a coroutine function without arguments
+        :type function: callable
+        :param interval: the number of seconds between the runs
+        :type interval: int or float
+        :param delay: the number of seconds until the first run
+        :type delay: int or float
+        """
+        due = time.monotonic() + delay
+        self._jobs[key] = [function, interval, due]
+        heapq.heappush(self._heap, (due, next(self._sequence), key))
+        if self._wakeup is not None and self._heap[0][2] == key:
+            self._wakeup.set()
+
+    def add_spread(self, jobs, interval, jitter=0.1):
+        """Schedules a batch of jobs with their first runs spread evenly over the interval:
+        each job gets its own slot of interval / len(jobs) seconds, and the jitter shifts
+        it randomly within its slot.
+
+        :param jobs: a dictionary like {key: coroutine function}
+        :type jobs: dict
+        :param interval: the number of seconds between the runs of every job
+        :type interval: int or float
+        :param jitter: the share of a slot a job can be shifted by (from 0 to 1)
+        :type jitter: float
+        """
+        if not jobs:
+            return
+        slot = interval / len(jobs)
+        # The slots start at a random point, so that a batch of a single job
+        # doesn't always go at the same moment.
+        phase = random.random()
+        for number, (key, function) in enumerate(jobs.items()):
+            offset = number + phase + (random.random() - 0.5) * jitter
+            self.add(key, function, interval, delay=(offset % len(jobs)) * slot)
+
+    def remove(self, key):
+        self._jobs.pop(key, None)
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['jobs'] = len(self._jobs)
+        stats['running'] = len(self._running)
+        stats['next_due_in'] = round(self._heap[0][0] - time.monotonic(), 1) if self._heap else 0
+        return stats
+
+    async def run(self):
+        """Runs the jobs until it is cancelled."""
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                if not self._heap:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                entry = self._heap[0]
+                due, _, key = entry
+                job = self._jobs.get(key)
+                if job is None or job[2] != due:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = due - time.monotonic()
+                if delay > 0:
+                    # Sleeping until the job is due, or until an earlier job is added.
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._slots.acquire()
+                # While waiting for a slot, an earlier job may have been added on top
+                # of the heap, or this one may have been removed or rescheduled.
+                if not self._heap or self._heap[0] is not entry \
+                        or self._jobs.get(key) is not job or job[2] != due:
+                    self._slots.release()
+                    continue
+                heapq.heappop(self._heap)
+                lateness = time.monotonic() - due
+                if lateness > 1:
+                    self._stats['late_starts'] += 1
+                    self._stats['lateness'] += lateness
+                function, interval, _ = job
+                # A job which is far behind its schedule (e.g. the bot has been asleep)
+                # doesn't try to catch up with all the missed runs.
+                next_due = due + interval
+                if next_due <= time.monotonic():
+                    next_due = time.monotonic() + interval
+                job[2] = next_due
+                heapq.heappush(self._heap, (next_due, next(self._sequence), key))
+                task = asyncio.create_task(self._run_job(key, function))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+        finally:
+            for task in list(self._running):
+                task.cancel()
+
+    async def _run_job(self, key, function):
+        try:
+            await function()
+            self._stats['runs'] += 1
+        except Exception as e:
+            self._stats['failures'] += 1
+            logging.error(f'The scheduled job {key} failed: {e}', exc_info=True)
+        finally:
+            self._slots.release()
@@ -1,21 +1,62 @@
 import configparser
+import datetime
+import functools
 import logging
-import aioschedule
 import asyncio
 from aiogram import Bot, Dispatcher, executor, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.utils.exceptions import BotBlocked
 import db
+import db_async
+import fsm_storage
+import job_scheduler
+import metrics
+import retention
+import sender
+import stop_words
 import utils
 import texts
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 config = configparser.ConfigParser()
 config.read('config.ini', encoding='utf-8-sig')
 bot_token = config.get('telegram', 'token')
 admin_id = int(config.get('telegram', 'admin_id'))
+# Delivery acknowledgements ('sent_to_user' flags) are written in batches.
+ack_batch_size = config.getint('delivery', 'ack_batch_size', fallback=20)
+ack_flush_interval = config.getint('delivery', 'ack_flush_interval', fallback=1000)  # ms
+# The number of users checked concurrently during the regular check, and the number of
+# seconds a single user's check may take.
+check_workers = config.getint('scheduler', 'workers', fallback=4)
+check_timeout = config.getint('scheduler', 'user_timeout', fallback=600)
+# Every user is checked once per check_interval seconds, the checks of different users being
+# spread evenly over the interval (and shifted randomly by check_jitter of a user's share).
+# The list of users is re-read every users_refresh_interval seconds.
+check_interval = config.getint('scheduler', 'interval', fallback=6 * 60 * 60)
+check_jitter = config.getfloat('scheduler', 'jitter', fallback=0.5)
+# 'per_user' checks every user with a scrape of the user's own query; 'shared' scrapes every
+# distinct job name once per check interval and hands the results to all its users.
+check_mode = config.get('scheduler', 'mode', fallback='per_user')
+users_refresh_interval = config.getint('scheduler', 'users_refresh_interval', fallback=600)
+# Telegram's flood limits: messages per second for all the chats together and for a single chat.
+send_rate = config.getint('telegram', 'send_rate', fallback=30)
+chat_send_rate = config.getfloat('telegram', 'chat_send_rate', fallback=1)
+chat_send_burst = config.getint('telegram', 'chat_send_burst', fallback=3)
+# The users' FSM states are kept in a local SQLite file, and deleted if they haven't been
+# touched for fsm_ttl seconds.
+fsm_path = config.get('fsm', 'path', fallback='fsm.sqlite3')
+fsm_ttl = config.getint('fsm', 'ttl', fallback=86400)
+fsm_cache_size = config.getint('fsm', 'cache_size', fallback=1024)
+# The metrics are served on http://127.0.0.1:<port>/ and/or written to a file every
+# metrics_interval seconds; either is off if it is not set.
+metrics_port = config.getint('metrics', 'port', fallback=0)
+metrics_file = config.get('metrics', 'file', fallback='')
+metrics_interval = config.getint('metrics', 'interval', fallback=60)
+# The number of the newest vacancy ids kept in a user's watermark.
+watermark_size = config.getint('parser', 'watermark_size', fallback=500)
 
 logging.basicConfig(level=logging.INFO,
                     filename="jobmonitoringbot.log",
@@ -23,7 +64,36 @@ logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s %(levelname)s %(message)s")
 
 bot = Bot(token=bot_token)
-dp = Dispatcher(bot=bot, storage=MemoryStorage())
+dp = Dispatcher(bot=bot, storage=fsm_storage.SQLiteStorage(fsm_path, ttl=fsm_ttl,
+                                                           cache_size=fsm_cache_size))
+# All the messages are sent through the scheduler, which keeps the bot within the flood limits.
+outbox = sender.MessageScheduler(bot, global_rate=send_rate, chat_rate=chat_send_rate,
+                                 chat_burst=chat_send_burst)
+# The regular checks of the users and the other periodic jobs.
+scheduler = job_scheduler.StaggeredScheduler(max_concurrency=check_workers)
+# Scrapes are blocking, so they run in these threads instead of the event loop.
+scrape_executor = ThreadPoolExecutor(max_workers=check_workers, thread_name_prefix='scrape')
+# The counters of the pools and the caches are exported along with the metrics.
+metrics.add_collector('db_pool', db.pool.get_stats)
+metrics.add_collector('known_users_cache', db.known_users.get_stats)
+metrics.add_collector('user_data_cache', db.user_data_cache.get_stats)
+metrics.add_collector('scrape_cache', utils.scrape_cache.get_stats)
+metrics.add_collector('stop_words_cache', stop_words.matchers.get_stats)
+metrics.add_collector('outbox', outbox.get_stats)
+metrics.add_collector('scheduler', scheduler.get_stats)
+metrics.add_collector('retention', retention.get_stats)
+if utils.parser_engine == 'selenium':
+    metrics.add_collector('browser_pool', utils.browser_pool.get_stats)
+if utils.http_cache is not None:
+    metrics.add_collector('http_cache', utils.http_cache.get_stats)
+metrics_server = None
+scheduler_task = None
+# The latencies of the scheduled checks since the last summary of them (see
+# log_scheduled_checks()) along with whether they have succeeded, the time the summary
+# has been logged at, and the scrape cache's counters at that time.
+scheduled_checks = []
+summary_started = time.monotonic()
+summary_cache_stats = utils.scrape_cache.get_stats()
 
 
 # To keep the bot's states we need to create a class which is inherited from
@@ -39,7 +109,7 @@ async def cmd_start(message: types.Message):
     logging.info('The \'cmd_start\' function has been started.')
     if message.text.lower() == '/start':
         greeting = texts.bot_greeting
-        await message.answer(greeting)
+        await outbox.answer(message, greeting)
         logging.info(f'The bot started by {message.from_user.id}.')
 
 
@@ -51,34 +121,36 @@ async def acquire_data(message, table):
     # to send text only. The state the bot currently in stays the same,
     # so it continues to wait for user's data.
     if message.content_type != 'text' or message.text.startswith('/'):
-        await message.answer(texts.only_text_warning)
+        await outbox.answer(message, texts.only_text_warning)
         return
     # Splitting a string into pieces, using a comma as separator and removing spaces.
     data_list = re.split(r',\s*', message.text)
-    db_update_result = db.add_jobs_or_stops(table, data_list)
+    telegram_id = str(message.from_user.id)
+    db_update_result = await db_async.add_jobs_or_stops(table, telegram_id, data_list)
     return db_update_result
 
 
 @dp.message_handler(commands='delete_user', state='*')
 async def delete_user(message: types.Message):
     logging.info('The \'delete_user\' function has been started.')
-    if db.delete_user(message.from_user.id):
-        await message.answer(texts.user_deleted)
+    if await db_async.delete_user(message.from_user.id):
+        await outbox.answer(message, texts.user_deleted)
     else:
-        await message.answer(texts.user_not_exist)
+        await outbox.answer(message, texts.user_not_exist)
 
 
 @dp.message_handler(commands=['add_jobs', 'add_stops'], state='*')
 async def cmd_add_jobs_or_stops(message: types.Message, state: FSMContext):
     logging.info('The \'cmd_add_jobs_or_stops\' function has been started.')
-    db.add_user_if_none(message)  # checking if user exists and creating it if it doesn't
+    # Checking if user exists and creating it if it doesn't:
+    await db_async.add_user_if_none(message)
     # Putting the bot into the 'waiting_for_jobs_or_stops' statement.
     command = message.get_command()
     # command = message.text
     if command == '/add_jobs':
-        await message.answer(texts.add_jobs)
+        await outbox.answer(message, texts.add_jobs)
     if command == '/add_stops':
-        await message.answer(texts.add_stops)
+        await outbox.answer(message, texts.add_stops)
     await state.update_data(command=command)
     await state.set_state(GetUserData.waiting_for_jobs_or_stops.state)
 
@@ -88,19 +160,18 @@ async def jobs_or_stops_acquired(message: types.Message, state: FSMContext):
     logging.info('The \'jobs_or_stops_acquired\' function has been started.')
     command = await state.get_data()
     command = command['command']
-    telegram_id = str(message.from_user.id)
     table = str()
     if command == '/add_jobs':
-        table = '_'.join(['jobs', telegram_id])
+        table = 'jobs'
     if command == '/add_stops':
-        table = '_'.join(['stops', telegram_id])
+        table = 'stops'
     data_acquired = await acquire_data(message, table)
     if data_acquired and command == '/add_jobs':
-        await message.answer(texts.jobs_acquired)
+        await outbox.answer(message, texts.jobs_acquired)
     if data_acquired and command == '/add_stops':
-        await message.answer(texts.stops_acquired)
+        await outbox.answer(message, texts.stops_acquired)
     if not data_acquired:
-        await message.answer(texts.bot_error_message)
+        await outbox.answer(message, texts.bot_error_message)
     await state.finish()
 
 
@@ -113,24 +184,25 @@ async def show_jobs_or_stops(message: types.Message):
         types.InlineKeyboardButton(text="Изменить", callback_data='edit_dataset'),
         types.InlineKeyboardButton(text="Удалить", callback_data='delete_dataset')]
     table = str()
-    db.add_user_if_none(message)  # checking if user exists and creating it if it doesn't
+    # Checking if user exists and creating it if it doesn't:
+    await db_async.add_user_if_none(message)
     telegram_id = str(message.from_user.id)
 
     # Checking if user's job names table is empty and warning the user about it:
-    user_jobs_check = db.check_if_jobs_empty(message)
+    user_jobs_check = await db_async.check_if_jobs_empty(message)
     if user_jobs_check == 'empty':
-        await message.answer(texts.set_jobs_first)
+        await outbox.answer(message, texts.set_jobs_first)
         return
 
     # Binding the correct commands to the buttons according to the type of data which is displayed,
     # and setting a proper table name we are acquiring the data from:
     if message.text == '/show_jobs':
-        table = '_'.join(['jobs', telegram_id])
+        table = 'jobs'
         buttons[0]['callback_data'] = 'add_jobs'
         buttons[1]['callback_data'] = 'edit_jobs'
         buttons[2]['callback_data'] = 'delete_jobs'
     if message.text == '/show_stops':
-        table = '_'.join(['stops', telegram_id])
+        table = 'stops'
         buttons[0]['callback_data'] = 'add_stops'
         buttons[1]['callback_data'] = 'edit_stops'
         buttons[2]['callback_data'] = 'delete_stops'
@@ -138,11 +210,11 @@ async def show_jobs_or_stops(message: types.Message):
     keyboard = types.InlineKeyboardMarkup()
     keyboard.add(*buttons)
     # Getting the data from the DB as a string and displaying it, keyboard buttons included.
-    data_str = db.get_jobs_or_stops(table)
+    data_str = await db_async.get_jobs_or_stops(table, telegram_id)
     if data_str:
-        await message.answer(data_str, reply_markup=keyboard)
+        await outbox.answer(message, data_str, reply_markup=keyboard)
     else:
-        await message.answer(texts.stops_empty)
+        await outbox.answer(message, texts.stops_empty)
 
 
 # A callback handler which catches the commands from the inline keyboard.
@@ -167,22 +239,22 @@ async def cmd_edit_or_delete_jobs_or_stops(callback_query: types.CallbackQuery,
         command = '/' + command
         await state.update_data(command=command)
         if command == '/add_jobs':
-            await bot.send_message(telegram_id, texts.add_jobs)
+            await outbox.send(telegram_id, texts.add_jobs)
         if command == '/add_stops':
-            await bot.send_message(telegram_id, texts.add_stops)
+            await outbox.send(telegram_id, texts.add_stops)
         await state.update_data(command=command)
         await state.set_state(GetUserData.waiting_for_jobs_or_stops.state)
     if command.startswith('delete'):
-        await bot.send_message(telegram_id, f'{texts.deleting_data}{data_str_old}')
-        table = '_'.join([command.split('_')[1], telegram_id])
-        table_cleanup = db.clean_up_db_table(table)
+        await outbox.send(telegram_id, f'{texts.deleting_data}{data_str_old}')
+        table = command.split('_')[1]
+        table_cleanup = await db_async.clean_up_db_table(table, telegram_id)
         if table_cleanup:
-            await bot.send_message(telegram_id, texts.table_cleanup_message)
+            await outbox.send(telegram_id, texts.table_cleanup_message)
         else:
-            await bot.send_message(telegram_id, texts.bot_error_message)
+            await outbox.send(telegram_id, texts.bot_error_message)
         logging.info('Delete command got from the user.')
     if command.startswith('edit'):
-        await bot.send_message(telegram_id, f'{texts.changing_data}'
+        await outbox.send(telegram_id, f'{texts.changing_data}'
                                             f'`{data_str_old}`'
                                             f'{texts.edit_message}', parse_mode='MarkdownV2')
         logging.info('Edit command got from the user.')
@@ -206,96 +278,623 @@ async def edit_or_delete_jobs_or_stops(message: types.Message, state: FSMContext
     data_str_old = data_details['data_str_old']
     command = data_details['command']
     telegram_id = data_details['telegram_id']
-    table = '_'.join([command.split('_')[1], telegram_id])
+    table = command.split('_')[1]
 
-    # Cleaning up the table:
-    table_cleanup = db.clean_up_db_table(table)
+    # Cleaning up the user's data in the table:
+    table_cleanup = await db_async.clean_up_db_table(table, telegram_id)
     if table_cleanup:
         # Filling it with new data:
         data_acquired = await acquire_data(message, table)
         if data_acquired:
-            await message.answer(f'{data_str_old}\n\nизменено на\n\n{message.text}')
+            await outbox.answer(message, f'{data_str_old}\n\nизменено на\n\n{message.text}')
         else:
-            await message.answer(texts.bot_error_message)
+            await outbox.answer(message, texts.bot_error_message)
     else:
-        await message.answer(texts.bot_error_message)
+        await outbox.answer(message, texts.bot_error_message)
     await state.finish()
 
 
+async def deliver_vacancies(telegram_id, digest_mode=False):
+    """Sends the user's vacancies with negative 'sent_to_user' flag to the user.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: str
+    :param digest_mode: whether the vacancies should be packed into as few messages as possible
+    :type digest_mode: bool
+
+    :return: the number of vacancies sent
+    :rtype: int
+    """
+    # Get all vacancies with negative 'sent_to_user' flag
+    vacancies_unsent_list = await db_async.get_vacancies(telegram_id)
+    if not vacancies_unsent_list:
+        return 0
+    # Each message carries either a single vacancy, or, in the digest mode, as many of them
+    # as a message can hold.
+    if digest_mode:
+        messages = utils.pack_vacancies(vacancies_unsent_list)
+    else:
+        messages = [([vacancy_id], f"{vacancy_name}\n{vacancy_url}")
+                    for vacancy_id, vacancy_url, vacancy_name in vacancies_unsent_list]
+    # Send each of them to the user, setting the 'sent_to_user' flag as positive.
+    # The flags are not updated one by one but flushed in batches, either every
+    # ack_batch_size messages or every ack_flush_interval milliseconds. A digest
+    # is acknowledged as soon as it is sent, since it carries many vacancies at once.
+    vacancy_new_state = 1
+    sent_ids = []
+    sent_count = 0
+    last_flush = time.monotonic()
+    try:
+        for message_ids, message_text in messages:
+            await outbox.send(telegram_id, message_text, priority=sender.BULK,
+                              disable_web_page_preview=digest_mode)
+            sent_ids.extend(message_ids)
+            sent_count += len(message_ids)
+            metrics.vacancies_delivered_total.inc(len(message_ids))
+            if digest_mode or len(sent_ids) >= ack_batch_size \
+                    or (time.monotonic() - last_flush) * 1000 >= ack_flush_interval:
+                await db_async.update_sent_to_user(telegram_id, sent_ids, vacancy_new_state)
+                sent_ids = []
+                last_flush = time.monotonic()
+    finally:
+        # Whatever happens, the vacancies which have been sent already must not be
+        # sent again during the next check.
+        await db_async.update_sent_to_user(telegram_id, sent_ids, vacancy_new_state)
+    return sent_count
+
+
+async def send_too_many_vacancies(telegram_id, vacancies_count):
+    """Tells the user that the search has found too many vacancies to send them.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: str
+    :param vacancies_count: the number of the vacancies found
+    :type vacancies_count: int
+    """
+    await outbox.send(telegram_id, f"{texts.too_many_vacancies_1} {vacancies_count} "
+                                   f"{texts.too_many_vacancies_2}", priority=sender.BULK)
+    logging.info(f"Too many vacancies upon {telegram_id}'s request.")
+
+
+async def move_watermark(telegram_id, check_started, seen_ids, known_ids, users_jobs,
+                         users_stops):
+    """Saves the user's watermark after a check: the ids seen during the check go first,
+    as the newest ones, followed by the previously known ones.
+
+    If the user has changed the job names or the stop words during the check, the watermark
+    (which has been cleared by the change) isn't saved, since it is only valid for the query
+    the check has been run with.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: str
+    :param check_started: the time the check started at
+    :type check_started: datetime.datetime
+    :param seen_ids: hh.ru ids of the vacancies seen during the check, the newest first
+    :type seen_ids: list
+    :param known_ids: hh.ru ids from the previous watermark
+    :type known_ids: list
+    :param users_jobs: the job names the check has been run with
+    :type users_jobs: list
+    :param users_stops: the stop words the check has been run with
+    :type users_stops: list
+    """
+    current_jobs = await db_async.get_jobs_or_stops_list('jobs', telegram_id)
+    current_stops = await db_async.get_jobs_or_stops_list('stops', telegram_id)
+    if current_jobs is False or current_stops is False \
+            or utils.normalize_query(current_jobs) != utils.normalize_query(users_jobs) \
+            or utils.normalize_query(current_stops) != utils.normalize_query(users_stops):
+        logging.info(f'The query of the user {telegram_id} has changed during the check. '
+                     f'The watermark is not saved.')
+        return
+    seen_ids_set = set(seen_ids)
+    known_ids = seen_ids + [known_id for known_id in known_ids if known_id not in seen_ids_set]
+    await db_async.set_watermark(telegram_id, check_started, known_ids[:watermark_size])
+
+
+@metrics.vacancies_check_seconds.time()
 async def vacancies_check(telegram_id):
     logging.info('The \'vacancies_check\' function started.')
-    # Get user's jobs.
-    jobs_table = '_'.join(["jobs", telegram_id])
-    users_jobs = re.split(r',\s*', db.get_jobs_or_stops(jobs_table))
+    # Get user's jobs and stops (usually from the cache, without touching the DB).
+    users_jobs = await db_async.get_jobs_or_stops_list('jobs', telegram_id)
+    users_stops = await db_async.get_jobs_or_stops_list('stops', telegram_id)
+    if users_jobs is False or users_stops is False:
+        logging.error(f"Could not get the jobs and stops of the user {telegram_id}.")
+        return
     # Checking if user has any job names saved at all, and skipping if he doesn't.
     if len(users_jobs) == 0:
-        await bot.send_message(telegram_id, texts.set_jobs_first)
-    # Get user's stops.
-    stops_table = '_'.join(["stops", telegram_id])
-    users_stops = re.split(r',\s*', db.get_jobs_or_stops(stops_table))
-    # Run parser and get a list of vacancies from it.
-    logging.info('Beginning to parse...')
-    vacancies_dict, vacancies_count = utils.hh_parser(users_jobs, users_stops)
-    # Save vacancies to the DB.
-    if len(vacancies_dict) == 0:
-        await bot.send_message(telegram_id, f"{texts.too_many_vacancies_1} "
-                                            f"{vacancies_count} "
-                                            f"{texts.too_many_vacancies_2}")
-        logging.info(f"Too many vacancies upon {telegram_id}'s request.")
+        await outbox.send(telegram_id, texts.set_jobs_first, priority=sender.BULK)
         return
+    # Get user's watermark: the time of the last check and the newest vacancies known by then.
+    # It narrows the search to the period since the last check and lets the parser stop
+    # as soon as it reaches the known vacancies.
+    check_started = datetime.datetime.now()
+    watermark = await db_async.get_watermark(telegram_id)
+    checked_at, known_ids = watermark if watermark else (None, [])
+    search_period = utils.search_period_since(checked_at)
+    settings = await db_async.get_settings(telegram_id) or db.default_settings
+    # Run parser and save and send the vacancies page by page, as soon as each page is parsed.
+    logging.info(f'Beginning to parse (search period: {search_period} days)...')
+    loop = asyncio.get_running_loop()
+    # The stop words are applied to the parsed vacancies locally (and also sent to hh.ru
+    # if there are not too many of them). The ones which are only applied locally don't narrow
+    # hh.ru's count, so more vacancies are collected then, and the limit is applied to the ones
+    # left after the filtering. That number is only known once all the pages are parsed,
+    # so such pages are saved and sent after that.
+    remote_stops = stop_words.remote_stops(users_stops)
+    filtered_locally = len(remote_stops) < len(users_stops)
+    max_count = utils.local_filter_max_vacancies if filtered_locally \
+        else utils.max_vacancies_count
+    pages = utils.iter_vacancy_pages(users_jobs, remote_stops, search_period, set(known_ids),
+                                     max_count)
+    seen_ids = []
+    filtered_pages = []
+    sent_count = 0
+
+    async def save_page(page_vacancies):
+        # Save vacancies to the DB.
+        new_vacancies_count = await db_async.add_vacancies(telegram_id, page_vacancies)
+        # If nothing new has been found, there is no need to re-read the table.
+        if new_vacancies_count is not False and new_vacancies_count == 0:
+            return 0
+        return await deliver_vacancies(telegram_id, settings['digest_mode'])
+
+    try:
+        while True:
+            page = await loop.run_in_executor(scrape_executor, next, pages, None)
+            if page is None:
+                break
+            page_vacancies, vacancies_count = page
+            if vacancies_count >= max_count:
+                await send_too_many_vacancies(telegram_id, vacancies_count)
+                return
+            seen_ids.extend(utils.get_vacancy_id(vacancy_url)
+                            for vacancy_url in page_vacancies.values())
+            filtered_vacancies = stop_words.filter_vacancies(page_vacancies, users_stops)
+            if filtered_locally:
+                filtered_pages.append(filtered_vacancies)
+            else:
+                sent_count += await save_page(filtered_vacancies)
+    finally:
+        # Closing the generator returns the browser to the pool if the scrape is interrupted.
+        # If the generator is still running in its thread (the check has timed out),
+        # it is closed once it is garbage collected.
+        try:
+            await loop.run_in_executor(scrape_executor, pages.close)
+        except ValueError:
+            pass
+    if filtered_pages:
+        # The limit is applied to the vacancies which have actually been parsed and left
+        # by the filtering. If the parser has stopped at the known vacancies, hh.ru's count
+        # includes the ones on the pages it hasn't parsed, which the user has seen already.
+        filtered_count = sum(len(filtered_vacancies) for filtered_vacancies in filtered_pages)
+        if filtered_count >= utils.max_vacancies_count:
+            await send_too_many_vacancies(telegram_id, filtered_count)
+            return
+        for filtered_vacancies in filtered_pages:
+            sent_count += await save_page(filtered_vacancies)
     logging.info(f"Vacancies check for {telegram_id} performed.")
-    vacancies_table = '_'.join(["vacancies", telegram_id])
-    db.add_vacancies(vacancies_table, vacancies_dict)
-    # Get all vacancies with negative 'sent_to_user' flag
-    vacancies_unsent_list = db.get_vacancies(vacancies_table)
-    if len(vacancies_unsent_list) == 0:
-        await bot.send_message(telegram_id, texts.no_new_vacancies)
+    await move_watermark(telegram_id, check_started, seen_ids, known_ids, users_jobs,
+                         users_stops)
+    if sent_count == 0:
+        await outbox.send(telegram_id, texts.no_new_vacancies, priority=sender.BULK)
+
+
+@dp.message_handler(commands=['digest'])
+async def cmd_digest(message: types.Message):
+    logging.info('The \'cmd_digest\' function started.')
+    # Checking if user exists and creating it if it doesn't:
+    await db_async.add_user_if_none(message)
+    telegram_id = str(message.from_user.id)
+    settings = await db_async.get_settings(telegram_id)
+    if not settings:
+        await outbox.answer(message, texts.bot_error_message)
+        return
+    # The command switches the digest mode on and off.
+    digest_mode = not settings['digest_mode']
+    if not await db_async.set_digest_mode(telegram_id, digest_mode):
+        await outbox.answer(message, texts.bot_error_message)
+    elif digest_mode:
+        await outbox.answer(message, texts.digest_mode_on)
     else:
-        # Send each of them to the user, setting the 'sent_to_user' flag as positive.
-        for vacancy in vacancies_unsent_list:
-            vacancy_id, vacancy_url, vacancy_name = vacancy[0], vacancy[1], vacancy[2]
-            await bot.send_message(telegram_id, f"{vacancy_name}\n{vacancy_url}")
-            vacancy_new_state = 1
-            db.update_sent_to_user(vacancies_table, vacancy_id, vacancy_new_state)
+        await outbox.answer(message, texts.digest_mode_off)
+
+
+@dp.message_handler(commands=['db_stats'])
+async def cmd_db_stats(message: types.Message):
+    logging.info('The \'cmd_db_stats\' function started.')
+    # The connection pool's counters are only shown to the bot's admin.
+    if message.from_user.id != admin_id:
+        return
+    stats = db.pool.get_stats()
+    await outbox.answer(message, '\n'.join(f'{name}: {value}' for name, value in stats.items()))
+
+
+@dp.message_handler(commands=['browser_stats'])
+async def cmd_browser_stats(message: types.Message):
+    logging.info('The \'cmd_browser_stats\' function started.')
+    # The browser pool's counters are only shown to the bot's admin.
+    if message.from_user.id != admin_id:
+        return
+    stats = utils.browser_pool.get_stats()
+    await outbox.answer(message, '\n'.join(f'{name}: {value}' for name, value in stats.items()))
 
 
 @dp.message_handler(commands=['check_vacancies'])
 async def cmd_check_vacancies(message: types.message):
     logging.info('The \'cmd_check_vacancies\' function started.')
     # Checking if user exists and creating it if it doesn't:
-    new_user = db.add_user_if_none(message)
+    new_user = await db_async.add_user_if_none(message)
     if new_user == "user_created":
-        await message.answer(texts.set_jobs_first)
+        await outbox.answer(message, texts.set_jobs_first)
         return
     logging.info('The \'check_vacancies\' function started.')
     telegram_id = str(message.from_user.id)
-    await message.answer(texts.parsing_message)
+    await outbox.answer(message, texts.parsing_message)
     await vacancies_check(telegram_id)
 
 
+async def check_user(telegram_id):
+    """Checks the user's vacancies, never letting the failure of the check go further.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: str
+
+    :return: True if the check has succeeded, False otherwise
+    :rtype: bool
+    """
+    try:
+        await asyncio.wait_for(vacancies_check(telegram_id), timeout=check_timeout)
+    except BotBlocked as bbe:
+        logging.error(f'The user {telegram_id} blocked the bot: {bbe}. Skipping user.',
+                      exc_info=True)
+        return False
+    except asyncio.TimeoutError:
+        logging.error(f'The check for the user {telegram_id} took more than '
+                      f'{check_timeout} seconds. Skipping user.')
+        return False
+    # One user's failure must not stop the checks of the others.
+    except Exception as e:
+        logging.error(f'The check for the user {telegram_id} failed: {e}. Skipping user.',
+                      exc_info=True)
+        return False
+    return True
+
+
 async def regular_vacancies_check():
+    """Checks all the users at once (check_workers users at a time) and logs how long it took.
+    The bot itself checks the users one by one on their own schedule (see schedule_users()),
+    so this is for the benchmarks and the manual runs.
+    """
     # 1. We should do that for each user, so we should get the list of telegram_ids first.
     logging.info('The \'check_new_vacancies\' function started.')
-    users_list = db.get_users()
-    # 2. Then we should iterate over this list, and do several jobs for each telegram_id.
-    for telegram_id in users_list:
+    cycle_started = time.monotonic()
+    cache_stats = utils.scrape_cache.get_stats()
+    users_list = await db_async.get_users()
+    # 2. Then we should check every telegram_id, check_workers users at a time.
+    workers = asyncio.Semaphore(check_workers)
+    latencies = []
+    failures = []
+
+    async def check_user_timed(telegram_id):
+        async with workers:
+            started = time.monotonic()
+            if not await check_user(telegram_id):
+                failures.append(telegram_id)
+            latencies.append(time.monotonic() - started)
+
+    await asyncio.gather(*[check_user_timed(telegram_id) for telegram_id in users_list or []])
+
+    # 3. Logging how long the cycle took and how many scrapes have been shared
+    # by the users with identical queries.
+    log_checks_summary('The regular check', latencies, len(failures),
+                       time.monotonic() - cycle_started, cache_stats)
+
+
+def log_checks_summary(description, latencies, failures_count, elapsed, cache_stats):
+    """Logs how many users have been checked and how long it took, and how many scrapes
+    have been shared by the users with identical queries.
+
+    :param description: what has been checked, like 'The regular check'
+    :type description: str
+    :param latencies: the durations of the users' checks, in seconds
+    :type latencies: list
+    :param failures_count: the number of the checks which have failed
+    :type failures_count: int
+    :param elapsed: the number of seconds the checks have taken
+    :type elapsed: float
+    :param cache_stats: the scrape cache's counters before the checks
+    :type cache_stats: dict
+
+    :return: the scrape cache's counters now
+    :rtype: dict
+    """
+    logging.info(f"{description}: {len(latencies)} users checked in {elapsed:.1f} seconds "
+                 f"({failures_count} failed). Per-user latency: "
+                 f"p50 {utils.percentile(latencies, 50):.1f} s, "
+                 f"p90 {utils.percentile(latencies, 90):.1f} s, "
+                 f"p99 {utils.percentile(latencies, 99):.1f} s, "
+                 f"max {max(latencies, default=0):.1f} s.")
+    cache_stats_new = utils.scrape_cache.get_stats()
+    logging.info(f"{description}: the scrape cache had "
+                 f"{cache_stats_new['hits'] - cache_stats['hits']} hits, "
+                 f"{cache_stats_new['misses'] - cache_stats['misses']} misses, "
+                 f"{cache_stats_new['evictions'] - cache_stats['evictions']} evictions.")
+    return cache_stats_new
+
+
+async def scheduled_check_user(telegram_id):
+    """Checks a single user on the user's schedule, recording how long it took
+    for the next summary of the scheduled checks.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: str
+
+    :return: True or False, depending on whether the check has succeeded
+    :rtype: bool
+    """
+    started = time.monotonic()
+    succeeded = await check_user(telegram_id)
+    scheduled_checks.append((time.monotonic() - started, succeeded))
+    return succeeded
+
+
+async def log_scheduled_checks():
+    """Logs the summary of the scheduled checks since the previous one, once per check
+    interval, so that it covers a check of every user, like a regular check used to.
+    """
+    global scheduled_checks, summary_started, summary_cache_stats
+    checks, scheduled_checks = scheduled_checks, []
+    now = time.monotonic()
+    summary_cache_stats = log_checks_summary(
+        'The scheduled checks', [latency for latency, _ in checks],
+        sum(1 for _, succeeded in checks if not succeeded), now - summary_started,
+        summary_cache_stats)
+    summary_started = now
+
+
+async def scrape_phrase(phrase, search_period):
+    """Scrapes all the result pages of a single job name, without any stop words.
+
+    :param phrase: a normalized job name like 'python developer'
+    :type phrase: str
+    :param search_period: the number of days to narrow the search to, or None
+    :type search_period: int or None
+
+    :return: the vacancies found, looking like {'vacancy_name': 'vacancy_url'},
+             and the number of the vacancies hh.ru has found (the vacancies are not
+             collected if there are too many of them)
+    :rtype: tuple
+    """
+    loop = asyncio.get_running_loop()
+    pages = utils.iter_vacancy_pages([phrase], [], search_period)
+    vacancies_dict = dict()
+    vacancies_count = 0
+    try:
+        while True:
+            page = await loop.run_in_executor(scrape_executor, next, pages, None)
+            if page is None:
+                break
+            page_vacancies, vacancies_count = page
+            if vacancies_count >= utils.max_vacancies_count:
+                return dict(), vacancies_count
+            vacancies_dict.update(page_vacancies)
+    finally:
         try:
-            await vacancies_check(telegram_id)
-        except BotBlocked as bbe:
-            logging.error(f'The user {telegram_id} blocked the bot: {bbe}. Skipping user.',
-                          exc_info=True)
-            continue
-
-async def scheduler():
-    aioschedule.every(6).hours.do(regular_vacancies_check)
+            await loop.run_in_executor(scrape_executor, pages.close)
+        except ValueError:
+            pass
+    return vacancies_dict, vacancies_count
+
+
+async def deliver_crawled_vacancies(telegram_id, vacancies_dict, users_jobs, users_stops,
+                                    watermark, check_started):
+    """Hands the vacancies the shared crawl has found by the user's job names to the user
+    the same way vacancies_check() does: filters them by the user's stop words, saves them
+    and sends the new ones.
+
+    :param telegram_id: user's telegram id
+    :type telegram_id: str
+    :param vacancies_dict: the vacancies found by all the user's job names
+    :type vacancies_dict: dict
+    :param users_jobs: the user's job names
+    :type users_jobs: list or tuple
+    :param users_stops: the user's stop words
+    :type users_stops: list
+    :param watermark: the user's watermark: the time of the last check and the known ids
+    :type watermark: tuple
+    :param check_started: the time the crawl started at
+    :type check_started: datetime.datetime
+    """
+    seen_ids = [utils.get_vacancy_id(vacancy_url) for vacancy_url in vacancies_dict.values()]
+    vacancies_dict = stop_words.filter_vacancies(vacancies_dict, users_stops)
+    sent_count = 0
+    new_vacancies_count = await db_async.add_vacancies(telegram_id, vacancies_dict)
+    if new_vacancies_count is False or new_vacancies_count > 0:
+        settings = await db_async.get_settings(telegram_id) or db.default_settings
+        sent_count = await deliver_vacancies(telegram_id, settings['digest_mode'])
+    await move_watermark(telegram_id, check_started, seen_ids, watermark[1], users_jobs,
+                         users_stops)
+    if sent_count == 0:
+        await outbox.send(telegram_id, texts.no_new_vacancies, priority=sender.BULK)
+
+
+@metrics.shared_crawl_seconds.time()
+async def shared_crawl():
+    """Checks all the users with a single scrape per distinct job name instead of a scrape
+    per user: the job names are collected into an inverted index (job name: its users),
+    every job name is scraped once, and its vacancies are handed to all its users.
+    So the number of the scrapes grows with the number of the distinct job names
+    rather than with the number of the users.
+
+    The job names are scraped without any stop words, so the number of the vacancies they find
+    says nothing about how many of them a user's stop words leave. A user whose job names
+    have found max_vacancies_count vacancies or more in total is therefore checked
+    with a scrape of the user's own query instead (see vacancies_check()), which either
+    delivers the vacancies or tells the user there are too many of them the same way
+    as in the per-user mode.
+    """
+    logging.info('The \'shared_crawl\' function started.')
+    crawl_started = time.monotonic()
+    check_started = datetime.datetime.now()
+    users_list = await db_async.get_users()
+    if not users_list:
+        return
+    # 1. Building the inverted index and collecting the users' stop words and watermarks.
+    subscribers = dict()
+    users_data = dict()
+
+    async def load_user(telegram_id):
+        users_jobs = await db_async.get_jobs_or_stops_list('jobs', telegram_id)
+        users_stops = await db_async.get_jobs_or_stops_list('stops', telegram_id)
+        if users_jobs is False or users_stops is False:
+            logging.error(f"Could not get the jobs and stops of the user {telegram_id}.")
+            return
+        if len(users_jobs) == 0:
+            await outbox.send(telegram_id, texts.set_jobs_first, priority=sender.BULK)
+            return
+        watermark = await db_async.get_watermark(telegram_id)
+        users_data[telegram_id] = (utils.normalize_query(users_jobs), users_stops,
+                                   watermark if watermark else (None, []))
+        for phrase in users_data[telegram_id][0]:
+            subscribers.setdefault(phrase, []).append(telegram_id)
+
+    await asyncio.gather(*[load_user(telegram_id) for telegram_id in users_list])
+
+    # 2. Scraping every job name once. The search is narrowed to the period since
+    # the least recent check of its users.
+    workers = asyncio.Semaphore(check_workers)
+    results = dict()
+
+    async def crawl_phrase(phrase):
+        checked_at_list = [users_data[telegram_id][2][0] for telegram_id in subscribers[phrase]]
+        search_period = None if None in checked_at_list \
+            else utils.search_period_since(min(checked_at_list))
+        async with workers:
+            try:
+                results[phrase] = await asyncio.wait_for(scrape_phrase(phrase, search_period),
+                                                         timeout=check_timeout)
+            except asyncio.TimeoutError:
+                logging.error(f'Scraping \'{phrase}\' took more than {check_timeout} seconds. '
+                              f'Skipping it.')
+            except Exception as e:
+                logging.error(f'Scraping \'{phrase}\' failed: {e}. Skipping it.', exc_info=True)
+
+    await asyncio.gather(*[crawl_phrase(phrase) for phrase in subscribers])
+
+    # 3. Handing the vacancies of every job name to its users. A user whose job name
+    # has failed to be scraped is skipped, so that the watermark stays where it was.
+    # A user whose job names have found too many vacancies is checked on the user's own.
+    failures = []
+    fallbacks = []
+
+    async def deliver_user(telegram_id):
+        users_jobs, users_stops, watermark = users_data[telegram_id]
+        if any(phrase not in results for phrase in users_jobs):
+            failures.append(telegram_id)
+            return
+        if sum(results[phrase][1] for phrase in users_jobs) >= utils.max_vacancies_count:
+            async with workers:
+                fallbacks.append(telegram_id)
+                if not await check_user(telegram_id):
+                    failures.append(telegram_id)
+            return
+        vacancies_dict = dict()
+        for phrase in users_jobs:
+            vacancies_dict.update(results[phrase][0])
+        async with workers:
+            try:
+                await asyncio.wait_for(
+                    deliver_crawled_vacancies(telegram_id, vacancies_dict, users_jobs,
+                                              users_stops, watermark, check_started),
+                    timeout=check_timeout)
+            except BotBlocked as bbe:
+                logging.error(f'The user {telegram_id} blocked the bot: {bbe}. Skipping user.',
+                              exc_info=True)
+                failures.append(telegram_id)
+            except asyncio.TimeoutError:
+                logging.error(f'Delivering the vacancies to the user {telegram_id} took more '
+                              f'than {check_timeout} seconds. Skipping user.')
+                failures.append(telegram_id)
+            except Exception as e:
+                logging.error(f'Delivering the vacancies to the user {telegram_id} failed: {e}. '
+                              f'Skipping user.', exc_info=True)
+                failures.append(telegram_id)
+
+    await asyncio.gather(*[deliver_user(telegram_id) for telegram_id in users_data])
+    logging.info(f"The shared crawl of {len(subscribers)} job names ({len(results)} scraped) "
+                 f"for {len(users_data)} users took {time.monotonic() - crawl_started:.1f} "
+                 f"seconds ({len(fallbacks)} users checked on their own, "
+                 f"{len(failures)} users failed).")
+
+
+async def metrics_writer():
     while True:
-        await aioschedule.run_pending()
-        await asyncio.sleep(1)
+        await asyncio.sleep(metrics_interval)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, metrics.write_to_file,
+                                                             metrics_file)
+        except Exception as e:
+            logging.error(f'Writing the metrics to {metrics_file} failed: {e}', exc_info=True)
+
+
+async def schedule_users():
+    """Brings the scheduled checks in line with the users in the DB: the new users
+    get their checks spread over the check interval, the deleted ones lose theirs.
+    """
+    users_list = await db_async.get_users()
+    if users_list is False:
+        return
+    scheduled_users = {key[1] for key in scheduler.keys() if key[0] == 'check'}
+    for telegram_id in scheduled_users.difference(users_list):
+        scheduler.remove(('check', telegram_id))
+    new_users = [telegram_id for telegram_id in users_list if telegram_id not in scheduled_users]
+    scheduler.add_spread({('check', telegram_id): functools.partial(scheduled_check_user,
+                                                                    telegram_id)
+                          for telegram_id in new_users}, check_interval, check_jitter)
+    if new_users:
+        logging.info(f'{len(new_users)} users added to the schedule.')
 
 
 async def on_startup(_):
-    asyncio.create_task(scheduler())
+    await db_async.create_tables()
+    await db_async.warm_up_known_users()
+    # Resolving the driver and launching the browsers takes a while, so it is done
+    # in a thread and only if the Selenium engine is used.
+    if utils.parser_engine == 'selenium':
+        await asyncio.get_running_loop().run_in_executor(None, utils.browser_pool.start)
+    if check_mode == 'shared':
+        # A single crawl at a random moment of the interval, like the first check of a user.
+        scheduler.add_spread({'crawl': shared_crawl}, check_interval)
+    else:
+        await schedule_users()
+        scheduler.add('users', schedule_users, users_refresh_interval,
+                      delay=users_refresh_interval)
+        scheduler.add('summary', log_scheduled_checks, check_interval, delay=check_interval)
+    scheduler.add('retention', retention.delete_old_vacancies, retention.interval,
+                  delay=retention.start_delay)
+    global scheduler_task, metrics_server
+    scheduler_task = asyncio.create_task(scheduler.run())
+    if metrics_port:
+        metrics_server = metrics.start_http_server(metrics_port)
+    if metrics_file:
+        asyncio.create_task(metrics_writer())
+
+
+async def on_shutdown(_):
+    if scheduler_task is not None:
+        scheduler_task.cancel()
+    await outbox.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    if metrics_file:
+        metrics.write_to_file(metrics_file)
+    scrape_executor.shutdown(wait=False)
+    utils.page_executor.shutdown(wait=False)
+    db_async.shutdown()
+    utils.browser_pool.close()
+    if utils.http_cache is not None:
+        utils.http_cache.close()
 
 
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+    executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
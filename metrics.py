@@ -0,0 +1,268 @@
+"""Counters and latency histograms of the bot's hot paths, rendered in the Prometheus
+text format. They can be scraped from a local HTTP endpoint or written to a file
+(see the [metrics] section of config.ini).
+"""
+import asyncio
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO,
+                    filename="jobmonitoringbot.log",
+                    filemode="a",
+                    format="%(asctime)s %(levelname)s %(message)s")
+
+# The upper bounds (in seconds) of the latency buckets: from a quick DB query
+# to a scrape of many pages.
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_metrics = []
+_collectors = []
+_lock = threading.Lock()
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in items]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A value which only goes up, like the number of messages sent."""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = dict()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with _lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(dict(key))} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Observed durations sorted into buckets, along with their sum and count."""
+
+    def __init__(self, name, documentation, buckets=default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (math.inf,)
+        # Every combination of labels has its own [bucket counts, sum, count].
+        self._values = dict()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            values = self._values.get(key)
+            if values is None:
+                values = [[0] * len(self.buckets), 0.0, 0]
+                self._values[key] = values
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[0][index] += 1
+                    break
+            values[1] += value
+            values[2] += 1
+
+    def time(self, **labels):
+        """Measures the duration of a block or of every call of a function (or a coroutine).
+
+        Usage: `with histogram.time(stage='parse'): ...` or `@histogram.time()`
+        """
+        return Timer(self, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with _lock:
+            values = {key: [list(value[0]), value[1], value[2]]
+                      for key, value in self._values.items()}
+        for key, (bucket_counts, total, count) in sorted(values.items()):
+            labels = dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket'
+                             f'{_format_labels(labels, {"le": _format_value(bound)})} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class Timer:
+    """A context manager and a decorator which observes the time spent into a histogram."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+    def __call__(self, function):
+        # Every call gets its own timer, so that the concurrent calls don't mix up.
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with Timer(self.histogram, self.labels):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with Timer(self.histogram, self.labels):
+                    return function(*args, **kwargs)
+        return wrapper
+
+
+def counter(name, documentation):
+    metric = Counter(name, documentation)
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name, documentation, buckets=default_buckets):
+    metric = Histogram(name, documentation, buckets)
+    _metrics.append(metric)
+    return metric
+
+
+def add_collector(prefix, function):
+    """Exports the numbers of a get_stats()-like function as gauges, each of them
+    being named like '<prefix>_<key>'.
+
+    :param prefix: the prefix of the gauges' names, like 'db_pool'
+    :type prefix: str
+    :param function: a function without arguments which returns a dictionary
+    :type function: callable
+    """
+    _collectors.append((prefix, function))
+
+
+def render():
+    """Renders all the metrics in the Prometheus text format.
+
+    :return: the metrics, one per line
+    :rtype: str
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, function in _collectors:
+        try:
+            stats = function()
+        except Exception as e:
+            logging.error(f'Collecting the \'{prefix}\' metrics failed: {e}', exc_info=True)
+            continue
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f'# TYPE {prefix}_{key} gauge')
+            lines.append(f'{prefix}_{key} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_to_file(path):
+    """Writes the metrics to a file (e.g. for the textfile collector of node_exporter).
+    The file is replaced atomically, so it is never read half-written.
+
+    :param path: the path to the file
+    :type path: str
+    """
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        file.write(render())
+    os.replace(temporary_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """Serves the metrics on http://host:port/ in a background thread.
+
+    :param port: the port to listen on
+    :type port: int
+    :param host: the address to listen on; the local one by default
+    :type host: str
+
+    :return: the server, which can be stopped with shutdown()
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f'Serving the metrics on http://{host}:{server.server_address[1]}/')
+    return server
+
+
+# The metrics of the bot's hot paths.
+db_connect_seconds = histogram('db_connect_seconds',
+                               'The time of a single attempt to connect to the DB.')
+db_connect_attempts_total = counter('db_connect_attempts_total',
+                                    'The attempts to connect to the DB, by result.')
+db_executor_wait_seconds = histogram('db_executor_wait_seconds',
+                                     'The time a DB call waits for a free DB thread.')
+db_call_seconds = histogram('db_call_seconds', 'The time of a call of a db function.')
+browser_launch_seconds = histogram('browser_launch_seconds',
+                                   'The time of launching a headless Chrome instance.')
+browser_checkout_seconds = histogram('browser_checkout_seconds',
+                                     'The time of waiting for a browser from the pool.')
+scrape_stage_seconds = histogram('scrape_stage_seconds',
+                                 'The time of the stages of a scrape, by engine and stage.')
+scrape_pages_total = counter('scrape_pages_total', 'The result pages scraped, by engine.')
+telegram_send_seconds = histogram('telegram_send_seconds',
+                                  'The time of a single send_message call.')
+telegram_queue_seconds = histogram('telegram_queue_seconds',
+                                   'The time a message waits in the outbound queue, by priority.')
+telegram_messages_total = counter('telegram_messages_total',
+                                  'The outbound messages, by result.')
+vacancies_check_seconds = histogram('vacancies_check_seconds',
+                                    'The time of a whole check of a single user.')
+shared_crawl_seconds = histogram('shared_crawl_seconds',
+                                 'The time of a whole shared crawl of all the users.')
+vacancies_delivered_total = counter('vacancies_delivered_total',
+                                    'The vacancies delivered to the users.')
+vacancies_filtered_total = counter('vacancies_filtered_total',
+                                   'The vacancies dropped by the users\' stop words.')
+retention_batch_seconds = histogram('retention_batch_seconds',
+                                    'The time of a single batch of deleting old vacancies.')
+retention_rows_deleted_total = counter('retention_rows_deleted_total',
+                                       'The old vacancies deleted, by method (batch or '
+                                       'partition; the latter is estimated).')
@@ -0,0 +1,159 @@
+"""A one-shot tool which moves the data from the old per-user tables
+(vacancies_<telegram_id>, jobs_<telegram_id> and stops_<telegram_id>)
+to the shared vacancies, jobs and stops tables.
+
+Usage: python migrate.py [--drop-old-tables]
+
+The tool can safely be run several times: the rows which have been copied already
+are skipped by the unique keys of the shared tables. It also adds the unique key
+on telegram_id to the old users table, dropping the duplicate users.
+"""
+import argparse
+import logging
+import db
+
+logging.basicConfig(level=logging.INFO,
+                    filename="jobmonitoringbot.log",
+                    filemode="a",
+                    format="%(asctime)s %(levelname)s %(message)s")
+
+# For every kind of the old per-user tables: the columns which are copied to the shared table.
+copied_columns = {'vacancies': ['vacancy_url', 'vacancy_name', 'vacancy_date', 'sent_to_user'],
+                  'jobs': ['job_name'],
+                  'stops': ['stop_word']}
+
+legacy_users_columns = ['user_vacancies', 'user_jobs', 'user_stops']
+
+
+def add_users_key(cursor):
+    """Makes telegram_id a unique key of the users table, which the old table lacks,
+    so that the INSERT IGNORE of add_user_if_none can't add a user twice.
+
+    The table is rebuilt with the key, and the duplicate rows are skipped on the way
+    (a single row of every user is kept), then it replaces the old one in a single
+    atomic RENAME.
+
+    :param cursor: a cursor of a connection checked out of the pool
+
+    :return: True if the key has been added, False if the table has it already
+    :rtype: bool
+    """
+    cursor.execute("SHOW INDEX FROM `users`;")
+    # The columns of every index, and whether it is a unique one.
+    indexes = dict()
+    for elem in cursor.fetchall():
+        key_name, non_unique, column_name = elem[2], elem[1], elem[4]
+        indexes.setdefault(key_name, (not non_unique, []))[1].append(column_name)
+    if any(unique and columns == ['telegram_id'] for unique, columns in indexes.values()):
+        return False
+
+    # The old table may have a primary key of its own, like an auto-increment id.
+    key = 'UNIQUE KEY `telegram_id` (`telegram_id`)' if 'PRIMARY' in indexes \
+        else 'PRIMARY KEY (`telegram_id`)'
+    cursor.execute("DROP TABLE IF EXISTS `users_new`;")
+    cursor.execute("CREATE TABLE `users_new` LIKE `users`;")
+    cursor.execute(f"ALTER TABLE `users_new` ADD {key};")
+    cursor.execute("INSERT IGNORE INTO `users_new` SELECT * FROM `users` "
+                   "WHERE `telegram_id` IS NOT NULL;")
+    kept_count = cursor.rowcount
+    cursor.execute("SELECT COUNT(*) FROM `users`;")
+    dropped_count = cursor.fetchone()[0] - kept_count
+    cursor.execute("RENAME TABLE `users` TO `users_old`, `users_new` TO `users`;")
+    cursor.execute("DROP TABLE `users_old`;")
+    logging.info(f'The unique key on telegram_id added to the users table, '
+                 f'{dropped_count} duplicate or id-less rows dropped.')
+    return True
+
+
+def copy_user_data(cursor, telegram_id, existing_tables):
+    """Copies the data of a single user from the user's own tables to the shared ones.
+
+    :param cursor: a cursor of a connection checked out of the pool
+    :param telegram_id: user's telegram id
+    :type telegram_id: str
+    :param existing_tables: the names of all the tables in the DB
+    :type existing_tables: set
+
+    :return: a list of the user's old tables the data has been copied from
+    :rtype: list
+    """
+    copied_tables = []
+    for table, columns in copied_columns.items():
+        old_table = '_'.join([table, telegram_id])
+        if old_table not in existing_tables:
+            continue
+        columns_str = ', '.join(f'`{column}`' for column in columns)
+        cursor.execute(f"INSERT IGNORE INTO `{table}` (`telegram_id`, {columns_str}) "
+                       f"SELECT %s, {columns_str} FROM `{old_table}`;", (telegram_id,))
+        logging.info(f'{cursor.rowcount} rows copied from \'{old_table}\' to \'{table}\'.')
+        copied_tables.append(old_table)
+    return copied_tables
+
+
+def migrate(drop_old_tables=False):
+    """Creates the shared tables and copies every user's data into them.
+
+    :param drop_old_tables: whether the old per-user tables should be dropped
+                            once their data is copied
+    :type drop_old_tables: bool
+
+    :return: True or False, depending on whether the function has been executed correctly or not
+    :rtype: bool
+    """
+    # The old per-user tables have only ever existed in MySQL.
+    if db.backend.name != 'mysql':
+        logging.error('The migration is only needed for the MySQL backend.')
+        return False
+    logging.info('Migrating to the shared tables...')
+    if not db.create_tables():
+        return False
+
+    error = False
+    with db.pool.connection() as connection:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute("SHOW TABLES;")
+                existing_tables = {elem[0] for elem in cursor.fetchall()}
+                cursor.execute("SELECT `telegram_id` FROM `users`;")
+                telegram_ids = [str(elem[0]) for elem in cursor.fetchall()]
+
+                for number, telegram_id in enumerate(telegram_ids, start=1):
+                    print(f'[{number}/{len(telegram_ids)}] Migrating the user {telegram_id}...')
+                    copied_tables = copy_user_data(cursor, telegram_id, existing_tables)
+                    connection.commit()
+                    if drop_old_tables and copied_tables:
+                        tables_str = ', '.join(f'`{table}`' for table in copied_tables)
+                        cursor.execute(f"DROP TABLE IF EXISTS {tables_str};")
+                        logging.info(f'The old tables of the user {telegram_id} dropped.')
+
+                # The users table doesn't need to store the names of the users' tables anymore.
+                cursor.execute("SHOW COLUMNS FROM `users`;")
+                users_columns = {elem[0] for elem in cursor.fetchall()}
+                legacy_columns = [column for column in legacy_users_columns
+                                  if column in users_columns]
+                if legacy_columns:
+                    drop_str = ', '.join(f'DROP COLUMN `{column}`' for column in legacy_columns)
+                    cursor.execute(f"ALTER TABLE `users` {drop_str};")
+                    logging.info(f'The columns {legacy_columns} dropped from the users table.')
+                add_users_key(cursor)
+                logging.info('Migration to the shared tables completed.')
+            except Exception as e:
+                logging.error(f'Migration to the shared tables failed: {e}', exc_info=True)
+                error = True
+
+    if error:
+        return False
+    else:
+        return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Moves the data from the per-user tables '
+                                                 'to the shared tables.')
+    parser.add_argument('--drop-old-tables', action='store_true',
+                        help='drop the per-user tables once their data is copied')
+    args = parser.parse_args()
+    if migrate(drop_old_tables=args.drop_old_tables):
+        print('Done.')
+    else:
+        print('Migration failed, see jobmonitoringbot.log for details.')
@@ -0,0 +1,125 @@
+"""Deletes the vacancies which have been stored more than [retention] days ago, so that
+the vacancies table doesn't grow without bound. The bot runs it once a [retention] interval.
+
+The old vacancies are deleted in small batches, each of them being a short transaction
+of its own, with pauses in between, so the live traffic is never blocked for long.
+The size of the batches adapts to keep every batch within batch_time_budget seconds,
+and a run stops after run_time_budget seconds (the next run picks up where it stopped).
+
+On MySQL, the vacancies table can be partitioned by month once (see --partition below)
+and the 'partitioning' option set: then the months which are entirely expired are dropped
+a partition at a time, and only the rest is deleted in batches.
+
+Usage: python retention.py [--partition]
+
+Without arguments, a single run is made. With --partition, the MySQL vacancies table
+is converted to the partitioned one (the table is rebuilt, so the bot should be stopped).
+"""
+import argparse
+import asyncio
+import configparser
+import datetime
+import logging
+import time
+import db
+import db_async
+import metrics
+
+config = configparser.ConfigParser()
+config.read('config.ini', encoding='utf-8-sig')
+
+logging.basicConfig(level=logging.INFO,
+                    filename="jobmonitoringbot.log",
+                    filemode="a",
+                    format="%(asctime)s %(levelname)s %(message)s")
+
+retention_days = config.getint('retention', 'days', fallback=90)
+interval = config.getint('retention', 'interval', fallback=24 * 60 * 60)
+# The first run is put off, so that it doesn't coincide with the start of the bot.
+start_delay = config.getint('retention', 'start_delay', fallback=600)
+batch_size = config.getint('retention', 'batch_size', fallback=1000)
+batch_time_budget = config.getfloat('retention', 'batch_time_budget', fallback=0.5)
+batch_pause = config.getfloat('retention', 'batch_pause', fallback=0.5)
+run_time_budget = config.getint('retention', 'run_time_budget', fallback=600)
+# The number of the months after the current one which have their partitions prepared.
+months_ahead = config.getint('retention', 'months_ahead', fallback=2)
+
+min_batch_size = 10
+
+# The report of the last run, exported along with the metrics.
+last_report = dict()
+
+
+async def delete_old_vacancies():
+    """Deletes the vacancies stored more than retention_days days ago.
+
+    :return: the report of the run: the numbers of the rows deleted in batches,
+             the batches, the partitions dropped and the rows in them (estimated),
+             the seconds spent, and whether everything expired has been deleted
+    :rtype: dict
+    """
+    started = time.monotonic()
+    expiration_date = datetime.date.today() - datetime.timedelta(days=retention_days)
+    logging.info(f'Deleting the vacancies stored before {expiration_date}...')
+    report = {'rows_deleted': 0, 'batches': 0, 'partitions_dropped': 0, 'partition_rows': 0,
+              'seconds': 0.0, 'finished': True}
+
+    if db.vacancies_partitioned:
+        dropped = await db_async.drop_old_vacancies_partitions(expiration_date)
+        if dropped is not False:
+            report['partitions_dropped'], report['partition_rows'] = dropped
+            metrics.retention_rows_deleted_total.inc(dropped[1], method='partition')
+        await db_async.add_vacancies_partitions(months_ahead)
+
+    # What is left (e.g. the expired part of the oldest month) is deleted in batches.
+    size = batch_size
+    while True:
+        if time.monotonic() - started > run_time_budget:
+            report['finished'] = False
+            break
+        batch_started = time.monotonic()
+        deleted_count = await db_async.delete_old_vacancies(expiration_date, size)
+        batch_seconds = time.monotonic() - batch_started
+        if deleted_count is False:
+            report['finished'] = False
+            break
+        metrics.retention_batch_seconds.observe(batch_seconds)
+        metrics.retention_rows_deleted_total.inc(deleted_count, method='batch')
+        report['rows_deleted'] += deleted_count
+        report['batches'] += 1
+        if deleted_count < size:
+            break
+        if batch_seconds > batch_time_budget:
+            size = max(min_batch_size, size // 2)
+        elif batch_seconds < batch_time_budget / 2:
+            size = min(batch_size, size * 2)
+        await asyncio.sleep(batch_pause)
+
+    report['seconds'] = round(time.monotonic() - started, 1)
+    logging.info(f"Deleting the old vacancies took {report['seconds']} seconds: "
+                 f"{report['rows_deleted']} vacancies deleted in {report['batches']} batches, "
+                 f"{report['partitions_dropped']} partitions dropped "
+                 f"(about {report['partition_rows']} vacancies)."
+                 + ('' if report['finished'] else ' The rest is left for the next run.'))
+    last_report.clear()
+    last_report.update(report)
+    return report
+
+
+def get_stats():
+    return dict(last_report)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Deletes the old vacancies.')
+    parser.add_argument('--partition', action='store_true',
+                        help='partition the MySQL vacancies table by month instead')
+    args = parser.parse_args()
+    if args.partition:
+        if db.partition_vacancies(months_ahead):
+            print("Done. Set 'partitioning = true' in the [retention] section of config.ini.")
+        else:
+            print('Partitioning failed, see jobmonitoringbot.log for details.')
+    else:
+        print(asyncio.run(delete_old_vacancies()))
+        db_async.shutdown()
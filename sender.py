@@ -0,0 +1,236 @@
+import asyncio
+import itertools
+import logging
+import time
+from aiogram.utils.exceptions import RetryAfter
+import metrics
+
+logging.basicConfig(level=logging.INFO,
+                    filename="jobmonitoringbot.log",
+                    filemode="a",
+                    format="%(asctime)s %(levelname)s %(message)s")
+
+# Message priorities: the lower, the sooner. Replies to the users' commands go ahead
+# of the vacancy notifications.
+INTERACTIVE = 0
+BULK = 1
+priority_names = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+
+class TokenBucket:
+    """A token bucket which allows rate events per second on average,
+    with bursts of up to capacity events.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def delay(self):
+        """Returns the number of seconds until a token is available (0 if it is available now)."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class MessageScheduler:
+    """The outbound message scheduler which every bot.send_message goes through.
+
+    Messages are queued by priority and sent no faster than the global and the per-chat
+    token buckets allow. RetryAfter from Telegram pauses all the sending for as long
+    as Telegram asks, and the message is retried after that instead of failing.
+    The chats are sent to concurrently, but a chat's messages are sent one at a time,
+    in the order they have been taken from the queue.
+    """
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, idle_chat_ttl=600):
+        """
+        :param bot: the bot the messages are sent with
+        :type bot: aiogram.Bot
+        :param global_rate: the number of messages per second for all the chats together
+        :type global_rate: int or float
+        :param chat_rate: the number of messages per second for a single chat
+        :type chat_rate: int or float
+        :param chat_burst: the number of messages a single chat can get at once
+        :type chat_burst: int
+        :param idle_chat_ttl: the number of seconds a chat's bucket is kept after its last message
+        :type idle_chat_ttl: int or float
+        """
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.idle_chat_ttl = idle_chat_ttl
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = dict()
+        self._chat_locks = dict()
+        self._queue = None
+        self._worker = None
+        self._sequence = itertools.count()
+        self._paused_until = 0
+        # The futures of the messages which haven't been sent yet, and the tasks sending them,
+        # so that close() leaves nobody waiting.
+        self._pending = set()
+        self._deliveries = set()
+        self._stats = {'sent': 0, 'failed': 0, 'retry_after': 0, 'deferred': 0}
+
+    async def send(self, chat_id, text, priority=INTERACTIVE, **kwargs):
+        """Queues a message and waits until it is sent.
+
+        :param chat_id: the chat to send the message to
+        :type chat_id: int or str
+        :param text: the text of the message
+        :type text: str
+        :param priority: INTERACTIVE or BULK
+        :type priority: int
+
+        :return: the message sent
+        :rtype: aiogram.types.Message
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        self._queue.put_nowait((priority, next(self._sequence), str(chat_id), text, kwargs,
+                                future, time.perf_counter()))
+        return await future
+
+    async def answer(self, message, text, priority=INTERACTIVE, **kwargs):
+        """The scheduled version of message.answer()."""
+        return await self.send(message.chat.id, text, priority=priority, **kwargs)
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize() if self._queue is not None else 0
+        stats['chats'] = len(self._chat_buckets)
+        return stats
+
+    async def close(self):
+        """Stops the sending. The messages which haven't been sent by then are cancelled,
+        so the callers waiting for them get CancelledError.
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for delivery in list(self._deliveries):
+            delivery.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+        for future in list(self._pending):
+            future.cancel()
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            if self._queue is None:
+                self._queue = asyncio.PriorityQueue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            priority, sequence, chat_id, text, kwargs, future, queued_at = item
+            if future.done():  # the sender has been cancelled
+                continue
+
+            # Telegram has asked to slow down, so nobody is sent anything until then.
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+            # A chat which has got its share already is put aside, so that it doesn't hold up
+            # the other chats. The sequence number keeps its messages in their order.
+            chat_bucket = self._get_chat_bucket(chat_id)
+            chat_delay = chat_bucket.delay()
+            if chat_delay > 0:
+                self._stats['deferred'] += 1
+                loop.call_later(chat_delay, self._queue.put_nowait, item)
+                continue
+
+            global_delay = self._global_bucket.delay()
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+            self._global_bucket.take()
+            chat_bucket.take()
+            # The tasks start in the order they are created, so they take their chats' locks
+            # in the order of the queue.
+            delivery = asyncio.create_task(self._deliver(item))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+            self._forget_idle_chats()
+
+    async def _deliver(self, item):
+        priority, sequence, chat_id, text, kwargs, future, queued_at = item
+        # A chat's next message waits until the previous one is sent, so that they arrive
+        # in their order (the vacancies and the digests are sent as several messages).
+        async with self._get_chat_lock(chat_id):
+            if future.done():  # the sender has been cancelled meanwhile
+                return
+            while True:
+                sending_started = time.perf_counter()
+                try:
+                    with metrics.telegram_send_seconds.time():
+                        result = await self.bot.send_message(chat_id, text, **kwargs)
+                except RetryAfter as e:
+                    self._stats['retry_after'] += 1
+                    metrics.telegram_messages_total.inc(result='retry_after')
+                    logging.info(f'Telegram asked to retry sending in {e.timeout} seconds. '
+                                 f'Pausing the delivery...')
+                    self._paused_until = max(self._paused_until, time.monotonic() + e.timeout)
+                    # The message is retried right here rather than queued again,
+                    # so that the chat's next messages can't overtake it.
+                    await asyncio.sleep(max(0, self._paused_until - time.monotonic()))
+                    continue
+                except Exception as e:
+                    self._stats['failed'] += 1
+                    metrics.telegram_messages_total.inc(result='failed')
+                    if not future.done():
+                        future.set_exception(e)
+                    return
+                break
+        self._stats['sent'] += 1
+        metrics.telegram_messages_total.inc(result='sent')
+        metrics.telegram_queue_seconds.observe(sending_started - queued_at,
+                                               priority=priority_names[priority])
+        if not future.done():
+            future.set_result(result)
+
+    def _get_chat_bucket(self, chat_id):
+        chat_bucket = self._chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = chat_bucket
+        return chat_bucket
+
+    def _get_chat_lock(self, chat_id):
+        chat_lock = self._chat_locks.get(chat_id)
+        if chat_lock is None:
+            chat_lock = asyncio.Lock()
+            self._chat_locks[chat_id] = chat_lock
+        return chat_lock
+
+    def _forget_idle_chats(self):
+        # The buckets of the chats which haven't got anything for a while are full anyway.
+        if len(self._chat_buckets) < 1000:
+            return
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, chat_bucket in self._chat_buckets.items()
+                        if now - chat_bucket.updated_at > self.idle_chat_ttl]:
+            del self._chat_buckets[chat_id]
+            chat_lock = self._chat_locks.get(chat_id)
+            if chat_lock is not None and not chat_lock.locked():
+                del self._chat_locks[chat_id]
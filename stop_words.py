@@ -0,0 +1,171 @@
+"""Filters the vacancies by the users' stop words locally, after they are parsed.
+
+A stop list is compiled once into an Aho-Corasick automaton, which finds any of the words
+in a vacancy title in a single pass over it, so the cost per title hardly depends on the
+number of the stop words. The compiled matchers are cached by the stop lists themselves,
+so a user's matcher is rebuilt only once the user's list changes.
+
+The matching ignores case (and 'ё' vs 'е') and respects word boundaries: 'java' matches
+'Senior Java developer', but not 'JavaScript developer'. A stop word ending with '*'
+matches the beginning of a word: 'разработ*' matches both 'разработчик' and 'разработка'.
+"""
+import configparser
+from collections import deque
+from cache import LRUCache
+import metrics
+
+config = configparser.ConfigParser()
+config.read('config.ini', encoding='utf-8-sig')
+
+# The compiled matchers of the recently used stop lists.
+matchers = LRUCache(maxsize=config.getint('parser', 'stop_words_cache_size', fallback=1024))
+# hh.ru limits the length of the excluded words field, so only the short stop lists are sent
+# to it as well (to make the result pages smaller); the long ones are only filtered locally.
+remote_stop_words_limit = config.getint('parser', 'remote_stop_words', fallback=20)
+
+
+def is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+def normalize_text(text):
+    """Brings a title or a stop word to the form they are matched in: case-folded,
+    with 'ё' replaced by 'е' and the whitespace collapsed.
+
+    :param text: a title or a stop word like ' Senior  Python-разработчик'
+    :type text: str
+
+    :return: a string like 'senior python-разработчик'
+    :rtype: str
+    """
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+class StopWordsMatcher:
+    """An Aho-Corasick automaton built from a stop list."""
+
+    def __init__(self, stops_list):
+        """
+        :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+        :type stops_list: list
+        """
+        self.words = []
+        # The trie: the transitions of every node, the node to fall back to when there is
+        # no transition, and the stop words (their indices in self.words) ending at the node,
+        # including the ones ending at the nodes it falls back to.
+        self._goto = [dict()]
+        self._fail = [0]
+        self._output = [[]]
+        for stop_word in stops_list:
+            word = normalize_text(stop_word)
+            prefix = word.endswith('*')
+            word = word.rstrip('*').rstrip()
+            if not word:
+                continue
+            # A side of the word which isn't a letter or a digit (like in 'C++')
+            # can't be checked for a word boundary.
+            self.words.append((stop_word, len(word), is_word_char(word[0]),
+                               not prefix and is_word_char(word[-1])))
+            node = 0
+            for char in word:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append(dict())
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append(len(self.words) - 1)
+
+        # The fallback links are set breadth-first, so the ones of the shorter prefixes
+        # are ready by the time the longer ones need them.
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(char, 0)
+                self._output[next_node].extend(self._output[self._fail[next_node]])
+                queue.append(next_node)
+
+    def __len__(self):
+        return len(self.words)
+
+    def find(self, title):
+        """Finds a stop word in the title.
+
+        :param title: a vacancy title
+        :type title: str
+
+        :return: the first stop word found, as it has been given to the matcher, or None.
+                 The matchers get_matcher() builds are given the normalized stop words
+                 (see normalize_text()), since they are shared by all the spellings
+                 of a stop list, so it is the normalized one like 'c++' then.
+        :rtype: str or None
+        """
+        text = normalize_text(title)
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for word_index in output[node]:
+                stop_word, length, left_boundary, right_boundary = self.words[word_index]
+                start = end - length + 1
+                if left_boundary and start > 0 and is_word_char(text[start - 1]):
+                    continue
+                if right_boundary and end + 1 < len(text) and is_word_char(text[end + 1]):
+                    continue
+                return stop_word
+        return None
+
+
+def filter_vacancies(vacancies_dict, stops_list):
+    """Drops the vacancies whose titles contain any of the stop words.
+
+    :param vacancies_dict: a dictionary with vacancies: looks like {'vacancy_name': 'vacancy_url'}
+    :type vacancies_dict: dict
+    :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+    :type stops_list: list
+
+    :return: a dictionary with the rest of the vacancies
+    :rtype: dict
+    """
+    if not stops_list or not vacancies_dict:
+        return vacancies_dict
+    matcher = get_matcher(stops_list)
+    filtered_dict = {vacancy_name: vacancy_url
+                     for vacancy_name, vacancy_url in vacancies_dict.items()
+                     if matcher.find(vacancy_name) is None}
+    metrics.vacancies_filtered_total.inc(len(vacancies_dict) - len(filtered_dict))
+    return filtered_dict
+
+
+def get_matcher(stops_list):
+    """Returns the compiled matcher of the stop list, compiling it only if it isn't cached.
+
+    :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+    :type stops_list: list
+
+    :rtype: StopWordsMatcher
+    """
+    key = tuple(sorted({normalize_text(stop_word) for stop_word in stops_list}))
+    return matchers.get_or_compute(key, lambda: StopWordsMatcher(key))
+
+
+def remote_stops(stops_list):
+    """Returns the stop words which are sent to hh.ru along with the search: all of them
+    if there are not too many, none otherwise.
+
+    :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+    :type stops_list: list
+
+    :rtype: list
+    """
+    if len(stops_list) > remote_stop_words_limit:
+        return []
+    return stops_list
@@ -17,6 +17,7 @@ bot_greeting = 'Добро пожаловать в бот.\n\n' \
                '\n\n' \
                'Чтобы указать вакансии - нажмите /add_jobs.\n\n' \
                'Чтобы указать стоп-слова - нажмите /add_stops.\n\n' \
+               'Чтобы получать новые вакансии не по одной, а списком - нажмите /digest.\n\n' \
                'Приятного использования. :3'
 
 changing_data = 'Изменяем следующие данные:\n\n'
@@ -25,6 +26,12 @@ connection_closed = 'Connection to the database closed.'
 
 deleting_data = 'Удаляем следующие данные:\n\n'
 
+digest_mode_off = 'Режим дайджеста выключен. Каждая новая вакансия будет приходить ' \
+                  'отдельным сообщением. Чтобы снова включить его, нажмите /digest.'
+
+digest_mode_on = 'Режим дайджеста включён. Новые вакансии будут приходить, собранные ' \
+                 'в несколько сообщений. Чтобы выключить его, нажмите /digest.'
+
 edit_message = '\n\nК сожалению, Telegram не позволяет ботам самостоятельно заполнять ' \
                'поле ввода, поэтому нажмите на текст, чтобы скопировать его, ' \
                'и вставьте в поле ввода, где вы сможете его изменить:'
@@ -1,88 +1,666 @@
+import configparser
+import datetime
+import itertools
 import re
-import time
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+import requests
+from lxml import html
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service as ChromeService
+from selenium.webdriver.support.ui import WebDriverWait
+from browser_pool import BrowserPool
+from cache import LRUCache
+from http_cache import HTTPCache
+import metrics
+
+config = configparser.ConfigParser()
+config.read('config.ini', encoding='utf-8-sig')
+
+# The engine which is used to scrape hh.ru: 'selenium' drives a headless Chrome through
+# the advanced search form, 'http' requests the result pages directly and parses them with lxml.
+parser_engine = config.get('parser', 'engine', fallback='selenium')
+hh_base_url = config.get('parser', 'base_url', fallback='https://spb.hh.ru')
+# The region to search in (2 is Saint Petersburg, the default region of spb.hh.ru).
+hh_area = config.get('parser', 'area', fallback='2')
+http_timeout = config.getint('parser', 'http_timeout', fallback=30)
+http_headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                              '(KHTML, like Gecko) Chrome/118.0 Safari/537.36'}
+# Warm headless Chrome instances used by the Selenium engine.
+browser_pool = BrowserPool(size=config.getint('parser', 'browser_pool_size', fallback=2),
+                           max_jobs=config.getint('parser', 'browser_max_jobs', fallback=50),
+                           max_rss=config.getint('parser', 'browser_max_rss', fallback=1024))
+# Scrape results shared by the users whose queries are identical.
+scrape_cache = LRUCache(maxsize=config.getint('parser', 'cache_size', fallback=256),
+                        ttl=config.getint('parser', 'cache_ttl', fallback=1800))
+# The pages downloaded by the HTTP engine, kept on disk and revalidated with conditional
+# requests. An empty path disables the cache.
+http_cache_path = config.get('parser', 'http_cache_path', fallback='http_cache.sqlite3')
+http_cache = HTTPCache(http_cache_path,
+                       ttl=config.getint('parser', 'http_cache_ttl', fallback=300),
+                       max_size=config.getint('parser', 'http_cache_size',
+                                              fallback=64) * 1024 * 1024) \
+    if parser_engine == 'http' and http_cache_path else None
+# Once the first page of the results tells how many pages there are, the rest of them
+# are downloaded page_fan_out at a time (in threads for the HTTP engine, in browser tabs
+# for the Selenium one). The threads are shared by all the scrapes.
+page_fan_out = config.getint('parser', 'page_fan_out', fallback=4)
+page_executor = ThreadPoolExecutor(max_workers=page_fan_out, thread_name_prefix='pages')
+# The periods (in days) hh.ru can narrow the search to.
+search_periods = (1, 3, 7, 30)
+# If there are more vacancies than that, they are not collected at all,
+# since it takes too much time.
+max_vacancies_count = 200
+# The stop words which are only filtered locally (see stop_words.remote_stops()) don't narrow
+# hh.ru's search, so such searches are collected up to this many vacancies, and the limit above
+# is applied to the ones left after the filtering.
+local_filter_max_vacancies = config.getint('parser', 'local_filter_max_vacancies',
+                                           fallback=1000)
+# Telegram doesn't accept messages longer than that.
+max_message_length = 4096
+
+
+def add_query_params(url, params):
+    """Adds the parameters to the URL's query string, replacing the existing ones.
+
+    :param url: a URL like 'https://spb.hh.ru/search/vacancy?text=python'
+    :type url: str
+    :param params: the parameters like {'order_by': 'publication_time'}
+    :type params: dict
+
+    :return: a URL like 'https://spb.hh.ru/search/vacancy?text=python&order_by=publication_time'
+    :rtype: str
+    """
+    url_parts = urlsplit(url)
+    query = dict(parse_qsl(url_parts.query, keep_blank_values=True))
+    query.update(params)
+    return urlunsplit(url_parts._replace(query=urlencode(query)))
+
+
+def build_page_urls(next_page_url, vacancies_count, per_page):
+    """Works out the URLs of all the pages with search results after the first one
+    from the URL of the second page.
+
+    :param next_page_url: the URL of the second page (the 'next' link of the first one)
+    :type next_page_url: str
+    :param vacancies_count: the number of vacancies found
+    :type vacancies_count: int
+    :param per_page: the number of vacancies on the first page (all of them, including
+                     the ones with the same title)
+    :type per_page: int
+
+    :return: a list of URLs, in the page order
+    :rtype: list
+    """
+    pages_count = -(-vacancies_count // max(per_page, 1))
+    return [add_query_params(next_page_url, {'page': page}) for page in range(1, pages_count)]
+
+
+def build_search_params(search_period):
+    """Builds the parameters which narrow the search to the vacancies published
+    during the last search_period days, the newest ones first.
+
+    :param search_period: the number of days (one of search_periods), or None
+    :type search_period: int or None
+
+    :return: a dictionary with the parameters, empty if search_period is None
+    :rtype: dict
+    """
+    if search_period is None:
+        return dict()
+    return {'order_by': 'publication_time', 'search_period': search_period}
+
+
+def build_search_text(jobs_list):
+    """Wraps every job name in quotes because HH's search engine demands it
+    (otherwise it searches for any word of the phrase), and joins them with OR.
+
+    :param jobs_list: a list with job titles like ['python junior', 'python developer']
+    :type jobs_list: list
+
+    :return: a search string like '"python junior" OR "python developer"'
+    :rtype: str
+    """
+    return ' OR '.join('\"' + job_name + '\"' for job_name in jobs_list)
+
+
+def build_search_url(jobs_list, stops_list, search_period=None):
+    """Builds the URL of the first page with search results, which is the same
+    the advanced search form leads to.
+
+    :param jobs_list: a list with job titles like ['python junior', 'python developer']
+    :type jobs_list: list
+    :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+    :type stops_list: list
+    :param search_period: the number of days to narrow the search to, or None
+    :type search_period: int or None
+
+    :return: the URL of the first page with search results
+    :rtype: str
+    """
+    query = {'text': build_search_text(jobs_list),
+             'excluded_text': ', '.join(stops_list),
+             'area': hh_area}
+    query.update(build_search_params(search_period))
+    return f'{hh_base_url}/search/vacancy?{urlencode(query)}'
+
+
+def collect_pages(pages):
+    """Merges the pages yielded by one of the iter_* functions into a single dictionary.
+
+    :param pages: an iterable of tuples like ({'vacancy title': 'vacancy URL'}, vacancies count)
+    :type pages: iterable
+
+    :return: a tuple like ({'vacancy title': 'vacancy URL'}, vacancies count)
+    :rtype: tuple
+    """
+    vacancies_dict = dict()
+    vacancies_count = 0
+    for page_vacancies, vacancies_count in pages:
+        vacancies_dict.update(page_vacancies)
+    return vacancies_dict, vacancies_count
+
+
+def fetch_results_page(session, page_url):
+    """Downloads (or takes from the HTTP cache) and parses a page with search results.
+
+    :param session: a requests session
+    :type session: requests.Session
+    :param page_url: the URL of the page
+    :type page_url: str
+
+    :return: a tuple like ({'vacancy title': 'vacancy URL'}, vacancies count, next page URL,
+             the number of the vacancies on the page), see parse_results_page()
+    :rtype: tuple
+    """
+    with metrics.scrape_stage_seconds.time(engine='http', stage='fetch'):
+        if http_cache is not None:
+            page_html, page_url = http_cache.get(session, page_url, timeout=http_timeout)
+        else:
+            response = session.get(page_url, timeout=http_timeout)
+            response.raise_for_status()
+            page_html, page_url = response.content, response.url
+    with metrics.scrape_stage_seconds.time(engine='http', stage='parse'):
+        results_page = parse_results_page(page_html, page_url)
+    metrics.scrape_pages_total.inc(engine='http')
+    return results_page
+
+
+def find_vacancies(jobs_list, stops_list):
+    """Searches for vacancies with the engine chosen in config.ini. The results are cached
+    by the normalized query, so the users with identical queries share a single scrape.
+
+    :param jobs_list: a list with job titles like ['python junior', 'python developer']
+    :type jobs_list: list
+    :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+    :type stops_list: list
+
+    :return: a tuple like ({'vacancy title': 'vacancy URL'}, vacancies count)
+    :rtype: tuple
+    """
+    return collect_pages(iter_vacancy_pages(jobs_list, stops_list))
+
+
+def get_vacancy_id(vacancy_url):
+    """Extracts hh.ru id of the vacancy from its URL.
+
+    :param vacancy_url: a URL like 'https://spb.hh.ru/vacancy/87654321'
+    :type vacancy_url: str
+
+    :return: an id like '87654321', or the URL itself if there is no id in it
+    :rtype: str
+    """
+    match = re.search(r'/vacancy/(\d+)', vacancy_url)
+    return match.group(1) if match else vacancy_url
+
+
+def hh_http_parser(jobs_list, stops_list, session=None):
+    """Requests the page(s) with search results directly over HTTP, without a browser,
+    and creates a dictionary like {'vacancy title': 'vacancy URL'}.
+
+    :param jobs_list: a list with job titles like ['python junior', 'python developer']
+    :type jobs_list: list
+    :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+    :type stops_list: list
+    :param session: a requests session to reuse the connections of; a new one is created
+                    if it is omitted
+    :type session: requests.Session or None
+
+    :return: a tuple like ({'vacancy title': 'vacancy URL'}, vacancies count)
+    :rtype: tuple
+    """
+    return collect_pages(iter_hh_http_pages(jobs_list, stops_list, session=session))
 
 
 def hh_parser(jobs_list, stops_list):
     """ Opens the advanced search page, fills the search fields in (including stop words),
     parses the page(s) with results and creates a dictionary like {'vacancy title': 'vacancy URL'}.
 
-    :param jobs_list: a list with job titles like ['"python junior"', '"python developer"'];
-                      it is important to wrap every title in quotes since it is the only way
-                      to make the search engine search full phrase instead of any word from it.
+    :param jobs_list: a list with job titles like ['python junior', 'python developer']
     :type jobs_list: list
 
     :param stops_list: a list with stop words we need to exclude from search like
                        ['Java', 'JavaScript', 'C++']
     :type stops_list: list
 
-    :return: a dictionary with vacancies like {'vacancy title': 'vacancy URL'}
-    :rtype: dict
+    :return: a tuple like ({'vacancy title': 'vacancy URL'}, vacancies count)
+    :rtype: tuple
+    """
+    return collect_pages(iter_hh_pages(jobs_list, stops_list))
+
+
+def iter_browser_tabs(browser, page_urls):
+    """Loads the pages in new tabs of the browser, page_fan_out tabs at a time,
+    and yields them parsed, in the page order. The tabs are closed once they are parsed,
+    and the browser is switched back to the tab it has been in.
+
+    :param browser: a browser checked out of the pool
+    :type browser: selenium.webdriver.Chrome
+    :param page_urls: the URLs of the pages
+    :type page_urls: list
+
+    :return: a generator of tuples like ({'vacancy title': 'vacancy URL'}, next page URL,
+             the number of the vacancies on the page), see parse_browser_page()
+    :rtype: generator
+    """
+    def page_loaded(driver):
+        return driver.current_url != 'about:blank' \
+            and driver.execute_script('return document.readyState;') == 'complete'
+
+    main_window = browser.current_window_handle
+    tabs = []
+    try:
+        for batch_start in range(0, len(page_urls), page_fan_out):
+            # WebDriver waits for a page to load when it navigates, so the navigation
+            # is started by a script instead, which lets the tabs load simultaneously.
+            for page_url in page_urls[batch_start:batch_start + page_fan_out]:
+                browser.switch_to.new_window('tab')
+                tabs.append(browser.current_window_handle)
+                browser.execute_script('window.location.href = arguments[0];', page_url)
+            while tabs:
+                browser.switch_to.window(tabs[0])
+                with metrics.scrape_stage_seconds.time(engine='selenium', stage='navigate'):
+                    WebDriverWait(browser, http_timeout).until(page_loaded)
+                page = parse_browser_page(browser)
+                browser.close()
+                tabs.pop(0)
+                # The closed tab's handle is no longer valid, and a new tab can't be opened
+                # from it, so the browser is switched back to a live tab.
+                browser.switch_to.window(main_window)
+                yield page
+    finally:
+        # The tabs of an interrupted scrape must not stay open in the pooled browser.
+        for tab in tabs:
+            browser.switch_to.window(tab)
+            browser.close()
+        browser.switch_to.window(main_window)
+
+
+def iter_hh_http_pages(jobs_list, stops_list, search_period=None, session=None,
+                       max_count=max_vacancies_count):
+    """The streaming version of hh_http_parser: yields the vacancies page by page,
+    as soon as each page is parsed.
+
+    If there are too many vacancies, a single page without vacancies is yielded,
+    so that the caller can tell the user about it.
+
+    :param jobs_list: a list with job titles like ['python junior', 'python developer']
+    :type jobs_list: list
+    :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+    :type stops_list: list
+    :param search_period: the number of days to narrow the search to (the newest vacancies
+                          go first then), or None to search through all the vacancies
+    :type search_period: int or None
+    :param session: a requests session to reuse the connections of; a new one is created
+                    if it is omitted
+    :type session: requests.Session or None
+    :param max_count: the number of the vacancies which is too many to collect
+    :type max_count: int
+
+    :return: a generator of tuples like ({'vacancy title': 'vacancy URL'}, vacancies count)
+    :rtype: generator
+    """
+    own_session = session is None
+    if own_session:
+        session = requests.Session()
+    session.headers.update(http_headers)
+
+    try:
+        page_url = build_search_url(jobs_list, stops_list, search_period)
+        page_vacancies, vacancies_count, next_page_url, per_page = \
+            fetch_results_page(session, page_url)
+        # If there are too many vacancies, the caller tells the user about it,
+        # so there is no need to collect them.
+        if vacancies_count >= max_count:
+            yield dict(), vacancies_count
+            return
+        yield page_vacancies, vacancies_count
+        if next_page_url is None:
+            return
+        # The rest of the pages are downloaded concurrently and yielded in the page order.
+        # No more than page_fan_out pages are requested ahead of the caller, so a caller
+        # which stops early (see iter_vacancy_pages) doesn't waste many requests.
+        page_urls = iter(build_page_urls(next_page_url, vacancies_count, per_page))
+        futures = deque(page_executor.submit(fetch_results_page, session, page_url)
+                        for page_url in itertools.islice(page_urls, page_fan_out))
+        try:
+            while futures:
+                page_vacancies, _, next_page_url, _ = futures.popleft().result()
+                for page_url in itertools.islice(page_urls, 1):
+                    futures.append(page_executor.submit(fetch_results_page, session, page_url))
+                yield page_vacancies, vacancies_count
+        finally:
+            for future in futures:
+                future.cancel()
+        # If there are more pages than expected, the rest of them are walked one by one.
+        while next_page_url is not None:
+            page_vacancies, _, next_page_url, _ = fetch_results_page(session, next_page_url)
+            yield page_vacancies, vacancies_count
+    finally:
+        if own_session:
+            session.close()
+
+
+def iter_hh_pages(jobs_list, stops_list, search_period=None, max_count=max_vacancies_count):
+    """The streaming version of hh_parser: yields the vacancies page by page,
+    as soon as each page is parsed.
+
+    If there are too many vacancies, a single page without vacancies is yielded,
+    so that the caller can tell the user about it.
+
+    :param jobs_list: a list with job titles like ['python junior', 'python developer']
+    :type jobs_list: list
+    :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+    :type stops_list: list
+    :param search_period: the number of days to narrow the search to (the newest vacancies
+                          go first then), or None to search through all the vacancies
+    :type search_period: int or None
+    :param max_count: the number of the vacancies which is too many to collect
+    :type max_count: int
+
+    :return: a generator of tuples like ({'vacancy title': 'vacancy URL'}, vacancies count)
+    :rtype: generator
     """
+    # Taking a warm browser instance from the pool; it is returned there
+    # (or recycled) once the scrape is finished.
+    with browser_pool.session() as browser:
+        with metrics.scrape_stage_seconds.time(engine='selenium', stage='submit'):
+            # Performing a request to the web-site.
+            browser.get(f'{hh_base_url}/search/vacancy/advanced')
+
+            # Finding a search form and passing search request there.
+            search_input = browser.find_element(By.CSS_SELECTOR,
+                                                '[data-qa="vacancysearch__keywords-input"]')
+            search_input.send_keys(build_search_text(jobs_list))
 
-    # Setting the browser's settings. Making it so that it opens in the background,
-    # without opening a window.
-    browser_options = Options()
-    browser_options.add_argument('--headless')
+            # Finding a form for stop words and filling it with them.
+            stop_words_input = browser.find_element(
+                By.CSS_SELECTOR, '[data-qa="vacancysearch__keywords-excluded-input"]')
+            stop_words_input.send_keys(', '.join(stops_list))
 
-    # Creating a browser instance.
-    browser = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()),
-                               options=browser_options)
-    browser.maximize_window()
+            # Submitting search request.
+            search_input.submit()
 
-    # Performing a request to the web-site.
-    browser.get('https://spb.hh.ru/search/vacancy/advanced')
+            # The advanced search form has no fields for the sorting and the period,
+            # so they are added to the URL of the results.
+            if search_period is not None:
+                browser.get(add_query_params(browser.current_url,
+                                             build_search_params(search_period)))
 
-    # Wrapping every job name in quotes because HH's search engine demands it.
-    for index, job_name in enumerate(jobs_list):
-        new_job_name = '\"' + job_name + '\"'
-        jobs_list[index] = new_job_name
+            # If there are too many vacancies, it is better to tell the user about it and ask
+            # to add make the search pattern more specific by adding more stop words.
+            vacancies_count_raw = browser.find_element(
+                By.CSS_SELECTOR, '[data-qa="vacancies-search-header"] > h1')
+            vacancies_count = parse_vacancies_count(vacancies_count_raw.text)
 
-    # Finding a search form and passing search request there.
-    search_input = browser.find_element(By.CSS_SELECTOR,
-                                        '[data-qa="vacancysearch__keywords-input"]')
-    search_input.send_keys(' OR '.join(jobs_list))
+        if vacancies_count >= max_count:
+            yield dict(), vacancies_count
+            return
 
-    # Finding a form for stop words and filling it with them.
-    stop_words_input = browser.find_element(By.CSS_SELECTOR,
-                                            '[data-qa="vacancysearch__keywords-excluded-input"]')
-    stop_words_input.send_keys(', '.join(stops_list))
+        # Yielding a dictionary like {'vacancy title': 'vacancy URL'} for every page
+        # with the search results. The next page URL is taken before yielding,
+        # since the caller may take a while.
+        page_vacancies, next_page_url, per_page = parse_browser_page(browser)
+        yield page_vacancies, vacancies_count
+        if next_page_url is None:
+            return
+        # The rest of the pages are loaded in several tabs at once and yielded in the page order.
+        page_urls = build_page_urls(next_page_url, vacancies_count, per_page)
+        for page_vacancies, next_page_url, _ in iter_browser_tabs(browser, page_urls):
+            yield page_vacancies, vacancies_count
+        # If there are more pages than expected, the rest of them are walked one by one.
+        while next_page_url is not None:
+            with metrics.scrape_stage_seconds.time(engine='selenium', stage='navigate'):
+                browser.get(next_page_url)
+            page_vacancies, next_page_url, _ = parse_browser_page(browser)
+            yield page_vacancies, vacancies_count
+
+
+def iter_vacancy_pages(jobs_list, stops_list, search_period=None, known_ids=None,
+                       max_count=max_vacancies_count):
+    """The streaming version of find_vacancies: yields the vacancies page by page,
+    using the engine chosen in config.ini.
+
+    If the search is narrowed to a period (so the newest vacancies go first), the pagination
+    stops after the first page which consists of the known vacancies only.
+
+    The pages are cached by the normalized query once the scrape is complete. A concurrent
+    caller with the same query doesn't wait for the running scrape, but scrapes on its own.
+
+    :param jobs_list: a list with job titles like ['python junior', 'python developer']
+    :type jobs_list: list
+    :param stops_list: a list with stop words like ['Java', 'JavaScript', 'C++']
+    :type stops_list: list
+    :param search_period: the number of days to narrow the search to, or None
+    :type search_period: int or None
+    :param known_ids: hh.ru ids of the vacancies which have been seen already
+    :type known_ids: set or None
+    :param max_count: the number of the vacancies which is too many to collect
+    :type max_count: int
+
+    :return: a generator of tuples like ({'vacancy title': 'vacancy URL'}, vacancies count)
+    :rtype: generator
+    """
+    jobs_key, stops_key = normalize_query(jobs_list), normalize_query(stops_list)
+    cache_key = (jobs_key, stops_key, search_period, max_count)
+    early_stop = search_period is not None and bool(known_ids)
+
+    def is_known(page_vacancies):
+        return early_stop and len(page_vacancies) > 0 \
+            and all(get_vacancy_id(url) in known_ids for url in page_vacancies.values())
+
+    with scrape_cache.key_lock(cache_key, blocking=False) as acquired:
+        pages = scrape_cache.get(cache_key)
+        if pages is not None:
+            # The cached dictionaries are shared, so the caller gets its own copies.
+            for page_vacancies, vacancies_count in pages:
+                yield dict(page_vacancies), vacancies_count
+                if is_known(page_vacancies):
+                    return
+            return
+
+        # The caller which has taken the lock scrapes the query and caches the pages.
+        # A concurrent caller with the same query doesn't wait for it: it would block
+        # a scrape thread until the first caller had consumed all the pages, and with all
+        # the threads blocked so, nobody could consume them. It scrapes on its own instead,
+        # without caching the pages.
+        if parser_engine == 'http':
+            engine_pages = iter_hh_http_pages(list(jobs_key), list(stops_key), search_period,
+                                              max_count=max_count)
+        else:
+            engine_pages = iter_hh_pages(list(jobs_key), list(stops_key), search_period,
+                                         max_count=max_count)
+        pages = []
+        try:
+            for page_vacancies, vacancies_count in engine_pages:
+                if acquired:
+                    pages.append((page_vacancies, vacancies_count))
+                yield dict(page_vacancies), vacancies_count
+                # The rest of the pages are older, so they are known as well.
+                if is_known(page_vacancies):
+                    return
+        finally:
+            engine_pages.close()
+        # Only the complete scrapes are cached, since a scrape which has been stopped early
+        # is incomplete for anybody else.
+        if acquired:
+            scrape_cache.set(cache_key, pages)
+
+
+def normalize_query(data_list):
+    """Brings a list of job names or stop words to a canonical form: lowercased, stripped,
+    deduplicated and sorted, so that equivalent queries look the same.
+
+    :param data_list: a list like ['Python developer', ' python developer', 'Django']
+    :type data_list: list
+
+    :return: a tuple like ('django', 'python developer')
+    :rtype: tuple
+    """
+    return tuple(sorted({data_element.strip().lower() for data_element in data_list
+                         if data_element.strip()}))
 
-    # Submitting search request.
-    search_input.submit()
 
-    # If there are too many vacancies, it is better to tell the user about it and ask to
-    # add make the search pattern more specific by adding more stop words.
-    vacancies_count_raw = browser.find_element(By.CSS_SELECTOR,
-                                               '[data-qa="vacancies-search-header"] > h1')
-    vacancies_count = int(''.join(re.findall(r'(\d+)', vacancies_count_raw.text)))
+def pack_vacancies(vacancies_list, max_length=max_message_length):
+    """Packs the vacancies into as few messages as possible, each of them being
+    no longer than max_length characters.
+
+    :param vacancies_list: tuples like (vacancy_id, vacancy_url, vacancy_name)
+    :type vacancies_list: list
+    :param max_length: the maximum length of a message
+    :type max_length: int
+
+    :return: tuples like ([vacancy_id, ...], message_text), one per message
+    :rtype: list
+    """
+    messages = []
+    message_ids, message_entries, message_length = [], [], 0
+    for vacancy_id, vacancy_url, vacancy_name in vacancies_list:
+        entry = f'{vacancy_name}\n{vacancy_url}'
+        # A single vacancy never takes more than a message, even with an absurdly long name.
+        if len(entry) > max_length:
+            entry = f'{vacancy_name[:max_length - len(vacancy_url) - 2]}…\n{vacancy_url}'
+        # The entries are separated by an empty line.
+        if message_entries and message_length + 2 + len(entry) > max_length:
+            messages.append((message_ids, '\n\n'.join(message_entries)))
+            message_ids, message_entries, message_length = [], [], 0
+        message_length += len(entry) + (2 if message_entries else 0)
+        message_ids.append(vacancy_id)
+        message_entries.append(entry)
+    if message_entries:
+        messages.append((message_ids, '\n\n'.join(message_entries)))
+    return messages
+
+
+def parse_browser_page(browser):
+    """Parses the page with search results the browser is on.
+
+    :param browser: a browser checked out of the pool
+    :type browser: selenium.webdriver.Chrome
+
+    :return: a tuple like ({'vacancy title': 'vacancy URL'}, next page URL, the number
+             of the vacancies on the page); the next page URL is None if the page is the last
+             one. The number may be greater than the dictionary's length
+             (see parse_results_page()).
+    :rtype: tuple
+    """
+    with metrics.scrape_stage_seconds.time(engine='selenium', stage='parse'):
+        page_vacancies = dict()
+        vacancies = browser.find_elements(By.CSS_SELECTOR, '[data-qa="serp-item__title"]')
+        for vacancy in vacancies:
+            page_vacancies[vacancy.text] = strip_vacancy_url(vacancy.get_attribute('href'))
+        # Checking if there is more than 1 page with search results.
+        next_page = browser.find_elements(By.CSS_SELECTOR, '[data-qa="pager-next"]')
+        next_page_url = next_page[0].get_attribute('href') if len(next_page) == 1 else None
+    metrics.scrape_pages_total.inc(engine='selenium')
+    return page_vacancies, next_page_url, len(vacancies)
+
+
+def parse_results_page(page_html, page_url):
+    """Parses a page with search results.
+
+    :param page_html: the HTML code of the page
+    :type page_html: str or bytes
+    :param page_url: the URL of the page, which relative links are resolved against
+    :type page_url: str
+
+    :return: a tuple like ({'vacancy title': 'vacancy URL'}, vacancies count, next page URL,
+             the number of the vacancies on the page); the next page URL is None if the page
+             is the last one. The vacancies with the same title take a single entry
+             of the dictionary, so the number of the vacancies on the page may be greater.
+    :rtype: tuple
+    """
+    tree = html.fromstring(page_html)
+    header = tree.xpath('//*[@data-qa="vacancies-search-header"]/h1')
+    vacancies_count = parse_vacancies_count(header[0].text_content()) if header else 0
 
     vacancies_dict = dict()
+    vacancies = tree.xpath('//a[@data-qa="serp-item__title"]')
+    for vacancy in vacancies:
+        vacancy_name = ' '.join(vacancy.text_content().split())
+        vacancies_dict[vacancy_name] = strip_vacancy_url(urljoin(page_url, vacancy.get('href')))
 
-    if vacancies_count < 200:
-        # Creating a dictionary like {'vacancy title': 'vacancy URL'}
-        # and filling it up with the search results. If there are too many vacancies,
-        # we skip this step since it takes too much time.
-        while True:
-            vacancies = browser.find_elements(By.CSS_SELECTOR, '[data-qa="serp-item__title"]')
-            for vacancy in vacancies:
-                vacancy_url = vacancy.get_attribute('href')
-                strip_position = vacancy_url.find('?')
-                vacancy_url = vacancy_url[:strip_position]  # removing the unnecessary part of the URL
-                vacancies_dict[vacancy.text] = vacancy_url
-            # Checking if there is more than 1 page with search results. If there are more pages,
-            # we are setting the next page number and going to the next loop.
-            next_page = browser.find_elements(By.CSS_SELECTOR, '[data-qa="pager-next"]')
-            if len(next_page) == 1:  # this means there are some more next pages
-                next_page = next_page[0].get_attribute('href')
-                browser.get(next_page)
-            else:
-                break
-
-    time.sleep(3)
-    browser.close()
-    return vacancies_dict, vacancies_count
+    next_page = tree.xpath('//a[@data-qa="pager-next"]/@href')
+    next_page_url = urljoin(page_url, next_page[0]) if next_page else None
+    return vacancies_dict, vacancies_count, next_page_url, len(vacancies)
+
+
+def parse_vacancies_count(header_text):
+    """Extracts the number of vacancies found from a header like 'Найдено 1 234 вакансии'.
+
+    :param header_text: the text of the search results header
+    :type header_text: str
+
+    :return: the number of vacancies found
+    :rtype: int
+    """
+    return int(''.join(re.findall(r'(\d+)', header_text)))
+
+
+def percentile(values, share):
+    """Returns the percentile of the values using the nearest-rank method.
+
+    :param values: a list of numbers
+    :type values: list
+    :param share: the percentile, like 50 or 99
+    :type share: int or float
+
+    :return: the percentile, or 0 if there are no values
+    :rtype: int or float
+    """
+    if not values:
+        return 0
+    sorted_values = sorted(values)
+    rank = max(1, -(-len(sorted_values) * share // 100))  # rounding up
+    return sorted_values[int(rank) - 1]
+
+
+def search_period_since(checked_at):
+    """Picks the shortest period hh.ru can narrow the search to which covers the time
+    since the last check.
+
+    :param checked_at: the time of the last check, or None if there hasn't been any
+    :type checked_at: datetime.datetime or None
+
+    :return: the number of days (one of search_periods), or None if the search can't be narrowed
+    :rtype: int or None
+    """
+    if checked_at is None:
+        return None
+    days_passed = (datetime.datetime.now() - checked_at) / datetime.timedelta(days=1)
+    for search_period in search_periods:
+        if days_passed < search_period:
+            return search_period
+    return None
+
+
+def strip_vacancy_url(vacancy_url):
+    """Removes the unnecessary part (the query string) of the vacancy's URL.
+
+    :param vacancy_url: a URL like 'https://spb.hh.ru/vacancy/123?query=python'
+    :type vacancy_url: str
+
+    :return: a URL like 'https://spb.hh.ru/vacancy/123'
+    :rtype: str
+    """
+    return vacancy_url.split('?')[0]